@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the token chunker against the CharacterTextSplitter it replaced.
+
+Run from the project root:
+    python benchmarks/bench_chunker.py --pages 10000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.docstore.document import Document
+from framework.chunker import TokenTextChunker
+from framework.utilities import get_token_encoder
+
+
+WORDS = ("agreement employee union clause schedule overtime premium holiday seniority wage rate "
+         "section article shall provided hours week period temporary regular seasonal part-time").split()
+
+
+def make_corpus(pages, seed=42):
+    rng = random.Random(seed)
+    corpus = list()
+    for page_num in range(1, pages + 1):
+        paragraphs = list()
+        for _ in range(rng.randint(4, 10)):
+            sentences = [" ".join(rng.choices(WORDS, k=rng.randint(6, 24))).capitalize() + "."
+                         for _ in range(rng.randint(2, 6))]
+            paragraphs.append(" ".join(sentences))
+        corpus.append(Document(page_content="\n".join(paragraphs), metadata={"source": "bench.pdf", "page": page_num}))
+    return corpus
+
+
+def token_stats(chunks):
+    encoder = get_token_encoder()
+    counts = [len(encoder.encode(chunk.page_content, disallowed_special=())) for chunk in chunks]
+    return sum(counts) / len(counts), max(counts)
+
+
+def run(name, splitter, corpus):
+    start_time = time.perf_counter()
+    chunks = list()
+    for page in corpus:
+        chunks.extend(splitter.split_documents([page]))
+    elapsed_time = time.perf_counter() - start_time
+    mean_tokens, max_tokens = token_stats(chunks)
+    print(f"{name:<24} {elapsed_time:>8.2f}s {len(corpus) / elapsed_time:>10.0f} pages/s "
+          f"{len(chunks):>9} chunks {mean_tokens:>8.1f} mean tokens {max_tokens:>6} max tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--chunk-tokens", type=int, default=128)
+    parser.add_argument("--chunk-chars", type=int, default=500)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.pages)
+    print(f"Corpus: {len(corpus)} pages, {sum(len(p.page_content) for p in corpus)} characters")
+
+    # Load the encoder before timing
+    get_token_encoder()
+
+    run("CharacterTextSplitter", CharacterTextSplitter(
+        separator="\n", chunk_size=args.chunk_chars, chunk_overlap=args.chunk_chars // 4, length_function=len), corpus)
+    run("TokenTextChunker", TokenTextChunker(
+        chunk_tokens=args.chunk_tokens, overlap_tokens=args.chunk_tokens // 4), corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Hit rate and latency of hybrid BM25 + vector retrieval against pure vector retrieval.
+
+Run from the project root against exported chunks and labelled queries (JSONL files):
+    python benchmarks/bench_hybrid_retrieval.py --corpus ./Data/chunks.jsonl --queries ./Data/queries.jsonl
+where every corpus line is {"text": ..., "vector": [...]} and every query line is
+{"query": ..., "vector": [...], "expected": <line number of the relevant chunk>}.
+Without files a synthetic corpus is used: chunks of the same topic share their embedding direction
+and only differ by the identifier they mention, which is what pure vector retrieval misses.
+Embedding the query costs the same in both modes and is not part of the latencies.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framework.bm25 import BM25Index, reciprocal_rank_fusion
+
+
+def load_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_corpus(topics, chunks_per_topic, dimensions, seed=42):
+    rng = np.random.default_rng(seed)
+    words = [f"term{idx}" for idx in range(topics * 8)]
+    centers = rng.normal(size=(topics, dimensions)).astype(np.float32)
+
+    texts, vectors, queries, query_vectors, expected = list(), list(), list(), list(), list()
+    for topic in range(topics):
+        topic_words = words[topic * 8:(topic + 1) * 8]
+        for idx in range(chunks_per_topic):
+            identifier = [f"clause {topic}.{idx}.{rng.integers(1, 9)}", f"SKU-{rng.integers(10000, 99999)}",
+                          f"error 0x{rng.integers(0, 2 ** 31):08X}"][idx % 3]
+            body = " ".join(rng.choice(topic_words, size=40))
+            texts.append(f"{body} see {identifier} for the details {body[:80]}")
+            vectors.append(centers[topic] + 0.3 * rng.normal(size=dimensions))
+            if rng.random() < 0.2:
+                queries.append(f"what does {identifier} say about {rng.choice(topic_words)}")
+                query_vectors.append(centers[topic] + 0.3 * rng.normal(size=dimensions))
+                expected.append(len(texts) - 1)
+
+    vectors = np.array(vectors, dtype=np.float32)
+    query_vectors = np.array(query_vectors, dtype=np.float32)
+    return texts, vectors, queries, query_vectors, expected
+
+
+def evaluate(name, search, queries, query_vectors, expected, k):
+    latencies = list()
+    hits = 0
+    for query, query_vector, target in zip(queries, query_vectors, expected):
+        start_time = time.perf_counter()
+        ids = search(query, query_vector)
+        latencies.append(time.perf_counter() - start_time)
+        hits += target in ids[:k]
+
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<8} hit@{k}={hits / len(queries):.3f}  "
+          f"p50={np.percentile(latencies, 50):.2f} ms  p95={np.percentile(latencies, 95):.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="JSONL of chunks with their vectors")
+    parser.add_argument("--queries", help="JSONL of labelled queries with their vectors")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--chunks-per-topic", type=int, default=50)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--rrf-k", type=int, default=60)
+    args = parser.parse_args()
+
+    if args.corpus and args.queries:
+        corpus, labelled = load_jsonl(args.corpus), load_jsonl(args.queries)
+        texts = [row["text"] for row in corpus]
+        vectors = np.array([row["vector"] for row in corpus], dtype=np.float32)
+        queries = [row["query"] for row in labelled]
+        query_vectors = np.array([row["vector"] for row in labelled], dtype=np.float32)
+        expected = [row["expected"] for row in labelled]
+    else:
+        texts, vectors, queries, query_vectors, expected = make_corpus(args.topics, args.chunks_per_topic, args.dimensions)
+
+    start_time = time.perf_counter()
+    bm25 = BM25Index(texts)
+    print(f"{len(texts)} chunks, {len(queries)} queries, BM25 index built in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+
+    def vector_search(query, query_vector, k=args.k):
+        _, ids = index.search(query_vector[None, :], k)
+        return ids[0].tolist()
+
+    def hybrid_search(query, query_vector):
+        vector_ids = vector_search(query, query_vector, args.fetch_k)
+        keyword_ids = [idx for idx, _ in bm25.search(query, args.fetch_k)]
+        return [idx for idx, _ in reciprocal_rank_fusion([vector_ids, keyword_ids], k=args.rrf_k)]
+
+    evaluate("vector", vector_search, queries, query_vectors, expected, args.k)
+    evaluate("hybrid", hybrid_search, queries, query_vectors, expected, args.k)
+
+
+if __name__ == "__main__":
+    main()
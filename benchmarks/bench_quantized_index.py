@@ -0,0 +1,87 @@
+"""
+Recall, memory and latency of the compressed local vector index modes.
+
+Run from the project root against exported embeddings (float32 .npy, one row per chunk):
+    python benchmarks/bench_quantized_index.py --vectors ./Data/chunk_vectors.npy
+or against a synthetic clustered corpus:
+    python benchmarks/bench_quantized_index.py --synthetic 200000
+"""
+import os
+import sys
+import time
+import argparse
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framework.local_vector_store import create_faiss_index, exact_rescore
+
+
+def make_vectors(count, dimensions, clusters=256, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)] + 0.35 * rng.normal(size=(count, dimensions)).astype(np.float32)
+    # Embedding models return unit length vectors
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ground_truth(vectors, queries, k, block=4096):
+    # Exact L2 neighbours; for unit vectors this is the cosine ranking
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        q = queries[start:start + block]
+        distances = (q ** 2).sum(axis=1)[:, None] - 2 * q @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+        ids[start:start + block] = np.argsort(distances, axis=1)[:, :k]
+    return ids
+
+
+def evaluate(name, index, vectors, queries, truth, k, rescore_factor=0):
+    latencies = list()
+    found = 0
+    for query, expected in zip(queries, truth):
+        start_time = time.perf_counter()
+        _, ids = index.search(query[None, :], k * max(rescore_factor, 1))
+        ids = ids[0]
+        if rescore_factor > 0:
+            ids, _ = exact_rescore(query, ids, vectors, k)
+        latencies.append(time.perf_counter() - start_time)
+        found += len(set(ids[:k].tolist()) & set(expected.tolist()))
+
+    memory_mb = len(faiss.serialize_index(index)) / (1024 * 1024)
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<18} recall@{k}={found / truth.size:.3f}  index={memory_mb:>9.1f} MB  "
+          f"p50={np.percentile(latencies, 50):.2f} ms  p95={np.percentile(latencies, 95):.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", help="Path of a float32 .npy matrix of exported embeddings")
+    parser.add_argument("--synthetic", type=int, default=50000, help="Number of synthetic vectors when --vectors is not given")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r").astype(np.float32)
+    else:
+        vectors = make_vectors(args.synthetic, args.dimensions)
+
+    rng = np.random.default_rng(7)
+    queries = vectors[rng.choice(len(vectors), size=args.queries, replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    truth = ground_truth(vectors, queries, args.k)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries, "
+          f"float32 payload {vectors.nbytes / (1024 * 1024):.1f} MB")
+
+    for mode in ("flat", "fp16", "int8", "pq"):
+        index = create_faiss_index(vectors, mode)
+        evaluate(mode, index, vectors, queries, truth, args.k)
+        if mode != "flat" and args.rescore_factor > 0:
+            evaluate(f"{mode}+rescore", index, vectors, queries, truth, args.k, args.rescore_factor)
+
+
+if __name__ == "__main__":
+    main()
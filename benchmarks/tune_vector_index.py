@@ -0,0 +1,260 @@
+"""
+Recall@k against p50/p95 latency of the vector index settings of Mongo vCore and Cosmos NoSQL.
+
+Exact ground truth is computed with NumPy over an exported vector set, then every index setting of
+the sweep is built and queried, and one CSV row per setting is written. Export the vectors of a
+collection first (float32 .npy, one row per document):
+    python benchmarks/tune_vector_index.py --export ./Data/frame_vectors.npy --collection CC_VideoAssetFrames --attr summary_vector
+Sweep offline, with FAISS standing in for the service indexes (no credentials needed, used in CI):
+    python benchmarks/tune_vector_index.py --vectors ./Data/frame_vectors.npy --target offline --csv tuning.csv
+or against a synthetic clustered set with --synthetic 20000. Sweep the service itself:
+    python benchmarks/tune_vector_index.py --vectors ./Data/frame_vectors.npy --target mongo
+    python benchmarks/tune_vector_index.py --vectors ./Data/frame_vectors.npy --target cosmos-nosql
+The service targets load the vectors into scratch collections / containers suffixed `_tuning`.
+The offline HNSW and IVF indexes take the same parameters as the vCore `vector-hnsw` and `vector-ivf`
+indexes; quantizedFlat is approximated by 8 bit scalar quantization and diskANN by HNSW. Settings
+found here go to MONGO_HNSW_M, MONGO_HNSW_EF_CONSTRUCTION, MONGO_HNSW_EF_SEARCH and COSMOS_VECTOR_INDEX_TYPE.
+"""
+import os
+import sys
+import csv
+import time
+import argparse
+import itertools
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_vectors(count, dimensions, clusters=256, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    return centers[rng.integers(0, clusters, size=count)] + 0.35 * rng.normal(size=(count, dimensions)).astype(np.float32)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def ground_truth(vectors, queries, k, block=1024):
+    # Exact cosine neighbours, brute force
+    vectors, queries = normalize(vectors), normalize(queries)
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        ids[start:start + block] = np.take_along_axis(top, order, axis=1)
+    return ids
+
+
+def measure(search, queries, truth, k):
+    """ recall@k, p50 and p95 latency (ms) of `search(query_vector, k) -> ids` """
+    latencies = list()
+    found = 0
+    for query, expected in zip(queries, truth):
+        start_time = time.perf_counter()
+        ids = search(query, k)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        found += len(set(int(idx) for idx in ids[:k]) & set(expected.tolist()))
+    return found / truth.size, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def parse_values(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+# Offline stand-ins
+
+def offline_sweep(vectors, args):
+    import faiss
+
+    vectors = normalize(vectors).astype(np.float32)
+    dimensions = vectors.shape[1]
+
+    def faiss_search(index):
+        def search(query, k):
+            _, ids = index.search(query[None, :].astype(np.float32), k)
+            return ids[0]
+        return search
+
+    for m, ef_construction in itertools.product(args.m, args.ef_construction):
+        start_time = time.perf_counter()
+        index = faiss.IndexHNSWFlat(dimensions, m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.add(vectors)
+        build_s = time.perf_counter() - start_time
+        for ef_search in args.ef_search:
+            index.hnsw.efSearch = ef_search
+            yield "vector-hnsw", f"m={m} efConstruction={ef_construction} efSearch={ef_search}", build_s, faiss_search(index)
+
+    for num_lists in args.num_lists:
+        start_time = time.perf_counter()
+        quantizer = faiss.IndexFlatIP(dimensions)
+        index = faiss.IndexIVFFlat(quantizer, dimensions, num_lists, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        build_s = time.perf_counter() - start_time
+        for n_probes in args.n_probes:
+            if n_probes > num_lists:
+                continue
+            index.nprobe = n_probes
+            yield "vector-ivf", f"numLists={num_lists} nProbes={n_probes}", build_s, faiss_search(index)
+
+    stand_ins = {
+        "flat": lambda: faiss.IndexFlatIP(dimensions),
+        "quantizedFlat": lambda: faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT),
+        "diskANN": lambda: faiss.IndexHNSWFlat(dimensions, 32, faiss.METRIC_INNER_PRODUCT),
+    }
+    for index_type in args.index_types:
+        start_time = time.perf_counter()
+        index = stand_ins[index_type]()
+        index.train(vectors)
+        index.add(vectors)
+        yield "cosmos-nosql", f"type={index_type}", time.perf_counter() - start_time, faiss_search(index)
+
+
+# Service targets
+
+def mongo_sweep(vectors, args):
+    from framework.cosmos_mongo_util import CosmosMongoClient
+
+    client = CosmosMongoClient(os.environ["MONGODB_CONNECTION_STRING"], args.database)
+    collection_name = f"{args.collection}_tuning"
+    collection = client.get_collection(collection_name)
+    collection.drop()
+    client.insert(collection_name, [{"_id": idx, "vector": vector.tolist()} for idx, vector in enumerate(vectors)])
+
+    def mongo_search(ef_search=None, n_probes=None):
+        def search(query, k):
+            result = client.perform_vector_search(collection_name, "vector", None, projection=["_id"], limit=k,
+                                                  vector=query.tolist(), ef_search=ef_search, n_probes=n_probes)
+            return [item.document["_id"] for item in result]
+        return search
+
+    def build(**options):
+        collection.drop_indexes()
+        start_time = time.perf_counter()
+        client.create_vector_index(collection_name, "vector", "TuningVectorIndex", dimensions=vectors.shape[1], **options)
+        return time.perf_counter() - start_time
+
+    try:
+        for m, ef_construction in itertools.product(args.m, args.ef_construction):
+            build_s = build(type="vector-hnsw", m=m, ef_construction=ef_construction)
+            for ef_search in args.ef_search:
+                yield "vector-hnsw", f"m={m} efConstruction={ef_construction} efSearch={ef_search}", build_s, mongo_search(ef_search=ef_search)
+        for num_lists in args.num_lists:
+            build_s = build(type="vector-ivf", num_lists=num_lists)
+            for n_probes in args.n_probes:
+                if n_probes <= num_lists:
+                    yield "vector-ivf", f"numLists={num_lists} nProbes={n_probes}", build_s, mongo_search(n_probes=n_probes)
+    finally:
+        collection.drop()
+        client.close_connection()
+
+
+def cosmos_nosql_sweep(vectors, args):
+    from framework.cosmos_util import CosmosUtil
+
+    util = CosmosUtil(database=os.environ["AZURE_COSMOS_DATABASE_NAME"])
+    for index_type in args.index_types:
+        container_name = f"{args.collection}_tuning_{index_type}"
+        start_time = time.perf_counter()
+        # The vector embedding policy of the containers is created for 1536 dimensions
+        util.create_container_with_vectors(container_name, "/pk", ["/vector"], vector_index_type=index_type)
+        for idx, vector in enumerate(vectors):
+            util.container_map[container_name].upsert_item({"id": str(idx), "pk": str(idx % 16), "vector": vector.tolist()})
+        build_s = time.perf_counter() - start_time
+
+        def search(query, k, container_name=container_name):
+            result = util.perform_vector_search(container_name, None, "vector", projection=["id"], limit=k, vector=query.tolist())
+            return [int(item.document["id"]) for item in result]
+
+        try:
+            yield "cosmos-nosql", f"type={index_type}", build_s, search
+        finally:
+            util.database_client.delete_container(container_name)
+
+
+def export_vectors(args):
+    from framework.cosmos_mongo_util import CosmosMongoClient
+
+    client = CosmosMongoClient(os.environ["MONGODB_CONNECTION_STRING"], args.database)
+    cursor = client.get_collection(args.collection).find({args.attr: {"$exists": True}}, {args.attr: 1, "_id": 0})
+    vectors = np.array([item[args.attr] for item in cursor], dtype=np.float32)
+    np.save(args.export, vectors)
+    client.close_connection()
+    print(f"Exported {len(vectors)} vectors of {vectors.shape[1]} dimensions to {args.export}")
+
+
+def pareto_front(rows, latency_key):
+    # Settings for which no other setting has both a higher recall and a lower latency
+    front = list()
+    for row in sorted(rows, key=lambda row: (row[latency_key], -row["recall"])):
+        if not front or row["recall"] > front[-1]["recall"]:
+            front.append(row)
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", help="Path of a float32 .npy matrix of exported embeddings")
+    parser.add_argument("--synthetic", type=int, default=20000, help="Number of synthetic vectors when --vectors is not given")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--export", help="Export the vectors of --collection / --attr from Mongo vCore to this .npy path and exit")
+    parser.add_argument("--database", default="ClipCognition")
+    parser.add_argument("--collection", default="CC_VideoAssetFrames")
+    parser.add_argument("--attr", default="summary_vector")
+    parser.add_argument("--target", choices=["offline", "mongo", "cosmos-nosql"], default="offline")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=parse_values, default=[16, 32, 64])
+    parser.add_argument("--ef-construction", type=parse_values, default=[64, 128, 256])
+    parser.add_argument("--ef-search", type=parse_values, default=[10, 20, 40, 80, 160])
+    parser.add_argument("--num-lists", type=parse_values, default=[1, 16, 64])
+    parser.add_argument("--n-probes", type=parse_values, default=[1, 4, 16])
+    parser.add_argument("--index-types", type=lambda text: text.split(","), default=["flat", "quantizedFlat", "diskANN"])
+    parser.add_argument("--csv", default="vector_index_tuning.csv")
+    args = parser.parse_args()
+
+    if args.export:
+        export_vectors(args)
+        return
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = make_vectors(args.synthetic, args.dimensions)
+
+    # Queries are perturbed corpus vectors, like questions close to stored summaries
+    rng = np.random.default_rng(7)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = normalize(queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32))
+    start_time = time.perf_counter()
+    truth = ground_truth(vectors, queries, args.k)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries, "
+          f"ground truth in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    sweep = {"offline": offline_sweep, "mongo": mongo_sweep, "cosmos-nosql": cosmos_nosql_sweep}[args.target]
+    rows = list()
+    for index_kind, setting, build_s, search in sweep(vectors, args):
+        recall, p50, p95 = measure(search, queries, truth, args.k)
+        rows.append({"target": args.target, "index": index_kind, "setting": setting, "recall": round(recall, 4),
+                     "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "build_s": round(build_s, 2)})
+        print(f"{index_kind:<13} {setting:<42} recall@{args.k}={recall:.3f}  p50={p50:.2f} ms  p95={p95:.2f} ms  build={build_s:.1f} s")
+
+    with open(args.csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {len(rows)} settings to {args.csv}")
+
+    for latency_key in ("p50_ms", "p95_ms"):
+        print(f"Recall / {latency_key} front:")
+        for row in pareto_front(rows, latency_key):
+            print(f"  {row['index']:<13} {row['setting']:<42} recall@{args.k}={row['recall']:.3f}  {latency_key}={row[latency_key]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+from .ingestion_manifest import get_index_version
+from .query_cache import get_query_vector_cache
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class _ScopeEntries:
+
+    def __init__(self) -> None:
+        self.version = None
+        self.questions: List[str] = list()
+        self.vectors: List[np.ndarray] = list()
+        self.payloads: List[dict] = list()
+        self.created_at: List[float] = list()
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        return self._matrix
+
+    def append(self, question, vector, payload, max_entries):
+        self.questions.append(question)
+        self.vectors.append(vector)
+        self.payloads.append(payload)
+        self.created_at.append(time.monotonic())
+        if len(self.questions) > max_entries:
+            del self.questions[0], self.vectors[0], self.payloads[0], self.created_at[0]
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of RAG answers keyed by scope (index name plus persona) and question embedding.
+
+    A lookup is a hit when the cosine similarity between the question and a cached question of the
+    same scope reaches `threshold`, the entry is younger than `ttl_seconds` and the index version
+    has not changed since the answer was stored. A new index version drops the scope's entries.
+    """
+
+    def __init__(self, threshold=None, ttl_seconds=None, max_entries=None) -> None:
+        self.threshold = threshold or _env_float("ANSWER_CACHE_THRESHOLD", 0.95)
+        self.ttl_seconds = ttl_seconds or _env_int("ANSWER_CACHE_TTL", 86400)
+        self.max_entries = max_entries or _env_int("ANSWER_CACHE_SIZE", 1000)
+        self.hits = 0
+        self.misses = 0
+        self._scopes: Dict[str, _ScopeEntries] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _entries(self, scope: str, version: str) -> _ScopeEntries:
+        entries = self._scopes.get(scope)
+        if entries is None or entries.version != version:
+            if entries is not None:
+                print(f"Answer cache [{scope}] index changed, dropping {len(entries.questions)} answers")
+            entries = _ScopeEntries()
+            entries.version = version
+            self._scopes[scope] = entries
+        return entries
+
+    def lookup(self, scope: str, question: str, vector, version: str) -> Optional[Tuple[dict, float]]:
+        query = self._normalize(vector)
+        with self._lock:
+            entries = self._entries(scope, version)
+            if entries.questions:
+                similarities = entries.matrix() @ query
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                fresh = time.monotonic() - entries.created_at[best] <= self.ttl_seconds
+                if similarity >= self.threshold and fresh:
+                    self.hits += 1
+                    # Logged on every hit so false hits can be audited
+                    print(f"Answer cache hit [{scope}] similarity={similarity:.4f} "
+                          f"question={question!r} cached_question={entries.questions[best]!r}")
+                    return entries.payloads[best], similarity
+            self.misses += 1
+            return None
+
+    def store(self, scope: str, question: str, vector, version: str, payload: dict) -> None:
+        with self._lock:
+            self._entries(scope, version).append(question, self._normalize(vector), payload, self.max_entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(entries.questions) for entries in self._scopes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
+
+
+def _index_name(vector_store) -> Optional[str]:
+    # LangChain's AzureSearch keeps the name in `_index_name` (and on its SearchClient)
+    for owner in (vector_store, getattr(vector_store, "client", None)):
+        for attr in ("index_name", "_index_name"):
+            index_name = getattr(owner, attr, None)
+            if isinstance(index_name, str) and index_name:
+                return index_name
+    return None
+
+
+def chain_identity(kind: str, prompt=None, deployment_name: str = None, **params) -> str:
+    """
+    Part of the cache scope that identifies the chain answering: its kind, prompt template, deployment
+    and retrieval parameters. Chains on the same index only share answers when all of them match.
+    """
+    template = None
+    if prompt is not None:
+        template = prompt.pretty_repr() if hasattr(prompt, "pretty_repr") else str(prompt)
+    payload = json.dumps({"kind": kind, "prompt": template, "deployment": deployment_name, **params}, sort_keys=True, default=str)
+    return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+def describe_vector_store(vector_store, index_name: str = None) -> Tuple[Optional[str], Optional[Callable[[], str]]]:
+    """
+    Cache scope of a vector store (or fan-out retriever) and a callable returning its current version.
+    (None, None) when the store cannot be identified, answers of such a store are not cached.
+    """
+    index_names = getattr(vector_store, "index_names", None)
+    if index_names and index_name is None:
+        index_names = sorted(index_names)
+        return "+".join(index_names), lambda: "+".join(get_index_version(index_name) for index_name in index_names)
+    index_name = index_name or _index_name(vector_store)
+    if index_name:
+        return index_name, lambda: get_index_version(index_name)
+    # Local stores are content addressed, a changed corpus gets a different key
+    store_key = getattr(vector_store, "store_key", None)
+    if store_key:
+        return store_key, lambda: "static"
+    print(f"Answer cache disabled, no index name or store key on {type(vector_store).__name__}")
+    return None, None
+
+
+class CachedAnswerChain:
+    """
+    Serves answers of a RAG chain from the semantic answer cache and stores the answers of misses.
+
+    With a conversation memory only the first question of a conversation is cached, since follow-up
+    questions are rewritten from the chat history; a hit is still written to the memory.
+    """
+
+    def __init__(self, chain, vector_store, embed_query: Callable, model_name: str, memory=None, cache=None,
+                 index_name: str = None, chain_id: str = None) -> None:
+        self.chain = chain
+        self.embed_query = embed_query
+        self.model_name = model_name
+        self.memory = memory
+        self.cache = cache or get_answer_cache()
+        self.scope, self.version = describe_vector_store(vector_store, index_name)
+        if self.scope is not None and chain_id:
+            # The cache is process wide, chains with another prompt or deployment must not share answers
+            self.scope = f"{self.scope}|{chain_id}"
+
+    def invoke(self, inputs, config=None, **kwargs):
+        question = inputs["question"] if isinstance(inputs, dict) else inputs
+        if self.scope is None or (self.memory is not None and self.memory.chat_memory.messages):
+            return self.chain.invoke(inputs, config, **kwargs)
+
+        persona = inputs.get("persona") if isinstance(inputs, dict) else None
+        scope = f"{self.scope}|{persona}" if persona else self.scope
+        version = self.version()
+        vector = get_query_vector_cache().get_or_compute(self.model_name, question, self.embed_query)
+
+        hit = self.cache.lookup(scope, question, vector, version)
+        if hit is not None:
+            payload, _ = hit
+            if self.memory is None:
+                return dict(payload)
+            self.memory.save_context({"question": question}, {"answer": payload["answer"]})
+            return {"question": question, "chat_history": self.memory.chat_memory.messages, "answer": payload["answer"]}
+
+        response = self.chain.invoke(inputs, config, **kwargs)
+        self.cache.store(scope, question, vector, version, {key: response[key] for key in ("answer", "docs") if key in response})
+        return response
+
+    def __getattr__(self, name):
+        if name == "chain":
+            raise AttributeError(name)
+        return getattr(self.chain, name)
@@ -0,0 +1,192 @@
+import os
+import io
+import time
+import wave
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import numpy as np
+import imageio_ffmpeg
+
+
+# Whisper rejects uploads above 25 MB
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class AudioTrack:
+    """
+    Audio track of a video extracted under a work directory: the compressed copy at `mp3_path`, the
+    16-bit mono PCM samples at `pcm_path` and the loudness (dBFS) of every `window` samples in `levels`.
+    """
+
+    def __init__(self, mp3_path: str, pcm_path: str, sample_rate: int, samples: int, window: int, levels: np.ndarray) -> None:
+        self.mp3_path = mp3_path
+        self.pcm_path = pcm_path
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.window = window
+        self.levels = levels
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+    def read(self, start: int, end: int) -> bytes:
+        """ PCM bytes of the samples [start, end) """
+        with open(self.pcm_path, "rb") as f:
+            f.seek(start * 2)
+            return f.read((end - start) * 2)
+
+
+def _window_levels(block: np.ndarray, window: int) -> np.ndarray:
+    # int64 squares of the int16 samples, no float copy of the block
+    squares = np.square(block.reshape(-1, window), dtype=np.int64)
+    rms = np.sqrt(squares.mean(axis=1)) / 32768
+    return (20 * np.log10(rms + 1e-10)).astype(np.float32)
+
+
+def extract_audio(video_path: str, work_dir: str, bitrate: str = "32k", sample_rate: int = 16000,
+                  window_ms: int = 30) -> Optional[AudioTrack]:
+    """
+    Demuxes the first audio stream of a local video in a single ffmpeg pass: the mp3 kept in blob storage
+    is written under `work_dir` and the PCM used for transcription is streamed from ffmpeg's stdout,
+    block by block, into a file next to it while the level of every `window_ms` window is measured.
+    Only the levels are kept in memory. None when the video has no audio.
+    """
+    start_time = time.perf_counter()
+    mp3_path = os.path.join(work_dir, "audio.mp3")
+    pcm_path = os.path.join(work_dir, "audio.pcm")
+    window = sample_rate * window_ms // 1000
+    command = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-i", video_path,
+        "-map", "0:a:0", "-b:a", bitrate, mp3_path,
+        "-map", "0:a:0", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "pipe:1",
+    ]
+    levels = list()
+    samples = 0
+    # About one second of audio per read
+    block_bytes = window * 2 * max(1000 // window_ms, 1)
+    with open(os.path.join(work_dir, "ffmpeg.log"), "w+b") as log, open(pcm_path, "wb") as pcm:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log)
+        with process.stdout:
+            while data := process.stdout.read(block_bytes):
+                pcm.write(data)
+                block = np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+                # Only the last block can end with a partial window, its samples are not measured
+                full = len(block) - len(block) % window
+                if full:
+                    levels.append(_window_levels(block[:full], window))
+                samples += len(block)
+        returncode = process.wait()
+        if returncode != 0:
+            log.seek(0)
+            error = log.read().decode("utf-8", errors="replace")
+            if "matches no streams" in error:
+                return None
+            raise RuntimeError(f"Unable to extract the audio of {video_path}: {error}")
+
+    levels = np.concatenate(levels) if levels else np.zeros(0, dtype=np.float32)
+    track = AudioTrack(mp3_path, pcm_path, sample_rate, samples, window, levels)
+    print(f"Extracted {track.duration:.1f} s of audio in {time.perf_counter() - start_time:.1f} s")
+    return track
+
+
+class AudioTranscriber:
+    """
+    Transcribes long audio tracks with Whisper in segments.
+
+    The track is cut in silences: every cut is placed in the last window quieter than `silence_threshold`
+    (dBFS) between `min_seconds` and `max_seconds` after the previous cut, or in the quietest window of
+    that span when there is no silence. Segments are sent as WAV, `concurrency` at a time, and their
+    timestamped segments are shifted by the segment offset before the text is joined in order.
+    Silent segments are not sent at all.
+    """
+
+    def __init__(self, client, deployment_name: str, max_seconds: int = None, min_seconds: int = None,
+                 silence_threshold: float = None, concurrency: int = None) -> None:
+        self.client = client
+        self.deployment_name = deployment_name
+        self.max_seconds = max_seconds or _env_int("AUDIO_SEGMENT_MAX_SECONDS", 600)
+        self.min_seconds = min_seconds or _env_int("AUDIO_SEGMENT_MIN_SECONDS", 120)
+        if not 0 < self.min_seconds < self.max_seconds:
+            raise ValueError(f"The minimum segment length ({self.min_seconds} s) has to be positive and "
+                             f"below the maximum segment length ({self.max_seconds} s)")
+        self.silence_threshold = silence_threshold if silence_threshold is not None else _env_float("AUDIO_SILENCE_THRESHOLD_DB", -40.0)
+        self.concurrency = concurrency or _env_int("AUDIO_TRANSCRIBE_CONCURRENCY", 4)
+
+    def segments(self, track: AudioTrack) -> List[Tuple[int, int]]:
+        """ (start, end) sample bounds of the segments """
+        window = track.window
+        # A WAV segment has a 44 bytes header and 2 bytes per sample
+        max_samples = min(self.max_seconds * track.sample_rate, (MAX_UPLOAD_BYTES - 44) // 2)
+        max_window = max_samples // window
+        # The upload limit can lower the maximum below the configured minimum
+        min_window = min(self.min_seconds * track.sample_rate // window, max_window - 1)
+        levels = track.levels
+
+        bounds = list()
+        start = 0
+        while track.samples - start > max_samples:
+            first = start // window
+            span = levels[first + min_window:first + max_window]
+            silent = np.flatnonzero(span < self.silence_threshold)
+            best = int(silent[-1]) if len(silent) else int(np.argmin(span))
+            # Cut in the middle of the chosen window
+            cut = (first + min_window + best) * window + window // 2
+            bounds.append((start, cut))
+            start = cut
+        bounds.append((start, track.samples))
+        return bounds
+
+    def _wav(self, track: AudioTrack, start: int, end: int) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(track.sample_rate)
+            wav.writeframes(track.read(start, end))
+        return buffer.getvalue()
+
+    def _transcribe_segment(self, track: AudioTrack, index: int, start: int, end: int) -> Tuple[str, List[dict]]:
+        levels = track.levels[start // track.window:-(-end // track.window)]
+        if end <= start or not len(levels) or levels.max() < self.silence_threshold:
+            return "", []
+        transcription = self.client.audio.transcriptions.create(
+            model=self.deployment_name,
+            file=(f"segment_{index}.wav", self._wav(track, start, end)),
+            response_format="verbose_json",
+        )
+        offset = start / track.sample_rate
+        segments = list()
+        for segment in getattr(transcription, "segments", None) or []:
+            if not isinstance(segment, dict):
+                segment = segment.model_dump() if hasattr(segment, "model_dump") else vars(segment)
+            segments.append({
+                "start": round(segment["start"] + offset, 2),
+                "end": round(segment["end"] + offset, 2),
+                "text": segment["text"].strip(),
+            })
+        return transcription.text.strip(), segments
+
+    def transcribe(self, track: AudioTrack) -> Tuple[str, List[dict]]:
+        """ Transcription text of the whole track and its timestamped segments (seconds from the start) """
+        start_time = time.perf_counter()
+        bounds = self.segments(track)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(bounds)), thread_name_prefix="transcribe") as executor:
+            results = list(executor.map(lambda args: self._transcribe_segment(track, *args),
+                                        [(index, start, end) for index, (start, end) in enumerate(bounds)]))
+        text = " ".join(text for text, _ in results if text)
+        segments = [segment for _, chunk in results for segment in chunk]
+        print(f"Transcribed {track.duration:.1f} s of audio in {len(bounds)} segments "
+              f"in {time.perf_counter() - start_time:.1f} s")
+        return text, segments
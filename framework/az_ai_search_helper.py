@@ -25,6 +25,7 @@ from azure.search.documents.models import *
 from azure.search.documents.indexes.models import *
 
 from .cosmos_util import CosmosUtil
+from .paged_search import PagedVectorSearchResult, split_document
 
 
 # Load env settings if not already loaded
@@ -101,25 +102,38 @@ def get_az_search_indices():
     return names
 
 
+def build_odata_filter(filter) -> str:
+    """ OData filter of a dict of equality conditions, strings are passed through """
+    if filter is None or isinstance(filter, str):
+        return filter
+    conditions = list()
+    for key, value in filter.items():
+        if isinstance(value, bool):
+            conditions.append(f"{key} eq {str(value).lower()}")
+        elif isinstance(value, (int, float)):
+            conditions.append(f"{key} eq {value}")
+        else:
+            escaped = str(value).replace("'", "''")
+            conditions.append(f"{key} eq '{escaped}'")
+    return " and ".join(conditions)
+
+
 # Search for documents using vector search
-def perform_vector_search(client, vectorized_query, attr_name: str, projection=None):
-    
-    # Create a search index
-    vector_query = VectorizedQuery(vector=vectorized_query, k_nearest_neighbors=3, fields=attr_name)
-    print(f"Index Client: {client}")
-    results = client.search(  
-        search_text=None,  
-        vector_queries= [vector_query],
+def perform_vector_search(client, vectorized_query, attr_name: str, projection=None, k=3, limit=None, filter=None) -> PagedVectorSearchResult:
+    """
+    Top `k` nearest neighbours of the query vector, at most `limit` of them returned lazily.
+    The service pages the results; a page is only requested while the caller iterates.
+    """
+    limit = limit or k
+    vector_query = VectorizedQuery(vector=vectorized_query, k_nearest_neighbors=max(k, limit), fields=attr_name)
+    results = client.search(
+        search_text=None,
+        vector_queries=[vector_query],
         select=projection,
-    ) 
-    print(f"Results: {results}")
-    # results = [x for x in results]
-    for result in results:
-        print(f"Score: {result['@search.score']}")  
-        print(f"Result: {result}")  
-        print("..........................................")
-
-    return results
+        filter=build_odata_filter(filter),
+        top=limit,
+    )
+    return PagedVectorSearchResult(results.by_page(), lambda item: split_document(item, "@search.score"), limit=limit, name=getattr(client, "_index_name", attr_name))
 
 
 def get_index_fields(index_name, embedding_function):
@@ -202,6 +216,17 @@ def create_bing_search_agent():
     return bing_search
 
 
+def ensure_index_field(index_name, field):
+    # Fields can be added to an existing index without rebuilding it
+    index_client = get_az_search_index_client()
+    index = index_client.get_index(index_name)
+    if any(existing.name == field.name for existing in index.fields):
+        return
+    index.fields.append(field)
+    index_client.create_or_update_index(index)
+    print(f"Added field {field.name} to index {index_name}")
+
+
 def create_clip_cognition_indices():
     # Create Azure Search indices for Clip Cognition
     # Create the Azure Search index
@@ -281,6 +306,7 @@ def create_clip_cognition_indices():
         SimpleField(name="url", type=SearchFieldDataType.String),
         SimpleField(name="summary", type=SearchFieldDataType.String),
         SimpleField(name="frame_id", type=SearchFieldDataType.Int32),
+        SimpleField(name="timestamp", type=SearchFieldDataType.Double, filterable=True, sortable=True),
         SimpleField(name="created_at", type=SearchFieldDataType.String, filterable=True, sortable=True),
         
         SearchField(name="summary_vector", type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
@@ -0,0 +1,81 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+# Keeps identifiers such as "4.2.1", "SKU-1138" or "0x80070005" in one token
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/:]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """ Lower cased word tokens; compound identifiers are kept whole and also split into their parts """
+    tokens = list()
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(part for part in re.split(r"[.\-/:]", match) if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25.
+
+    Postings are kept as NumPy arrays of (document, term frequency) per term, so a query only
+    touches the documents that contain one of its terms.
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+
+        postings: Dict[str, List[Tuple[int, int]]] = dict()
+        doc_lengths = np.zeros(self.size, dtype=np.float32)
+        for doc_idx, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[doc_idx] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, list()).append((doc_idx, tf))
+
+        self.avg_doc_length = float(doc_lengths.mean()) if self.size else 0.0
+        # Length normalization of every document, precomputed once
+        self._norms = self.k1 * (1 - self.b + self.b * doc_lengths / max(self.avg_doc_length, 1e-9))
+        self._postings = {
+            term: (np.array([doc for doc, _ in entries], dtype=np.int64), np.array([tf for _, tf in entries], dtype=np.float32))
+            for term, entries in postings.items()
+        }
+
+    def idf(self, term: str) -> float:
+        entry = self._postings.get(term)
+        df = len(entry[0]) if entry is not None else 0
+        return math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """ Returns up to k (document index, score) pairs with a positive score, best first """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            entry = self._postings.get(term)
+            if entry is None:
+                continue
+            docs, tfs = entry
+            scores[docs] += query_tf * self.idf(term) * tfs * (self.k1 + 1) / (tfs + self._norms[docs])
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(idx), float(scores[idx])) for idx in candidates]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[Hashable, float]]:
+    """ Merges ranked lists of keys by sum(weight / (k + rank)), best first """
+    scores: Dict[Hashable, float] = dict()
+    for list_idx, ranking in enumerate(rankings):
+        weight = weights[list_idx] if weights else 1.0
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,82 @@
+from typing import Iterator, List, Tuple
+from langchain.docstore.document import Document
+
+from .utilities import get_token_encoder
+
+
+class TokenTextChunker:
+    """
+    Single pass chunker that sizes chunks in tokens of the embedding model.
+
+    The text is encoded once; chunks are cut as windows of at most `chunk_tokens` tokens with
+    `overlap_tokens` tokens shared between neighbours. The end of a window is moved back to the closest
+    line or sentence boundary found in its last `boundary_window` fraction, which bounds the extra
+    work per chunk and keeps the whole split linear in the size of the text.
+    """
+
+    def __init__(self, chunk_tokens=128, overlap_tokens=32, encoding_name="cl100k_base", boundary_window=0.2) -> None:
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError(f"Overlap ({overlap_tokens}) must be smaller than the chunk size ({chunk_tokens})")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding_name = encoding_name
+        self.boundary_window = boundary_window
+
+    def params(self) -> dict:
+        return {
+            "splitter": type(self).__name__,
+            "chunk_tokens": self.chunk_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "encoding": self.encoding_name,
+        }
+
+    @staticmethod
+    def _is_boundary(text: str, pos: int) -> bool:
+        if pos <= 0 or pos >= len(text):
+            return False
+        return text[pos - 1] == "\n" or text[pos] == "\n" or (text[pos - 1] in ".!?;" and text[pos].isspace())
+
+    def iter_chunks(self, text: str) -> Iterator[Tuple[str, int, int, int]]:
+        """ Yields (chunk text, start char, end char, token count) """
+        encoder = get_token_encoder(self.encoding_name)
+        tokens = encoder.encode(text, disallowed_special=())
+        if len(tokens) == 0:
+            return
+        text, offsets = encoder.decode_with_offsets(tokens)
+
+        token_count = len(tokens)
+        min_window = max(1, int(self.chunk_tokens * (1 - self.boundary_window)))
+        start = 0
+        while start < token_count:
+            end = min(start + self.chunk_tokens, token_count)
+            if end < token_count:
+                for candidate in range(end, start + min_window, -1):
+                    if self._is_boundary(text, offsets[candidate]):
+                        end = candidate
+                        break
+
+            start_char = offsets[start]
+            end_char = offsets[end] if end < token_count else len(text)
+            chunk = text[start_char:end_char]
+
+            # Report offsets of the stripped chunk so they map back onto the page text
+            stripped = chunk.strip()
+            if stripped:
+                start_char += len(chunk) - len(chunk.lstrip())
+                yield stripped, start_char, start_char + len(stripped), end - start
+
+            if end >= token_count:
+                break
+            start = max(end - self.overlap_tokens, start + 1)
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _, _, _ in self.iter_chunks(text)]
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks = list()
+        for document in documents:
+            for chunk, start_char, end_char, token_count in self.iter_chunks(document.page_content):
+                metadata = dict(document.metadata)
+                metadata.update(start_index=start_char, end_index=end_char, token_count=token_count)
+                chunks.append(Document(page_content=chunk, metadata=metadata))
+        return chunks
@@ -2,14 +2,30 @@ from enum import Enum
 from typing import List, Dict, Any
 from .schema import *
 from .text_loader import *
+from .paged_search import PagedVectorSearchResult
+from .fanout_search import fan_out_search, normalize_score, take
+
+
+# Vector store option that searches every VectorStoreType backend at once
+ALL_VECTOR_STORES = "All vector stores"
 
 
 class VectorSearchAgent:
+    """
+    Vector search over one of the supported stores.
+
+    perform_vector_search searches the `k` nearest neighbours of the query (embedded unless `vector`
+    is given) and returns at most `limit` of them as a lazy PagedVectorSearchResult of VectorSearchItem,
+    restricted to the `projection` fields and the equality conditions of `filter`.
+    """
+
     def __init__(self, vector_store_type: VectorStoreType, container_names: List[str]) -> None:
         self.vector_store_type = vector_store_type
         self.container_names = container_names
 
-    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, limit: int) -> VectorSearchResult:
+    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int,
+                              k: int = None, filter: dict = None, page_size: int = None,
+                              vector: List[float] = None) -> PagedVectorSearchResult:
         raise NotImplementedError
 
     def perform_search(self, collection_name: str, filter: dict, limit: int) -> List[Dict[str, Any]]:
@@ -23,12 +39,13 @@ class CosmosNoSQLVectorSearchAgent(VectorSearchAgent):
         super().__init__(VectorStoreType.CosmosNoSQL, container_names)
         self.client = create_cosmos_nosql_vector_search_agent(container_names=container_names)
 
-    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int) -> VectorSearchResult:
-        response = self.client.perform_vector_search(
-            collection_name, prompt=query, 
-            content_vector_field=attr_name, projection=projection , limit=limit)
-        
-        return response
+    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int,
+                              k: int = None, filter: dict = None, page_size: int = None,
+                              vector: List[float] = None) -> PagedVectorSearchResult:
+        return self.client.perform_vector_search(
+            collection_name, prompt=query,
+            content_vector_field=attr_name, projection=projection, limit=limit,
+            k=k, filter=filter, page_size=page_size, vector=vector)
     
     def perform_search(self, collection_name: str, filter: dict, limit: int) -> List[Dict[str, Any]]:
         _, items = self.client.query_items(collection_name, filter, limit)
@@ -41,9 +58,14 @@ class CosmosMongoVCoreVectorSearchAgent(VectorSearchAgent):
         super().__init__(VectorStoreType.CosmosMongoVCore, container_names)
         self.client = create_cosmos_mongo_vector_search_agent(container_names=container_names)
 
-    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int) -> VectorSearchResult:
-        response = self.client.perform_vector_search(collection_name, attr_name, prompt=query, projection=projection, limit=limit)
-        return response
+    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int,
+                              k: int = None, filter: dict = None, page_size: int = None,
+                              vector: List[float] = None) -> PagedVectorSearchResult:
+        # Mongo vCore filters use query operators
+        mongo_filter = {key: {"$eq": value} for key, value in filter.items()} if filter else None
+        return self.client.perform_vector_search(
+            collection_name, attr_name, prompt=query, projection=projection, limit=limit,
+            k=k, filter=mongo_filter, page_size=page_size, vector=vector)
     
     def perform_search(self, collection_name: str, filter: dict, limit: int) -> List[Dict[str, Any]]:
         response = self.client.find(collection_name, filter, limit)
@@ -58,20 +80,70 @@ class AISearchVectorSearchAgent(VectorSearchAgent):
         }
         super().__init__(VectorStoreType.AISearch, container_names=index_names)
         self.index_client_map = get_ai_search_index_clients(index_names=index_names)
-
-    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int) -> VectorSearchResult:
-        response = perform_vector_search(
-                            self.index_client_map[self.index_collection_map[collection_name]], 
-                            attr_name=attr_name,
-                            vectorized_query=query, 
-                            projection=projection 
-            )
-        return response
+        self.embedding_agent = QueryEmbeddingAgent(AzureOpenAIEmbeddingsAgent())
+
+    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int,
+                              k: int = None, filter: dict = None, page_size: int = None,
+                              vector: List[float] = None) -> PagedVectorSearchResult:
+        # AI Search sizes its result pages itself, page_size does not apply
+        return perform_vector_search(
+            self.index_client_map[self.index_collection_map[collection_name]],
+            attr_name=attr_name,
+            vectorized_query=vector if vector is not None else self.embedding_agent.get_text_embeddings(query),
+            projection=projection,
+            k=max(k or limit, limit),
+            limit=limit,
+            filter=filter,
+        )
     
     def perform_search(self, collection_name: str, filter: dict, limit: int) -> List[Dict[str, Any]]:
         pass
 
 
+class FanOutVectorSearchAgent(VectorSearchAgent):
+    """
+    Searches every backend concurrently with a single embedding of the query and merges the results
+    into one top `limit` on the normalized cosine score. A backend slower than FANOUT_SEARCH_TIMEOUT
+    only drops out of the result.
+    """
+
+    def __init__(self, agents: List[VectorSearchAgent]) -> None:
+        super().__init__(None, container_names=["CC_VideoAssetFrames", "CC_VideoAssets"])
+        self.agents = agents
+        self.embedding_agent = QueryEmbeddingAgent(AzureOpenAIEmbeddingsAgent())
+
+    def _search_agent(self, agent: VectorSearchAgent, collection_name, attr_name, projection, limit, k, filter, vector):
+        result = agent.perform_vector_search(
+            collection_name, attr_name=attr_name, query=None, projection=projection, limit=limit,
+            k=k, filter=filter, vector=vector)
+        items = list()
+        for item in take(result, limit):
+            score = normalize_score(item.similarity_score, agent.vector_store_type)
+            document = dict(item.document, vector_store=agent.vector_store_type.value)
+            items.append((score, VectorSearchItem(similarity_score=score, document=document)))
+        return items
+
+    def perform_vector_search(self, collection_name: str, attr_name: str, query: str, projection: list[str], limit: int,
+                              k: int = None, filter: dict = None, page_size: int = None,
+                              vector: List[float] = None) -> PagedVectorSearchResult:
+        vector = vector if vector is not None else self.embedding_agent.get_text_embeddings(query)
+        searches = {
+            agent.vector_store_type.value: (
+                lambda agent=agent: self._search_agent(agent, collection_name, attr_name, projection, limit, k, filter, vector))
+            for agent in self.agents
+        }
+        top_items, _ = fan_out_search(searches, limit)
+        return PagedVectorSearchResult([[item for _, _, item in top_items]], lambda item: item, limit=limit, name=ALL_VECTOR_STORES)
+
+    def perform_search(self, collection_name: str, filter: dict, limit: int) -> List[Dict[str, Any]]:
+        # Assets live in the store they were processed into
+        for agent in self.agents:
+            items = agent.perform_search(collection_name, filter, limit)
+            if items:
+                return items
+        return list()
+
+
 class VectorSearchAgentFactory:
 
     @staticmethod
@@ -83,5 +155,16 @@ class VectorSearchAgentFactory:
             return CosmosMongoVCoreVectorSearchAgent()
         elif vector_store_type == VectorStoreType.AISearch.value:
             return AISearchVectorSearchAgent(index_names=["cc-video-asset-index", "cc-video-asset-frames-index"])
+        elif vector_store_type == ALL_VECTOR_STORES:
+            # Stores that are not configured on this deployment are left out of the fan-out
+            agents = list()
+            for store_type in VectorStoreType:
+                try:
+                    agents.append(VectorSearchAgentFactory.create_vector_search_agent(store_type.value))
+                except Exception as e:
+                    print(f"Skipping vector store {store_type.value}: {e}")
+            if not agents:
+                raise ValueError("None of the vector stores could be created")
+            return FanOutVectorSearchAgent(agents)
         else:
             raise ValueError(f"Invalid vector store type: {vector_store_type}")
@@ -0,0 +1,136 @@
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+
+from .utilities import count_tokens
+from .hybrid_retriever import VECTOR_METADATA_KEY
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def mmr_order(query_vector, doc_vectors, lambda_mult: float = 0.7) -> List[int]:
+    """ Maximal marginal relevance order of all documents, with the similarity matrix computed once """
+    query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+    vectors = _normalize_rows(np.asarray(doc_vectors, dtype=np.float32))
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    count = len(relevance)
+    max_similarity = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    order = list()
+    for _ in range(count):
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0)
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return order
+
+
+class ContextPacker:
+    """
+    Builds the prompt context from retrieved documents within a token budget.
+
+    Documents are taken in maximal marginal relevance order, so a passage that repeats one already
+    selected is pushed back behind passages that add something new. Text that overlaps a selected
+    chunk of the same page (chunks share `overlap_tokens` with their neighbours, located by their
+    start_index / end_index metadata) is cut, and passages are added while they fit the budget.
+
+    The document vectors are the ones the retrievers return in the metadata (VECTOR_METADATA_KEY),
+    nothing is embedded but the question. They are taken out of the metadata, so they are not kept
+    with the answer; without vectors the documents keep their retrieval order.
+    """
+
+    def __init__(self, embed_query: Callable, token_budget=None, lambda_mult=None,
+                 document_separator="\n\n", encoding_name="cl100k_base") -> None:
+        self.embed_query = embed_query
+        self.token_budget = token_budget or _env_int("CONTEXT_TOKEN_BUDGET", 3000)
+        self.lambda_mult = lambda_mult if lambda_mult is not None else _env_float("CONTEXT_MMR_LAMBDA", 0.7)
+        self.document_separator = document_separator
+        self.encoding_name = encoding_name
+
+    @staticmethod
+    def _span(doc: Document) -> Optional[Tuple[Tuple, int, int]]:
+        metadata = doc.metadata
+        if metadata.get("start_index") is None or metadata.get("end_index") is None:
+            return None
+        return (metadata.get("source"), metadata.get("page")), int(metadata["start_index"]), int(metadata["end_index"])
+
+    @staticmethod
+    def _trim(doc: Document, covered: Dict[Tuple, List[Tuple[int, int]]]) -> Optional[str]:
+        """ Text of the document without the parts already covered by selected chunks of the same page """
+        span = ContextPacker._span(doc)
+        if span is None:
+            return doc.page_content
+        page, start, end = span
+        text_start, text_end = start, end
+        for covered_start, covered_end in covered.get(page, []):
+            if covered_start <= text_start < covered_end:
+                text_start = covered_end
+            if covered_start < text_end <= covered_end:
+                text_end = covered_start
+        if text_start >= text_end:
+            return None
+        return doc.page_content[text_start - start:text_end - start].strip() or None
+
+    def pack(self, question: str, docs: List[Document]) -> Tuple[str, dict]:
+        if len(docs) == 0:
+            return "", {"documents": 0, "selected": 0, "tokens": 0, "tokens_saved": 0}
+
+        full_context = self.document_separator.join(doc.page_content for doc in docs)
+        full_tokens = count_tokens(full_context, self.encoding_name)
+
+        doc_vectors = [doc.metadata.pop(VECTOR_METADATA_KEY, None) for doc in docs]
+        order = list(range(len(docs)))
+        if len(docs) > 1:
+            if all(vector is not None for vector in doc_vectors):
+                order = mmr_order(self.embed_query(question), np.vstack(doc_vectors), self.lambda_mult)
+            else:
+                print("Retrieved documents carry no vectors, packing them in retrieval order")
+
+        separator_tokens = count_tokens(self.document_separator, self.encoding_name)
+        covered: Dict[Tuple, List[Tuple[int, int]]] = dict()
+        passages = list()
+        used_tokens = 0
+        for idx in order:
+            text = self._trim(docs[idx], covered)
+            if text is None or text in passages:
+                continue
+            tokens = count_tokens(text, self.encoding_name) + (separator_tokens if passages else 0)
+            if used_tokens + tokens > self.token_budget:
+                # A shorter passage further down the order may still fit
+                continue
+            passages.append(text)
+            used_tokens += tokens
+            span = self._span(docs[idx])
+            if span is not None:
+                covered.setdefault(span[0], list()).append((span[1], span[2]))
+
+        report = {
+            "documents": len(docs),
+            "selected": len(passages),
+            "tokens": used_tokens,
+            "tokens_saved": full_tokens - used_tokens,
+        }
+        print(f"Packed {report['selected']}/{report['documents']} passages into {used_tokens} tokens "
+              f"(budget {self.token_budget}), saved {report['tokens_saved']} of {full_tokens} tokens")
+        return self.document_separator.join(passages), report
+
+    def __call__(self, docs: List[Document], question: str) -> str:
+        return self.pack(question, docs)[0]
@@ -1,7 +1,31 @@
+import os
 import json
+import itertools
 from pymongo import MongoClient
 from bson import json_util
 
+from .schema import VectorSearchItem
+from .paged_search import PagedVectorSearchResult, split_document
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _cursor_pages(cursor, page_size):
+    # With batchSize equal to page_size every page is one getMore, sent when the previous page has been read
+    with cursor:
+        while page := list(itertools.islice(cursor, page_size)):
+            yield page
+
+
+def _to_search_item(item):
+    # Without a projection the stored document is returned under 'document'
+    if "document" in item and isinstance(item["document"], dict):
+        return VectorSearchItem(similarity_score=item.get("similarityScore") or 0.0, document=item["document"])
+    return split_document(item, "similarityScore")
+
 
 class CosmosMongoClient:
 
@@ -39,7 +63,9 @@ class CosmosMongoClient:
     def get_indices(self, collection_name):
         return self.database[collection_name].getIndexes();
     
-    def create_vector_index (self, collection_name, attr_name, index_name, type="vector-hnsw", num_lists=1, similarity="COS", dimensions=1536):
+    def create_vector_index (self, collection_name, attr_name, index_name, type="vector-hnsw", num_lists=1, similarity="COS", dimensions=1536,
+                             m=None, ef_construction=None):
+        """ HNSW `m` / `ef_construction` default to MONGO_HNSW_M / MONGO_HNSW_EF_CONSTRUCTION, see benchmarks/tune_vector_index.py """
         search_options = None
 
         # Support for HNSW indexes are available for M40 cluster tiers and higher 
@@ -54,8 +80,8 @@ class CosmosMongoClient:
         elif type == "vector-hnsw": 
             search_options = {
                 'kind': type,
-                'm': 64,
-                'efConstruction': 256,
+                'm': m or _env_int("MONGO_HNSW_M", 64),
+                'efConstruction': ef_construction or _env_int("MONGO_HNSW_EF_CONSTRUCTION", 256),
                 'similarity': similarity,
                 'dimensions': dimensions
             }
@@ -94,6 +120,11 @@ class CosmosMongoClient:
         collection.insert_many(items)
             
 
+    def upsert(self, collection_name, filter, data):
+        data = json.loads(json_util.dumps(data))
+        collection = self.database[collection_name]
+        collection.replace_one(filter, data, upsert=True)
+
     def find (self, collection_name, filter = {}, limit=100):
         collection = self.database[collection_name]
         result = collection.find(filter=filter, limit=limit)
@@ -106,9 +137,11 @@ class CosmosMongoClient:
 
 
     # https://www.mongodb.com/docs/atlas/atlas-vector-search/vector-search-stage/
-    def perform_vector_search(self, collection_name, attr_name, prompt, projection: list = [], limit=3):
+    def perform_vector_search(self, collection_name, attr_name, prompt, projection: list = [], limit=3,
+                              k=None, filter: dict = None, page_size=None, vector=None, ef_search=None, n_probes=None) -> PagedVectorSearchResult:
         collection = self.database[collection_name]
-        embedding_vector = self.embedding_agent.get_text_embeddings(prompt)
+        embedding_vector = vector if vector is not None else self.embedding_agent.get_text_embeddings(prompt)
+        k = max(k or limit, limit)
         projected_fields = dict(similarityScore= { "$meta": 'searchScore' })
         if len(projection) != 0:
             for field in projection:
@@ -118,25 +151,37 @@ class CosmosMongoClient:
 
         print(f"Projected fields: {projected_fields}")
 
+        cosmos_search = {
+            "vector": embedding_vector,
+            "path": attr_name,
+            "k": k,
+            "efSearch": ef_search or _env_int("MONGO_HNSW_EF_SEARCH", 40) # optional for HNSW only
+        }
+        if n_probes:
+            # IVF only, number of clusters searched
+            cosmos_search["nProbes"] = n_probes
+        if filter:
+            # Pre-filter on fields that have a filter index, e.g. {"asset_name": {"$eq": "demo.mp4"}}
+            cosmos_search["filter"] = filter
+
         pipeline = [
                 {
                     "$search": {
-                        "cosmosSearch": {
-                            "vector": embedding_vector,
-                            "path": attr_name,
-                            "k": limit, 
-                            "efsearch": 40 # optional for HNSW only 
-                            #"filter": {"title": {"$ne": "Azure Cosmos DB"}}
-                        },
+                        "cosmosSearch": cosmos_search,
                         "returnStoredSource": True 
                     }
                 },
                 {
                     "$project": projected_fields
+                },
+                {
+                    "$limit": limit
                 }
             ]
-        results = collection.aggregate(pipeline)
-        return list(results)
+        # The cursor fetches the next batch from the server only once the current one is consumed
+        page_size = page_size or limit
+        cursor = collection.aggregate(pipeline, batchSize=page_size)
+        return PagedVectorSearchResult(_cursor_pages(cursor, page_size), _to_search_item, limit=limit, name=collection_name)
 
 
     def close_connection(self):
@@ -0,0 +1,170 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+
+# Property paths that can be projected or filtered on, e.g. asset_name or metadata.source
+FIELD_PATH = re.compile(r"[A-Za-z_]\w*(\.[A-Za-z_]\w*)*")
+
+
+def _field(alias: str, path: str) -> str:
+    if not FIELD_PATH.fullmatch(path):
+        raise ValueError(f"Invalid field: {path}")
+    return f"{alias}.{path}"
+
+
+class CosmosQuery:
+    """ Query text with its parameters and the partition it is routed to (None for a cross-partition query) """
+
+    def __init__(self, query: str, parameters: List[Dict[str, Any]], partition_key=None) -> None:
+        self.query = query
+        self.parameters = parameters
+        self.partition_key = partition_key
+
+    def __repr__(self) -> str:
+        scope = f"partition {self.partition_key!r}" if self.partition_key is not None else "cross-partition"
+        return f"{self.query} ({scope})"
+
+
+class CosmosQueryBuilder:
+    """
+    Builds Cosmos NoSQL queries whose values are all sent as parameters.
+
+    Field names cannot be parameters, they are checked against FIELD_PATH instead. An equality
+    filter on the container's partition key path routes the query to that single partition.
+    """
+
+    def __init__(self, alias: str = "c", partition_key_path: str = None) -> None:
+        self.alias = alias
+        self.partition_key_field = partition_key_path.strip("/").replace("/", ".") if partition_key_path else None
+        self._fields: List[str] = list()
+        self._conditions: List[str] = list()
+        self._parameters: List[Dict[str, Any]] = list()
+        self._top = None
+        self._order_by = None
+        self._partition_key = None
+
+    def _parameter(self, value) -> str:
+        name = f"@p{len(self._parameters)}"
+        self._parameters.append({"name": name, "value": value})
+        return name
+
+    def select(self, fields: Optional[List[str]]):
+        self._fields.extend(_field(self.alias, field) for field in fields or [])
+        return self
+
+    def top(self, count: Optional[int]):
+        self._top = int(count) if count is not None else None
+        return self
+
+    def where_equals(self, conditions: Optional[Dict[str, Any]]):
+        for key, value in (conditions or {}).items():
+            self._conditions.append(f"{_field(self.alias, key)} = {self._parameter(value)}")
+            if key == self.partition_key_field:
+                self._partition_key = value
+        return self
+
+    def where(self, condition: str):
+        """ Raw condition, only for conditions written in code (never user input) """
+        self._conditions.append(condition)
+        return self
+
+    def partition_key(self, value):
+        self._partition_key = value
+        return self
+
+    def vector_distance(self, field: str, vector: List[float], score_alias: str = "similarity_score"):
+        """ Projects the distance to `vector` as `score_alias` and orders by it, most similar first """
+        distance = f"VectorDistance({_field(self.alias, field)}, {self._parameter(vector)})"
+        self._fields.append(f"{distance} AS {score_alias}")
+        # ORDER BY has to repeat the VectorDistance expression, the projected alias is not accepted
+        self._order_by = distance
+        return self
+
+    def build(self) -> CosmosQuery:
+        top = f"TOP {self._parameter(self._top)} " if self._top is not None else ""
+        fields = self._fields
+        if fields and all(" AS " in field for field in fields):
+            # `*` cannot be combined with computed fields, the whole document is projected as `document`
+            fields = [f"{self.alias} AS document"] + fields
+        fields = ", ".join(fields) if fields else "*"
+        query = f"SELECT {top}{fields} FROM {self.alias}"
+        if self._conditions:
+            query += " WHERE " + " AND ".join(self._conditions)
+        if self._order_by is not None:
+            query += f" ORDER BY {self._order_by}"
+        return CosmosQuery(query, self._parameters, self._partition_key)
+
+
+class _RequestCosts:
+    """
+    response_hook of a single query, sums the request charge and server duration of the requests sent
+    for it. The client's last_response_headers are shared by every query of the client, so they cannot
+    be read after a page when other threads query through the same client.
+    """
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        self.request_charge = 0.0
+        self.duration_ms = 0.0
+
+    def __call__(self, headers, result) -> None:
+        # query_items also calls the hook once when the query is created, with the client's last headers
+        # and the pager instead of a response body
+        if not isinstance(result, dict):
+            return
+        self.request_charge += float(headers.get("x-ms-request-charge", 0))
+        self.duration_ms += float(headers.get("x-ms-request-duration-ms", 0))
+
+
+class CosmosQueryPages:
+    """
+    Continuation pages of a query, fetched while they are iterated.
+
+    The request charge (RU) and server duration of every page are printed and kept in `page_costs`.
+    `continuation_token` is the token after the last page read, pass it back as `continuation_token`
+    to resume the query later.
+    """
+
+    def __init__(self, container_client, query: CosmosQuery, page_size: int = None, continuation_token: str = None,
+                 name: str = "") -> None:
+        self.container_client = container_client
+        self.query = query
+        self.page_size = page_size
+        self.continuation_token = continuation_token
+        self.name = name or container_client.id
+        self.page_costs: List[Dict[str, float]] = list()
+        self._costs = _RequestCosts()
+
+    def __iter__(self) -> Iterator[List[dict]]:
+        options = dict(query=self.query.query, parameters=self.query.parameters, max_item_count=self.page_size,
+                       response_hook=self._costs)
+        if self.query.partition_key is not None:
+            options["partition_key"] = self.query.partition_key
+        else:
+            options["enable_cross_partition_query"] = True
+        print(f"[{self.name}] Query: {self.query}")
+
+        pager = self.container_client.query_items(**options).by_page(self.continuation_token)
+        for page in pager:
+            items = list(page)
+            # A page of a cross-partition query can take several requests, the page costs their sum
+            cost = {
+                "items": len(items),
+                "request_charge": self._costs.request_charge - self.request_charge,
+                "duration_ms": self._costs.duration_ms - self.duration_ms,
+            }
+            self.page_costs.append(cost)
+            self.continuation_token = pager.continuation_token
+            print(f"[{self.name}] Page {len(self.page_costs)}: {cost['items']} items, "
+                  f"{cost['request_charge']:.2f} RU, {cost['duration_ms']:.1f} ms")
+            yield items
+
+    @property
+    def request_charge(self) -> float:
+        return sum(cost["request_charge"] for cost in self.page_costs)
+
+    @property
+    def duration_ms(self) -> float:
+        return sum(cost["duration_ms"] for cost in self.page_costs)
@@ -1,6 +1,5 @@
 from azure.identity import ClientSecretCredential, DefaultAzureCredential
 from azure.cosmos import CosmosClient, PartitionKey
-from azure.cosmos.diagnostics import RecordDiagnostics
 import azure.cosmos.exceptions as exceptions
 from typing import List
 import json
@@ -9,8 +8,12 @@ import time
 from datetime import date, datetime
 from faker import Faker
 import uuid
+import re
 import random
 
+from .cosmos_query_builder import CosmosQueryBuilder, CosmosQueryPages
+from .paged_search import PagedVectorSearchResult, split_document
+
 
 class CosmosUtil:
 
@@ -25,6 +28,7 @@ class CosmosUtil:
                 container_names = containers
 
         self.container_map = dict()
+        self.partition_key_paths = dict()
 
         if auth_type == "connection_str":
             connection_string = os.environ["AZURE_COSMOS_CONNECTION_STRING"]
@@ -81,36 +85,32 @@ class CosmosUtil:
                 "x-ms-request-charge"]
             print(f"Request Charge: {request_charge}")
 
-    def query_items(self, container, predicate, limit=None):
-
+    def partition_key_path(self, container):
+        """ Partition key path of the container, e.g. /asset_name, read once from its properties """
+        if container not in self.partition_key_paths:
+            properties = self.container_map[container].read()
+            self.partition_key_paths[container] = properties["partitionKey"]["paths"][0]
+        return self.partition_key_paths[container]
+
+    def query_items(self, container, predicate, limit=None, projection=None, partition_key=None):
+        """
+        Items matching `predicate`, a dict of equality conditions sent as query parameters (a string
+        predicate is used as is and must not contain user input). An equality condition on the partition
+        key, or `partition_key`, keeps the query in a single partition.
+        Returns (timestamp, request charge, server duration ms) summed over the pages, and the items.
+        """
         container_client = self.container_map[container]
-        top_q = ""
-        if limit != None:
-            top_q += f"TOP {limit}"
-
-        if (predicate == None or predicate == ""):
-            query = f"SELECT {top_q} * FROM r"
-        else:
-            if type(predicate) == dict:
-                predicate_str = ""
-                for key in predicate.keys():
-                    predicate_str += f"r.{key} = '{predicate[key]}' AND "
-                predicate_str = predicate_str[:-4]
-                query = f"SELECT {top_q} * FROM r WHERE {predicate_str}"
-            else:
-                query = f"SELECT {top_q} * FROM r WHERE r.{predicate}"
-            
-        print(f"Query: {query}")
-
-        m = RecordDiagnostics()
-        items = list(container_client.query_items(
-            query=query,
-            enable_cross_partition_query=True,
-            response_hook=m
-        ))
-        # print(f"Here: {items}")
-        ru_consumption = (datetime.now().isoformat(), m.request_charge, float(
-            m.headers["x-ms-request-duration-ms"]))
+        builder = CosmosQueryBuilder("r", self.partition_key_path(container)).select(projection).top(limit)
+        if type(predicate) == dict:
+            builder.where_equals(predicate)
+        elif predicate:
+            builder.where(f"r.{predicate}")
+        if partition_key is not None:
+            builder.partition_key(partition_key)
+
+        pages = CosmosQueryPages(container_client, builder.build(), name=container)
+        items = [item for page in pages for item in page]
+        ru_consumption = (datetime.now().isoformat(), pages.request_charge, pages.duration_ms)
 
         return ru_consumption, items
 
@@ -141,7 +141,9 @@ class CosmosUtil:
         }
         return vector_embedding_policy
 
-    def create_indexing_policy(self, field_paths: List):
+    def create_indexing_policy(self, field_paths: List, index_type: str = None):
+        # flat, quantizedFlat or diskANN; see benchmarks/tune_vector_index.py
+        index_type = index_type or os.getenv("COSMOS_VECTOR_INDEX_TYPE") or "quantizedFlat"
         excluded_paths = []
         excluded_paths.append({ "path": "/\"_etag\"/?"})
         vector_indexes = []
@@ -149,7 +151,7 @@ class CosmosUtil:
             excluded_paths.append({ "path": f"{field}/*"})
             vector_indexes.append({
                 "path": field,
-                "type": "quantizedFlat"
+                "type": index_type
             })
 
         indexing_policy = { 
@@ -163,17 +165,18 @@ class CosmosUtil:
         }
         return indexing_policy
 
-    def create_container_with_vectors(self, container_name: str, partitionKey: str, vector_fields: List):
+    def create_container_with_vectors(self, container_name: str, partitionKey: str, vector_fields: List, vector_index_type: str = None):
         try:
             # Vector embedding policy is not allowed on the shared throughput containers
             container = self.database_client.create_container_if_not_exists(
                 id=container_name,
                 partition_key=PartitionKey(path=partitionKey),
                 vector_embedding_policy=self.create_vector_embedding_policy(vector_fields),
-                indexing_policy=self.create_indexing_policy(vector_fields),
+                indexing_policy=self.create_indexing_policy(vector_fields, vector_index_type),
                 # offer_throughput=400
             )
             self.container_map[container_name] = container
+            self.partition_key_paths[container_name] = partitionKey
             return container
         except exceptions.CosmosResourceExistsError:
             container = self.database_client.get_container_client(container_name)
@@ -182,28 +185,41 @@ class CosmosUtil:
         except exceptions.CosmosHttpResponseError:
             raise
 
-    def perform_vector_search(self, container_name: str, prompt: str, content_vector_field: str="summary_vector", projection: list = [], limit: int = 3):
+    def perform_vector_search(self, container_name: str, prompt: str, content_vector_field: str="summary_vector", projection: list = [], limit: int = 3,
+                              k: int = None, filter: dict = None, page_size: int = None, vector: List[float] = None,
+                              partition_key=None, min_score: float = None, continuation_token: str = None) -> PagedVectorSearchResult:
+        """
+        Top `k` nearest items, of which at most `limit` are returned lazily in pages of `page_size` items.
+        `filter` is a dict of equality conditions sent as query parameters; a condition on the partition key
+        (or `partition_key`) searches a single partition. Items below `min_score` are dropped client-side,
+        VectorDistance is only computed for the projection and the ordering.
+        The request charge and duration of each page are printed and kept on `result.query`.
+        """
         container_client = self.container_map[container_name]
-        prompt_vector = self.embedding_agent.get_text_embeddings(prompt)
-        if len(projection) == 0:
-            projected_fields = "*"
-        else:
-            projected_fields = ", ".join([f"c.{p}" for p in projection])
-
-        # query=f"SELECT TOP {limit} {projected_fields}, VectorDistance(c.{content_vector_field}, {prompt_vector}) AS similarity_score FROM c ORDER BY VectorDistance(c.{content_vector_field}, {prompt_vector})"
-        # print(f"Query: {query}")
-        
-        result = container_client.query_items(
-            query=f"SELECT TOP {limit} {projected_fields}, VectorDistance(c.{content_vector_field}, @embedding) AS similarity_score FROM c where VectorDistance(c.{content_vector_field}, @embedding) > 0.7 ORDER BY VectorDistance(c.{content_vector_field}, @embedding) ",
-            parameters=[
-                {"name":"@embedding", "value": prompt_vector},
-            ],
-            enable_cross_partition_query=True
-        )
-        items = list()
-        for item in result: 
-            print(json.dumps(item, indent=True))
-            items.append(item)
-        
-        return items
-    
+        prompt_vector = vector if vector is not None else self.embedding_agent.get_text_embeddings(prompt)
+        k = max(k or limit, limit)
+
+        builder = CosmosQueryBuilder("c", self.partition_key_path(container_name))
+        builder.select(projection).top(k).where_equals(filter).vector_distance(content_vector_field, prompt_vector)
+        if partition_key is not None:
+            builder.partition_key(partition_key)
+        pages = CosmosQueryPages(container_client, builder.build(), page_size=page_size or limit,
+                                 continuation_token=continuation_token, name=container_name)
+
+        def to_item(item):
+            if "document" in item and len(projection) == 0:
+                item = dict(item.pop("document"), similarity_score=item["similarity_score"])
+            return split_document(item, "similarity_score")
+
+        # Continuation pages are only requested while the caller iterates
+        return PagedVectorSearchResult(
+            _above_score(pages, min_score), to_item, limit=limit, name=container_name, query=pages)
+
+
+def _above_score(pages, min_score):
+    """ Pages cut at the first item below `min_score`, items arrive in descending similarity """
+    for page in pages:
+        kept = [item for item in page if min_score is None or item["similarity_score"] >= min_score]
+        yield kept
+        if len(kept) < len(page):
+            return
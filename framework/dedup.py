@@ -0,0 +1,134 @@
+import re
+import hashlib
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+
+
+SIMHASH_BITS = 64
+
+# Numbers, codes and identifiers (clause 4.2, SKU-1234, ISO, snake_case) have to match exactly between near duplicates
+_FACT_TOKEN = re.compile(r"[\w\-./]*[\d_][\w\-./]*|\b[A-Z]{2,}[\w\-./]*")
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def fact_tokens(text: str) -> List[str]:
+    return [token.strip(".-/") for token in _FACT_TOKEN.findall(text)]
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """ 64 bit SimHash over word shingles, the bit votes are counted with NumPy """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) == 0:
+        return 0
+    shingles = [" ".join(words[idx:idx + shingle_size]) for idx in range(max(1, len(words) - shingle_size + 1))]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little") for shingle in shingles],
+        dtype=np.uint64
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int(np.packbits(votes > 0, bitorder="little").view("<u8")[0])
+
+
+class ChunkDeduplicator:
+    """
+    Finds exact and near duplicate chunks within a scope (the source document when used by ingestion).
+
+    Exact duplicates are matched on the hash of the normalized text. Near duplicate candidates are found
+    on a SimHash within `max_distance` bits, looked up through `max_distance + 1` bands so that any two
+    hashes within the distance share at least one identical band. A candidate is only a duplicate when
+    the word sequences are at least `min_similarity` alike and their numbers and identifiers are the
+    same, chunks that differ in a single value are kept. The first chunk seen is kept as the canonical
+    copy and collects the (source, page) of every chunk it replaced.
+    """
+
+    def __init__(self, max_distance: int = 3, shingle_size: int = 3, min_similarity: float = 0.98) -> None:
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.min_similarity = min_similarity
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self.duplicates = 0
+        self._exact: Dict[Tuple[str, str], int] = dict()
+        self._bands: Dict[Tuple[str, int, int], List[int]] = dict()
+        self._hashes: List[int] = list()
+        self._texts: List[Tuple[List[str], List[str]]] = list()
+        self.occurrences: List[List[dict]] = list()
+
+    def _band_keys(self, scope: str, value: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            yield (scope, band, (value >> (band * self.band_bits)) & mask)
+
+    def _is_near_duplicate(self, canonical_id: int, words: List[str], facts: List[str]) -> bool:
+        canonical_words, canonical_facts = self._texts[canonical_id]
+        if facts != canonical_facts:
+            return False
+        return SequenceMatcher(None, canonical_words, words, autojunk=False).ratio() >= self.min_similarity
+
+    def _find(self, scope: str, exact_key: str, value: int, words: List[str], facts: List[str]) -> Optional[int]:
+        if (scope, exact_key) in self._exact:
+            return self._exact[(scope, exact_key)]
+        checked = set()
+        for band_key in self._band_keys(scope, value):
+            for canonical_id in self._bands.get(band_key, []):
+                if canonical_id in checked:
+                    continue
+                checked.add(canonical_id)
+                # SimHash only proposes candidates, the text decides
+                if bin(self._hashes[canonical_id] ^ value).count("1") <= self.max_distance \
+                        and self._is_near_duplicate(canonical_id, words, facts):
+                    return canonical_id
+        return None
+
+    def add(self, document: Document, scope: str = "") -> Tuple[int, bool]:
+        """ Returns the canonical id of the document and whether the document is the canonical copy """
+        reference = {"source": document.metadata.get("source"), "page": document.metadata.get("page")}
+        exact_key = hashlib.sha256(normalize_text(document.page_content).encode("utf-8")).hexdigest()
+        value = simhash(document.page_content, self.shingle_size)
+        words = re.findall(r"\w+", document.page_content.lower())
+        facts = fact_tokens(document.page_content)
+
+        canonical_id = self._find(scope, exact_key, value, words, facts)
+        if canonical_id is not None:
+            self.duplicates += 1
+            if reference not in self.occurrences[canonical_id]:
+                self.occurrences[canonical_id].append(reference)
+            return canonical_id, False
+
+        canonical_id = len(self._hashes)
+        self._hashes.append(value)
+        self._texts.append((words, facts))
+        self.occurrences.append([reference])
+        self._exact[(scope, exact_key)] = canonical_id
+        for band_key in self._band_keys(scope, value):
+            self._bands.setdefault(band_key, list()).append(canonical_id)
+        return canonical_id, True
+
+
+def deduplicate_documents(documents: List[Document], max_distance: int = 3) -> List[Document]:
+    """ Keeps the canonical copy of every group of duplicates with all its occurrences in metadata """
+    deduplicator = ChunkDeduplicator(max_distance=max_distance)
+    canonical_docs = dict()
+    for document in documents:
+        canonical_id, is_canonical = deduplicator.add(document, scope=document.metadata.get("source", ""))
+        if is_canonical:
+            canonical_docs[canonical_id] = document
+
+    for canonical_id, document in canonical_docs.items():
+        document.metadata["occurrences"] = deduplicator.occurrences[canonical_id]
+
+    print(f"Removed {deduplicator.duplicates} duplicate chunks out of {len(documents)}")
+    return list(canonical_docs.values())
+
+
+def deduplicate_texts(texts: List[str], max_distance: int = 3) -> List[str]:
+    deduplicator = ChunkDeduplicator(max_distance=max_distance)
+    unique_texts = [text for text in texts if deduplicator.add(Document(page_content=text))[1]]
+    print(f"Removed {len(texts) - len(unique_texts)} duplicate chunks out of {len(texts)}")
+    return unique_texts
@@ -0,0 +1,202 @@
+import os
+import re
+import sys
+import struct
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+MAGIC = b"EMB1"
+HEADER = struct.Struct("<4sI")
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class EmbeddingCache:
+    """
+    Content addressed on-disk cache of embedding vectors.
+
+    Every vector is stored in its own file named after sha256(model, dimensions, normalized text) and
+    written with an atomic rename, so several processes (and replicas sharing a mounted volume) can
+    read and write the same directory without locking. File mtime is used as the LRU recency and the
+    directory is trimmed back below its size budget when it grows past it.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None) -> None:
+        self.cache_dir = Path(cache_dir or os.getenv("EMBEDDING_CACHE_DIR") or "./.cache/embeddings")
+        self.max_bytes = max_bytes or _env_int("EMBEDDING_CACHE_MAX_MB", 512) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._approx_bytes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+    def make_key(self, model: str, text: str, dimensions: Optional[int] = None) -> str:
+        key = f"{model}\x1f{dimensions or 'default'}\x1f{self.normalize(text)}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.bin"
+
+    @staticmethod
+    def encode(vector) -> bytes:
+        values = array("f", vector)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return HEADER.pack(MAGIC, len(values)) + values.tobytes()
+
+    @staticmethod
+    def decode(data: bytes) -> Optional[List[float]]:
+        if len(data) < HEADER.size:
+            return None
+        magic, dims = HEADER.unpack_from(data)
+        if magic != MAGIC or len(data) != HEADER.size + dims * 4:
+            return None
+        values = array("f")
+        values.frombytes(data[HEADER.size:])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tolist()
+
+    def get(self, model: str, text: str, dimensions: Optional[int] = None) -> Optional[List[float]]:
+        path = self._path(self.make_key(model, text, dimensions))
+        try:
+            vector = self.decode(path.read_bytes())
+        except OSError:
+            vector = None
+
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if vector is not None:
+            try:
+                # Refresh the LRU recency of the entry
+                os.utime(path)
+            except OSError:
+                pass
+        return vector
+
+    def put(self, model: str, text: str, vector, dimensions: Optional[int] = None) -> None:
+        if not vector:
+            return
+        path = self._path(self.make_key(model, text, dimensions))
+        data = self.encode(vector)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Unable to write embedding cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_size()
+            self._approx_bytes += len(data)
+            over_budget = self._approx_bytes > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def get_or_compute(self, model: str, text: str, compute: Callable, dimensions: Optional[int] = None):
+        vector = self.get(model, text, dimensions)
+        if vector is None:
+            vector = compute(text)
+            self.put(model, text, vector, dimensions)
+        return vector
+
+    def get_or_compute_many(self, model: str, texts: List[str], compute_many: Callable, dimensions: Optional[int] = None):
+        vectors = [self.get(model, text, dimensions) for text in texts]
+
+        # Identical texts inside one call are only computed once
+        missing = dict()
+        for idx, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(self.make_key(model, texts[idx], dimensions), list()).append(idx)
+
+        if missing:
+            positions = list(missing.values())
+            computed = compute_many([texts[idx_list[0]] for idx_list in positions])
+            for idx_list, vector in zip(positions, computed):
+                self.put(model, texts[idx_list[0]], vector, dimensions)
+                for idx in idx_list:
+                    vectors[idx] = vector
+
+        return vectors
+
+    def _entries(self):
+        if not self.cache_dir.exists():
+            return
+        for path in self.cache_dir.glob("*/*.bin"):
+            try:
+                yield path, path.stat()
+            except OSError:
+                # Removed by another process in the meantime
+                continue
+
+    def _scan_size(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        total_bytes = sum(stat.st_size for _, stat in entries)
+        target_bytes = int(self.max_bytes * 0.9)
+        removed = 0
+        for path, stat in entries:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+            total_bytes -= stat.st_size
+
+        with self._lock:
+            self.evictions += removed
+            self._approx_bytes = total_bytes
+        print(f"Embedding cache evicted {removed} entries, {total_bytes} bytes remaining")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "approx_bytes": self._approx_bytes,
+            }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """ Process wide cache instance used by every embedding call site """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
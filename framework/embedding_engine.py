@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from langchain_core.embeddings import Embeddings
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from .utilities import get_token_encoder
+
+
+# Hard per-input limit of the ada-002 / text-embedding-3 family
+MAX_INPUT_TOKENS = 8191
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class RateLimiter:
+    """
+    Sliding one minute window over requests and tokens.
+    A limit of 0 disables that dimension. The limiter is shared by all worker threads of an engine.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    _, expired_tokens = self._events.popleft()
+                    self._tokens_in_window -= expired_tokens
+
+                requests_ok = self.requests_per_minute <= 0 or len(self._events) < self.requests_per_minute
+                # A single batch larger than the whole budget is let through once the window is empty
+                tokens_ok = (self.tokens_per_minute <= 0
+                             or self._tokens_in_window + tokens <= self.tokens_per_minute
+                             or not self._events)
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+
+                wait_time = 60 - (now - self._events[0][0])
+
+            time.sleep(max(wait_time, 0.05))
+
+
+class BatchEmbeddingEngine(Embeddings):
+    """
+    Embeddings implementation that packs texts into token aware batches and keeps several
+    batches in flight at once. It can be passed as the embedding function to FAISS and AzureSearch.
+    """
+
+    def __init__(self, client, deployment, max_batch_size=None, max_batch_tokens=None,
+                 max_concurrency=None, requests_per_minute=None, tokens_per_minute=None,
+                 encoding_name="cl100k_base", cache=None) -> None:
+        self.client = client
+        self.deployment = deployment
+        self.cache = cache
+        self.max_batch_size = max_batch_size or _env_int("AZURE_EMBEDDING_BATCH_SIZE", 2048)
+        self.max_batch_tokens = max_batch_tokens or _env_int("AZURE_EMBEDDING_BATCH_TOKENS", 300000)
+        self.max_concurrency = max_concurrency or _env_int("AZURE_EMBEDDING_CONCURRENCY", 4)
+        self.encoding_name = encoding_name
+        self.rate_limiter = RateLimiter(
+            requests_per_minute if requests_per_minute is not None else _env_int("AZURE_EMBEDDING_RPM", 0),
+            tokens_per_minute if tokens_per_minute is not None else _env_int("AZURE_EMBEDDING_TPM", 0)
+        )
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix="embedding")
+            return self._executor
+
+    def _prepare(self, text):
+        # The service rejects empty input and inputs above the model limit
+        if not text:
+            text = " "
+        encoder = get_token_encoder(self.encoding_name)
+        tokens = encoder.encode(text, disallowed_special=())
+        if len(tokens) > MAX_INPUT_TOKENS:
+            tokens = tokens[:MAX_INPUT_TOKENS]
+            text = encoder.decode(tokens)
+        return text, len(tokens)
+
+    def make_batches(self, texts: List[str]):
+        batches = list()
+        batch, batch_tokens = list(), 0
+        for text in texts:
+            text, token_count = self._prepare(text)
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + token_count > self.max_batch_tokens):
+                batches.append((batch, batch_tokens))
+                batch, batch_tokens = list(), 0
+            batch.append(text)
+            batch_tokens += token_count
+
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    @retry(
+        wait=wait_random_exponential(multiplier=1, min=1, max=30),
+        stop=stop_after_attempt(6),
+        retry=retry_if_exception_type((RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)),
+        reraise=True
+    )
+    def _embed_batch(self, batch):
+        texts, token_count = batch
+        self.rate_limiter.acquire(token_count)
+        response = self.client.embeddings.create(input=texts, model=self.deployment)
+        # The service does not guarantee the order of the returned items
+        return [item.embedding for item in sorted(response.data, key=lambda x: x.index)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+
+        if self.cache is not None:
+            return self.cache.get_or_compute_many(self.deployment, texts, self._embed_documents)
+        return self._embed_documents(texts)
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = self.make_batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        start_time = time.perf_counter()
+        vectors = list()
+        for batch_vectors in self._get_executor().map(self._embed_batch, batches):
+            vectors.extend(batch_vectors)
+        elapsed_time = time.perf_counter() - start_time
+        print(f"Embedded {len(texts)} texts in {len(batches)} batches in {elapsed_time:.2f} seconds")
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain.docstore.document import Document
+from langchain_community.vectorstores.azuresearch import FIELDS_ID, FIELDS_CONTENT, FIELDS_CONTENT_VECTOR, FIELDS_METADATA
+
+from .schema import VectorStoreType
+from .az_ai_search_helper import get_ai_search_index_clients, get_az_search_index_client, perform_vector_search
+from .hybrid_retriever import VECTOR_METADATA_KEY
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# Shared by all fan-out searches; unlike the default executor of asyncio.run it is not joined on
+# return, so a search that timed out does not hold back the merged result
+_search_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fanout-search")
+
+
+def normalize_score(score: float, vector_store_type: VectorStoreType) -> float:
+    """
+    Maps the score of a cosine vector search of any backend onto [0, 1].
+
+    AI Search returns 1 / (1 + cosine distance), Cosmos NoSQL VectorDistance and the Mongo vCore
+    searchScore return the cosine similarity itself.
+    """
+    if vector_store_type == VectorStoreType.AISearch:
+        cosine = 2 - 1 / score if score > 0 else -1.0
+    else:
+        cosine = score
+    return min(max((cosine + 1) / 2, 0.0), 1.0)
+
+
+async def _search_one(name: str, search: Callable[[], List[Tuple[float, Any]]], timeout: float):
+    start_time = time.perf_counter()
+    try:
+        # A timed out search keeps running on its worker thread, its result is dropped
+        items = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(_search_executor, search), timeout)
+        status = "ok"
+    except asyncio.TimeoutError:
+        items, status = list(), "timeout"
+    except Exception as e:
+        items, status = list(), f"error: {e}"
+    latency_ms = (time.perf_counter() - start_time) * 1000
+    print(f"Fan-out search [{name}] {status} with {len(items)} items in {latency_ms:.0f} ms")
+    return name, items, {"status": status, "items": len(items), "latency_ms": round(latency_ms, 1)}
+
+
+async def _fan_out(searches: Dict[str, Callable], k: int, timeout: float):
+    results = await asyncio.gather(*[_search_one(name, search, timeout) for name, search in searches.items()])
+    candidates = [(score, name, item) for name, items, _ in results for score, item in items]
+    top_items = heapq.nlargest(k, candidates, key=lambda candidate: candidate[0])
+    return top_items, {name: report for name, _, report in results}
+
+
+def fan_out_search(searches: Dict[str, Callable[[], List[Tuple[float, Any]]]], k: int, timeout: float = None):
+    """
+    Runs every search concurrently and merges their (normalized score, item) lists into one top k.
+
+    Each search gets `timeout` seconds (FANOUT_SEARCH_TIMEOUT); a slow or failing one only contributes
+    no items. Returns the merged [(score, search name, item)] and a report per search.
+    """
+    timeout = timeout or _env_float("FANOUT_SEARCH_TIMEOUT", 2.0)
+    start_time = time.perf_counter()
+    top_items, report = asyncio.run(_fan_out(searches, k, timeout))
+    print(f"Fan-out search over {len(searches)} targets merged {len(top_items)} items in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+    return top_items, report
+
+
+def take(result, k: int) -> list:
+    """ Reads the first k items of a lazy search result, on the calling worker thread """
+    return list(itertools.islice(result, k))
+
+
+class FanOutRetriever(BaseRetriever):
+    """
+    Retriever over several AI Search indices of the knowledge base.
+
+    The question is embedded once, every index is searched concurrently with the same vector and the
+    results are merged on their normalized cosine score.
+    """
+
+    index_names: List[str]
+    embed_query: Callable
+    index_clients: Dict[str, Any]
+    k: int = 4
+    timeout: float = 2.0
+    last_report: Dict[str, dict] = dict()
+
+    def _search_index(self, index_name: str, vector) -> List[Tuple[float, Document]]:
+        result = perform_vector_search(
+            self.index_clients[index_name],
+            vectorized_query=vector,
+            attr_name=FIELDS_CONTENT_VECTOR,
+            projection=[FIELDS_ID, FIELDS_CONTENT, FIELDS_METADATA, FIELDS_CONTENT_VECTOR],
+            k=self.k,
+        )
+        docs = list()
+        for item in take(result, self.k):
+            metadata = json.loads(item.document.get(FIELDS_METADATA) or "{}")
+            score = normalize_score(item.similarity_score, VectorStoreType.AISearch)
+            metadata.update(index_name=index_name, score=score)
+            if item.document.get(FIELDS_CONTENT_VECTOR) is not None:
+                metadata[VECTOR_METADATA_KEY] = np.asarray(item.document[FIELDS_CONTENT_VECTOR], dtype=np.float32)
+            docs.append((score, Document(page_content=item.document.get(FIELDS_CONTENT, ""), metadata=metadata)))
+        return docs
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = self.embed_query(query)
+        searches = {
+            index_name: (lambda index_name=index_name: self._search_index(index_name, vector))
+            for index_name in self.index_names
+        }
+        top_items, self.last_report = fan_out_search(searches, self.k, self.timeout)
+        return [doc for _, _, doc in top_items]
+
+
+def get_fanout_retriever(index_names: List[str], embed_query: Callable, k=4) -> FanOutRetriever:
+    # Only indices with the chunk layout of the knowledge base can answer the query vector
+    index_client = get_az_search_index_client()
+    index_names = [
+        index_name for index_name in index_names
+        if any(field.name == FIELDS_CONTENT_VECTOR for field in index_client.get_index(index_name).fields)
+    ]
+    print(f"Fan-out retriever over indices {index_names}")
+    return FanOutRetriever(
+        index_names=list(index_names),
+        embed_query=embed_query,
+        index_clients=get_ai_search_index_clients(index_names),
+        k=k,
+        timeout=_env_float("FANOUT_SEARCH_TIMEOUT", 2.0),
+    )
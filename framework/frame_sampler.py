@@ -0,0 +1,162 @@
+import os
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import cv2
+
+from .keyframe_selector import KeyframeSelector
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def spool_video(video_data: bytes, file_name: str = "video.mp4") -> str:
+    """ Writes the in-memory video to a local temp file, OpenCV only decodes from a path or URL """
+    _, suffix = os.path.splitext(file_name)
+    with tempfile.NamedTemporaryFile(suffix=suffix or ".mp4", delete=False) as f:
+        f.write(video_data)
+        return f.name
+
+
+class FrameSampler:
+    """
+    Samples one frame every `interval_seconds` from a local video file.
+
+    The file is decoded sequentially: frames between samples are only grabbed (demuxed and decoded,
+    never converted), and only the sampled frames are retrieved and JPEG encoded. Videos longer than
+    `workers` x `min_range_seconds` are split into time ranges on sample boundaries, each range is
+    decoded by its own capture on a worker thread after a single seek to its start (OpenCV releases
+    the GIL while decoding).
+
+    With a `selector` the frames are scanned every `selector.scan_interval` seconds and only the
+    keyframes it picks are encoded. Ranges are scanned in parallel, the keyframes are then selected
+    again over the candidates of all ranges in order, so the result matches a sequential scan.
+    """
+
+    def __init__(self, video_path: str, interval_seconds: float, workers: int = None, min_range_seconds: int = None,
+                 jpeg_quality: int = 95, selector: KeyframeSelector = None) -> None:
+        self.video_path = video_path
+        self.selector = selector
+        self.interval_seconds = selector.scan_interval if selector is not None else interval_seconds
+        self.workers = workers or _env_int("VIDEO_DECODE_WORKERS", min(4, os.cpu_count() or 1))
+        self.min_range_seconds = min_range_seconds or _env_int("VIDEO_DECODE_MIN_RANGE_SECONDS", 120)
+        self.jpeg_quality = jpeg_quality
+        self.total_frames, self.fps = self.probe()
+        self.step = max(int(self.fps * self.interval_seconds), 1)
+
+    def probe(self) -> Tuple[int, float]:
+        video = cv2.VideoCapture(self.video_path)
+        if not video.isOpened():
+            raise ValueError(f"Unable to open video {self.video_path}")
+        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = video.get(cv2.CAP_PROP_FPS) or 25.0
+        video.release()
+        return total_frames, fps
+
+    def _ranges(self) -> List[Tuple[int, Optional[int]]]:
+        samples = (self.total_frames + self.step - 1) // self.step
+        min_samples = max(int(self.min_range_seconds / self.interval_seconds), 1)
+        count = max(min(self.workers, samples // min_samples), 1)
+        bounds = [round(samples * idx / count) * self.step for idx in range(count)]
+        # The frame count in the header can be off, the last range decodes to the end of the file
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def _encode(self, frame) -> bytes:
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return buffer.tobytes()
+
+    def _sample_range(self, start_frame: int, end_frame: Optional[int]):
+        """
+        Frames of the range. When selecting keyframes, the (frame index, signature) of every scanned
+        candidate is returned as well, and the frames are the ones kept by a selection of the range alone.
+        """
+        video = cv2.VideoCapture(self.video_path)
+        if start_frame > 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        session = self.selector.session() if self.selector is not None else None
+        candidates = list()
+        frames = list()
+        frame_idx = start_frame
+        while end_frame is None or frame_idx < end_frame:
+            if not video.grab():
+                break
+            if (frame_idx - start_frame) % self.step == 0:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                if session is not None:
+                    signature = self.selector.signature(frame)
+                    candidates.append((frame_idx, signature))
+                    if not session.offer(frame_idx / self.fps, signature=signature):
+                        frame_idx += 1
+                        continue
+                frames.append((frame_idx, self._encode(frame)))
+            frame_idx += 1
+        video.release()
+        return frames, candidates
+
+    def _encode_range(self, frame_indices: List[int]) -> List[Tuple[int, bytes]]:
+        """ Decodes from the first to the last of the (sorted) frame indices and encodes only those """
+        video = cv2.VideoCapture(self.video_path)
+        if frame_indices[0] > 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_indices[0])
+        wanted = set(frame_indices)
+        frames = list()
+        for frame_idx in range(frame_indices[0], frame_indices[-1] + 1):
+            if not video.grab():
+                break
+            if frame_idx in wanted:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                frames.append((frame_idx, self._encode(frame)))
+        video.release()
+        return frames
+
+    def _join_ranges(self, results, executor) -> List[Tuple[int, bytes]]:
+        """
+        Keyframes are selected again in a single pass over the candidates of all ranges, in order, so the
+        result is the one of a sequential scan. The selection of a range alone already encoded most of
+        them, the others are decoded again from their range.
+        """
+        if self.selector is None:
+            return [frame for frames, _ in results for frame in frames]
+
+        encoded = dict()
+        keyframes = list()
+        missing = list()
+        session = self.selector.session()
+        for frames, candidates in results:
+            encoded.update(frames)
+            range_keyframes = [frame_idx for frame_idx, signature in candidates
+                               if session.offer(frame_idx / self.fps, signature=signature)]
+            keyframes.extend(range_keyframes)
+            range_missing = [frame_idx for frame_idx in range_keyframes if frame_idx not in encoded]
+            if range_missing:
+                missing.append(range_missing)
+
+        for frames in executor.map(self._encode_range, missing):
+            encoded.update(frames)
+        print(f"Joined {len(results)} ranges: {len(keyframes)} keyframes, {sum(map(len, missing))} decoded again")
+        return [(frame_idx, encoded[frame_idx]) for frame_idx in keyframes if frame_idx in encoded]
+
+    def timestamp(self, frame_idx: int) -> float:
+        return frame_idx / self.fps
+
+    def sample(self) -> List[Tuple[int, bytes]]:
+        """ (frame index, JPEG bytes) of every sampled frame, in order """
+        start_time = time.perf_counter()
+        ranges = self._ranges()
+        if len(ranges) == 1:
+            frames, _ = self._sample_range(*ranges[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="frame-sampler") as executor:
+                results = list(executor.map(lambda bounds: self._sample_range(*bounds), ranges))
+                frames = self._join_ranges(results, executor)
+        kind = "keyframes scanning" if self.selector is not None else "frames sampling"
+        print(f"Selected {len(frames)} {kind} {self.total_frames} frames every {self.step} frames "
+              f"with {len(ranges)} workers in {time.perf_counter() - start_time:.1f} s")
+        return frames
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import weakref
+import threading
+from typing import Any, Dict, List
+import numpy as np
+from azure.search.documents.models import VectorizedQuery
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import AzureSearch
+from langchain_community.vectorstores.azuresearch import FIELDS_CONTENT, FIELDS_CONTENT_VECTOR, FIELDS_METADATA
+
+from .bm25 import BM25Index, reciprocal_rank_fusion
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# Metadata key of the document vector returned by the retrievers, consumed by the context packer
+VECTOR_METADATA_KEY = "_vector"
+
+
+def with_vector(doc: Document, vector) -> Document:
+    """ Copy of the document carrying its vector, retrieved documents can be shared by other requests """
+    return Document(page_content=doc.page_content,
+                    metadata={**doc.metadata, VECTOR_METADATA_KEY: np.asarray(vector, dtype=np.float32)})
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Keyword + vector retriever over a local FAISS store.
+
+    The query runs against the FAISS index and a BM25 inverted index of the same chunks, both
+    fetching `fetch_k` candidates, and the two rankings are merged with reciprocal rank fusion.
+    BM25 is what finds exact identifiers (clause numbers, SKUs, error codes) that embeddings blur.
+    The returned documents carry their vector from the index.
+    """
+
+    vector_store: Any
+    bm25_index: Any
+    documents: List[Document]
+    positions: Dict[str, int]
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        start_time = time.perf_counter()
+        vector_docs = self.vector_store.similarity_search(query, k=self.fetch_k)
+        vector_time = time.perf_counter() - start_time
+        keyword_docs = [self.documents[idx] for idx, _ in self.bm25_index.search(query, self.fetch_k)]
+
+        # Chunks are identified by their content, the FAISS results do not carry docstore ids
+        docs_by_key = dict()
+        for doc in vector_docs + keyword_docs:
+            docs_by_key.setdefault(doc.page_content, doc)
+        fused = reciprocal_rank_fusion(
+            [[doc.page_content for doc in vector_docs], [doc.page_content for doc in keyword_docs]],
+            k=self.rrf_k
+        )
+
+        print(f"Hybrid retrieval: {len(vector_docs)} vector ({vector_time * 1000:.0f} ms) and {len(keyword_docs)} keyword "
+              f"candidates fused in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        return [with_vector(docs_by_key[key], self._vector(self.positions[key])) for key, _ in fused[:self.k]]
+
+    def _vector(self, idx: int) -> np.ndarray:
+        # Full precision vectors when the store keeps them for rescoring, else decoded from the index
+        exact_vectors = getattr(self.vector_store, "exact_vectors", None)
+        if exact_vectors is not None:
+            return np.asarray(exact_vectors[idx])
+        return self.vector_store.index.reconstruct(int(idx))
+
+
+class AzureSearchRetriever(BaseRetriever):
+    """
+    Hybrid (text + vector) or vector query against the index of an AzureSearch store.
+
+    Unlike the retriever of the store, which drops the stored vectors, the returned documents carry
+    the content vector of their chunk.
+    """
+
+    vector_store: Any
+    k: int = 4
+    search_type: str = "hybrid"
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = self.vector_store.embed_query(query)
+        results = self.vector_store.client.search(
+            search_text=query if self.search_type == "hybrid" else None,
+            vector_queries=[VectorizedQuery(vector=np.array(vector, dtype=np.float32).tolist(),
+                                            k_nearest_neighbors=self.k, fields=FIELDS_CONTENT_VECTOR)],
+            top=self.k,
+        )
+        docs = list()
+        for result in results:
+            content = result.pop(FIELDS_CONTENT)
+            vector = result.pop(FIELDS_CONTENT_VECTOR, None)
+            # Same metadata as the store's own retriever: the metadata field, or every other field
+            metadata = json.loads(result[FIELDS_METADATA]) if FIELDS_METADATA in result else dict(result)
+            if vector is not None:
+                metadata[VECTOR_METADATA_KEY] = np.asarray(vector, dtype=np.float32)
+            docs.append(Document(page_content=content, metadata=metadata))
+        return docs
+
+
+_bm25_indexes = weakref.WeakKeyDictionary()
+_bm25_indexes_lock = threading.Lock()
+
+
+def get_bm25_index(vector_store):
+    """ BM25 index of the chunks of a FAISS store with the chunks and their positions, built once per loaded store """
+    with _bm25_indexes_lock:
+        if vector_store not in _bm25_indexes:
+            start_time = time.perf_counter()
+            documents = [
+                vector_store.docstore.search(vector_store.index_to_docstore_id[idx])
+                for idx in range(len(vector_store.index_to_docstore_id))
+            ]
+            # Position of every chunk in the index, by content (the FAISS results do not carry docstore ids)
+            positions = dict()
+            for idx, doc in enumerate(documents):
+                positions.setdefault(doc.page_content, idx)
+            _bm25_indexes[vector_store] = (BM25Index([doc.page_content for doc in documents]), documents, positions)
+            print(f"Built BM25 index of {len(documents)} chunks in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        return _bm25_indexes[vector_store]
+
+
+def get_hybrid_retriever(vector_store, k=4, search_type=None):
+    """
+    Retriever used by the RAG chains in place of vector_store.as_retriever().
+
+    AzureSearch stores send a single text + vector query and AI Search fuses both rankings with
+    RRF on the service; FAISS stores are wrapped in a HybridRetriever. RETRIEVAL_SEARCH_TYPE=similarity
+    switches back to pure vector retrieval.
+    """
+    search_type = search_type or os.getenv("RETRIEVAL_SEARCH_TYPE") or "hybrid"
+    if isinstance(vector_store, AzureSearch):
+        return AzureSearchRetriever(vector_store=vector_store, k=k, search_type="hybrid" if search_type == "hybrid" else "similarity")
+
+    if search_type != "hybrid":
+        return vector_store.as_retriever(search_type="similarity", search_kwargs={"k": k})
+
+    bm25_index, documents, positions = get_bm25_index(vector_store)
+    return HybridRetriever(
+        vector_store=vector_store,
+        bm25_index=bm25_index,
+        documents=documents,
+        positions=positions,
+        k=k,
+        fetch_k=max(20, k * 4),
+        rrf_k=_env_int("HYBRID_RRF_K", 60),
+    )
@@ -0,0 +1,221 @@
+import os
+import time
+import itertools
+import threading
+from typing import Callable, Iterable, List, Optional
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchIndexingBufferedSender
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class WriteTracker:
+    """
+    Outcome of the actions one caller (e.g. an ingestion run) queued on a shared writer, matched on the
+    document key: the acknowledged and failed actions, and the latency of the batches that carried them.
+    `on_result(succeeded, batch_seconds)` is called for every action; `batch_seconds` is the latency of
+    its batch the first time the batch is seen by this tracker, 0 afterwards.
+
+    The sender drops the actions of a batch whose request raised without reporting them, so after a
+    flush every key in `missing()` has to be treated as failed.
+    """
+
+    def __init__(self, key_field: str, on_result: Optional[Callable[[bool, float], None]] = None) -> None:
+        self.key_field = key_field
+        self.on_result = on_result
+        self.keys = set()
+        self.acknowledged = set()
+        self.failed = list()
+        self._failed_keys = set()
+        self.batch_latencies: List[float] = list()
+        self._batches = set()
+        self._lock = threading.Lock()
+
+    def add(self, documents: Iterable[dict]):
+        with self._lock:
+            self.keys.update(document[self.key_field] for document in documents)
+
+    def record(self, action, succeeded: bool, batch) -> None:
+        key = action.additional_properties.get(self.key_field)
+        with self._lock:
+            if key not in self.keys:
+                return
+            batch_seconds = 0.0
+            if batch is not None and batch[0] not in self._batches:
+                self._batches.add(batch[0])
+                self.batch_latencies.append(batch[1])
+                batch_seconds = batch[1]
+            if succeeded:
+                self.acknowledged.add(key)
+            else:
+                self.failed.append(action)
+                self._failed_keys.add(key)
+        if self.on_result is not None:
+            self.on_result(succeeded, batch_seconds)
+
+    @property
+    def succeeded(self) -> int:
+        return len(self.acknowledged)
+
+    def missing(self) -> set:
+        """ Keys that were neither acknowledged nor reported as failed """
+        with self._lock:
+            return self.keys - self.acknowledged - self._failed_keys
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.batch_latencies)
+            return {
+                "batches": len(latencies),
+                "succeeded": len(self.acknowledged),
+                "failed": len(self.failed),
+                "p50_batch_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                "max_batch_ms": latencies[-1] * 1000 if latencies else 0.0,
+            }
+
+
+class SearchIndexWriter:
+    """
+    Buffered writer for an Azure AI Search index built on SearchIndexingBufferedSender.
+
+    Actions are queued and sent in batches once `batch_size` actions are pending or every
+    `flush_interval` seconds. Actions that come back with a retryable status inside a 207 response
+    are re-queued by the sender up to `max_retries_per_action` times, while 503 / 429 responses of
+    a whole batch are retried by the pipeline retry policy with exponential backoff.
+    Request latency of every batch is recorded from the transport hooks. Callers sharing the writer
+    follow their own actions with a WriteTracker from `track()`.
+    """
+
+    def __init__(self, index_name, endpoint=None, key=None, batch_size=None, flush_interval=None,
+                 max_retries_per_action=3, retry_total=6, retry_backoff_factor=1.0, retry_backoff_max=60) -> None:
+        self.index_name = index_name
+        self.batch_latencies: List[float] = list()
+        self.batch_status_codes: List[int] = list()
+        self.succeeded = 0
+        self.failed = list()
+        self._trackers: List[WriteTracker] = list()
+        self._batch_ids = itertools.count()
+        # The sender reports the actions of a batch on the thread that sent it, right after its response
+        self._current_batch = threading.local()
+        self._lock = threading.Lock()
+
+        self.sender = SearchIndexingBufferedSender(
+            endpoint=endpoint or os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"],
+            index_name=index_name,
+            credential=AzureKeyCredential(key or os.environ["AZURE_SEARCH_ADMIN_KEY"]),
+            auto_flush_interval=flush_interval or _env_int("AZURE_SEARCH_FLUSH_INTERVAL", 10),
+            initial_batch_action_count=batch_size or _env_int("AZURE_SEARCH_BATCH_SIZE", 500),
+            max_retries_per_action=max_retries_per_action,
+            on_progress=self._on_progress,
+            on_error=self._on_error,
+            retry_total=retry_total,
+            retry_backoff_factor=retry_backoff_factor,
+            retry_backoff_max=retry_backoff_max,
+            raw_request_hook=self._on_request,
+            raw_response_hook=self._on_response,
+        )
+
+    def _on_request(self, request):
+        request.context["batch_start_time"] = time.perf_counter()
+
+    def _on_response(self, response):
+        start_time = response.context.get("batch_start_time")
+        if start_time is None:
+            return
+        latency = time.perf_counter() - start_time
+        status_code = response.http_response.status_code
+        with self._lock:
+            self.batch_latencies.append(latency)
+            self.batch_status_codes.append(status_code)
+        self._current_batch.value = (next(self._batch_ids), latency)
+        print(f"[{self.index_name}] Indexed batch with status {status_code} in {latency * 1000:.0f} ms")
+
+    def _notify(self, action, succeeded):
+        with self._lock:
+            trackers = list(self._trackers)
+        batch = getattr(self._current_batch, "value", None)
+        for tracker in trackers:
+            tracker.record(action, succeeded, batch)
+
+    def _on_progress(self, action):
+        with self._lock:
+            self.succeeded += 1
+        self._notify(action, True)
+
+    def _on_error(self, action):
+        with self._lock:
+            self.failed.append(action)
+        print(f"[{self.index_name}] Failed to index action after retries: {action}")
+        self._notify(action, False)
+
+    def track(self, key_field: str, on_result: Optional[Callable[[bool, float], None]] = None) -> WriteTracker:
+        tracker = WriteTracker(key_field, on_result)
+        with self._lock:
+            self._trackers.append(tracker)
+        return tracker
+
+    def untrack(self, tracker: WriteTracker):
+        with self._lock:
+            if tracker in self._trackers:
+                self._trackers.remove(tracker)
+        self.reset_retries(tracker.keys)
+
+    def reset_retries(self, keys: Iterable[str]):
+        # The sender counts retries per document key for its whole lifetime, a shared writer would let
+        # earlier writes of a key use up the retries of later ones
+        for key in keys:
+            self.sender._retry_counter.pop(key, None)
+
+    def upload_documents(self, documents):
+        self.sender.upload_documents(documents=documents if isinstance(documents, list) else [documents])
+
+    def merge_or_upload_documents(self, documents):
+        self.sender.merge_or_upload_documents(documents=documents if isinstance(documents, list) else [documents])
+
+    def merge_documents(self, documents):
+        self.sender.merge_documents(documents=documents if isinstance(documents, list) else [documents])
+
+    def delete_documents(self, documents):
+        self.sender.delete_documents(documents=documents if isinstance(documents, list) else [documents])
+
+    def flush(self):
+        self.sender.flush()
+        return self.stats()
+
+    def close(self):
+        self.sender.close()
+        return self.stats()
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.batch_latencies)
+            return {
+                "index_name": self.index_name,
+                "batches": len(latencies),
+                "succeeded": self.succeeded,
+                "failed": len(self.failed),
+                "p50_batch_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                "max_batch_ms": latencies[-1] * 1000 if latencies else 0.0,
+                "status_codes": {code: self.batch_status_codes.count(code) for code in set(self.batch_status_codes)},
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_index_writers = dict()
+_index_writers_lock = threading.Lock()
+
+
+def get_index_writer(index_name) -> SearchIndexWriter:
+    """ Shared writer per index so concurrent write paths fill the same batches """
+    with _index_writers_lock:
+        if index_name not in _index_writers:
+            _index_writers[index_name] = SearchIndexWriter(index_name)
+        return _index_writers[index_name]
@@ -0,0 +1,115 @@
+import os
+import json
+import uuid
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Iterable, Set
+
+
+def _manifest_root(manifest_dir=None) -> Path:
+    return Path(manifest_dir or os.getenv("INGESTION_MANIFEST_DIR") or "./.cache/manifests")
+
+
+def get_index_version(index_name: str, manifest_dir=None) -> str:
+    """ Version of the content of an index, changed by every ingestion that modified it """
+    try:
+        return (_manifest_root(manifest_dir) / index_name / "VERSION").read_text(encoding="utf-8").strip()
+    except OSError:
+        return "0"
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def chunk_fingerprint(source: str, text: str, chunking_params: dict) -> str:
+    """ Stable index key of a chunk, derived from its source, its text and the chunking parameters """
+    payload = json.dumps({"source": source, "chunking": chunking_params, "text": text}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ManifestStore:
+    """
+    Keeps one manifest per (index, source document) listing the fingerprints of the chunks currently
+    stored in the index for that document. A re-upload compares its fingerprints against the manifest
+    to only embed new chunks and to delete the ones that disappeared.
+
+    The manifests are only trusted after `validate` checked them against the live index.
+    """
+
+    def __init__(self, index_name: str, chunking_params: dict, manifest_dir=None) -> None:
+        self.index_name = index_name
+        self.chunking_params = chunking_params
+        self.manifest_dir = _manifest_root(manifest_dir) / index_name
+
+    def _path(self, source: str) -> Path:
+        name = hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+        return self.manifest_dir / f"{name}.json"
+
+    def fingerprint(self, source: str, text: str) -> str:
+        return chunk_fingerprint(source, text, self.chunking_params)
+
+    def load(self, source: str) -> Set[str]:
+        path = self._path(source)
+        if not path.exists():
+            return set()
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return set(manifest.get("chunks", []))
+
+    def save(self, source: str, chunk_keys: Iterable[str]) -> None:
+        manifest = {
+            "index_name": self.index_name,
+            "source": source,
+            "chunking": self.chunking_params,
+            "chunks": sorted(chunk_keys),
+        }
+        _write_atomic(self._path(source), json.dumps(manifest))
+
+    def _chunk_count(self) -> int:
+        count = 0
+        for path in self.manifest_dir.glob("*.json"):
+            if path.name == "INDEX.json":
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                count += len(json.load(f).get("chunks", []))
+        return count
+
+    def validate(self, e_tag: str, document_count: int) -> bool:
+        """
+        Checks the manifests still describe the index: it has to be the index instance they were written
+        against (same etag) and must not be empty. Otherwise, e.g. after the index was deleted, recreated
+        or its schema changed, the manifests are dropped and every chunk is uploaded again. The document
+        count lags behind recent writes, so it only invalidates the manifests when it is 0.
+        """
+        state_path = self.manifest_dir / "INDEX.json"
+        try:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            state = dict()
+
+        chunk_count = self._chunk_count()
+        valid = True
+        if chunk_count and state.get("e_tag") != e_tag:
+            print(f"Index {self.index_name} changed since the last upload, dropping its manifests")
+            valid = False
+        elif chunk_count and document_count == 0:
+            print(f"Index {self.index_name} is empty but its manifests list {chunk_count} chunks, dropping them")
+            valid = False
+
+        if not valid:
+            for path in self.manifest_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
+            self.bump_version()
+        _write_atomic(state_path, json.dumps({"index_name": self.index_name, "e_tag": e_tag}))
+        return valid
+
+    def bump_version(self) -> str:
+        version = uuid.uuid4().hex
+        _write_atomic(self.manifest_dir / "VERSION", version)
+        return version
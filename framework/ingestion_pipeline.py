@@ -0,0 +1,385 @@
+import json
+import time
+import uuid
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from langchain_community.vectorstores.azuresearch import FIELDS_ID, FIELDS_CONTENT, FIELDS_CONTENT_VECTOR, FIELDS_METADATA
+
+from .pdf_extractor import iter_pdf_pages
+from .ingestion_manifest import ManifestStore
+from .dedup import ChunkDeduplicator
+from .index_writer import SearchIndexWriter, WriteTracker
+
+
+# Marks the end of the stream on every queue
+_DONE = object()
+
+
+class StageStats:
+    """ Thread safe counters of a single pipeline stage """
+
+    def __init__(self, name, unit) -> None:
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._active_workers = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+            self._active_workers += 1
+
+    def finish(self):
+        # A stage is done once the last of its worker threads finished
+        with self._lock:
+            self._active_workers -= 1
+            if self._active_workers == 0:
+                self.finished_at = time.perf_counter()
+
+    def record(self, items, busy_seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += busy_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            end = self.finished_at or time.perf_counter()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "stage": self.name,
+                "unit": self.unit,
+                "items": self.items,
+                "rate": self.items / elapsed if elapsed > 0 else 0.0,
+                "busy_seconds": round(self.busy_seconds, 2),
+                "done": self.finished_at is not None,
+            }
+
+
+class IngestionPipeline:
+    """
+    Staged extract -> split -> embed -> upload ingestion of PDF files into an AzureSearch vector store index.
+
+    Every stage runs on its own thread(s) and hands work to the next one through a bounded queue,
+    so all four stages overlap and at most a fixed number of pages, chunks and vectors are held in
+    memory regardless of the size of the upload.
+
+    With a manifest store, chunks are keyed by their fingerprint: unchanged chunks of a re-uploaded
+    document are skipped before embedding and chunks that no longer exist are deleted from the index.
+
+    Exact and near duplicate chunks of a document (headers, footers, disclaimers) are dropped right
+    after splitting; the canonical copy is indexed once and its metadata lists every page it occurs on.
+    """
+
+    def __init__(self, index_writer: SearchIndexWriter, embeddings, text_splitter, manifest_store: Optional[ManifestStore] = None,
+                 embed_batch_size=128, embed_workers=2, page_queue_size=8, chunk_queue_size=512,
+                 vector_queue_size=2, deduplicate=True) -> None:
+        self.index_writer = index_writer
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.manifest_store = manifest_store
+        self._previous_keys: Dict[str, Set[str]] = dict()
+        self._current_keys: Dict[str, Set[str]] = dict()
+        self._incomplete_sources: Set[str] = set()
+        # Duplicates are only looked up within their own document, which keeps the manifests per document consistent
+        self.deduplicator = ChunkDeduplicator() if deduplicate else None
+        self._canonical_chunks: Dict[int, Tuple[str, dict]] = dict()
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = embed_workers
+
+        self.page_queue = queue.Queue(maxsize=page_queue_size)
+        self.chunk_queue = queue.Queue(maxsize=chunk_queue_size)
+        self.vector_queue = queue.Queue(maxsize=vector_queue_size)
+
+        self.stats = {
+            "extract": StageStats("extract", "pages"),
+            "split": StageStats("split", "chunks"),
+            "embed": StageStats("embed", "chunks"),
+            "upload": StageStats("upload", "chunks"),
+            "unchanged": StageStats("unchanged", "chunks"),
+            "duplicate": StageStats("duplicate", "chunks"),
+        }
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._upload_tracker: Optional[WriteTracker] = None
+
+    def _put(self, q, item):
+        # Blocking put that gives up once another stage has failed
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _run_stage(self, stage, target, *args):
+        self.stats[stage].start()
+        try:
+            target(*args)
+        except BaseException as e:
+            print(f"Ingestion stage [{stage}] failed: {e}")
+            self._error = self._error or e
+            self._stop.set()
+        finally:
+            self.stats[stage].finish()
+
+    def _extract(self, files):
+        stats = self.stats["extract"]
+        for file in files:
+            print(f"Processing {getattr(file, 'name', file)}")
+            pages = iter_pdf_pages(file)
+            try:
+                while not self._stop.is_set():
+                    start_time = time.perf_counter()
+                    page = next(pages, None)
+                    if page is None:
+                        break
+                    stats.record(1, time.perf_counter() - start_time)
+                    self._put(self.page_queue, page)
+            finally:
+                pages.close()
+        self._put(self.page_queue, _DONE)
+
+    def _register_source(self, source):
+        if source not in self._current_keys:
+            self._previous_keys[source] = self.manifest_store.load(source)
+            self._current_keys[source] = set()
+
+    def _fingerprint(self, chunk):
+        source = chunk.metadata.get("source", "")
+        self._register_source(source)
+        key = self.manifest_store.fingerprint(source, chunk.page_content)
+        is_new = key not in self._previous_keys[source] and key not in self._current_keys[source]
+        self._current_keys[source].add(key)
+        return key, is_new
+
+    def _split(self):
+        stats = self.stats["split"]
+        unchanged_stats = self.stats["unchanged"]
+        duplicate_stats = self.stats["duplicate"]
+        unchanged_stats.start()
+        duplicate_stats.start()
+        try:
+            while (page := self._get(self.page_queue)) is not _DONE:
+                start_time = time.perf_counter()
+                chunks = self.text_splitter.split_documents([page])
+                stats.record(len(chunks), time.perf_counter() - start_time)
+                source = page.metadata.get("source", "")
+                if self.manifest_store is not None:
+                    self._register_source(source)
+                if "extraction_timeout" in page.metadata or "extraction_error" in page.metadata:
+                    self._incomplete_sources.add(source)
+
+                for chunk in chunks:
+                    canonical_id = None
+                    if self.deduplicator is not None:
+                        canonical_id, is_canonical = self.deduplicator.add(chunk, scope=source)
+                        if not is_canonical:
+                            duplicate_stats.record(1, 0)
+                            continue
+
+                    key = None
+                    is_new = True
+                    if self.manifest_store is not None:
+                        key, is_new = self._fingerprint(chunk)
+                    elif canonical_id is not None:
+                        key = str(uuid.uuid4())
+                    if canonical_id is not None:
+                        self._canonical_chunks[canonical_id] = (key, chunk.metadata)
+
+                    if not is_new:
+                        unchanged_stats.record(1, 0)
+                        continue
+                    self._put(self.chunk_queue, (chunk, key))
+        finally:
+            unchanged_stats.finish()
+            duplicate_stats.finish()
+
+        for _ in range(self.embed_workers):
+            self._put(self.chunk_queue, _DONE)
+
+    def _embed_batch(self, batch):
+        start_time = time.perf_counter()
+        vectors = self.embeddings.embed_documents([chunk.page_content for chunk, _ in batch])
+        self.stats["embed"].record(len(batch), time.perf_counter() - start_time)
+        self._put(self.vector_queue, (batch, vectors))
+
+    def _embed(self):
+        batch = list()
+        while (chunk := self._get(self.chunk_queue)) is not _DONE:
+            batch.append(chunk)
+            if len(batch) >= self.embed_batch_size:
+                self._embed_batch(batch)
+                batch = list()
+
+        if batch and not self._stop.is_set():
+            self._embed_batch(batch)
+        self._put(self.vector_queue, _DONE)
+
+    def _upload(self):
+        stats = self.stats["upload"]
+        remaining_workers = self.embed_workers
+        while remaining_workers > 0:
+            item = self._get(self.vector_queue)
+            if item is _DONE:
+                remaining_workers -= 1
+                continue
+
+            batch, vectors = item
+            # Same document layout as the langchain AzureSearch vector store
+            documents = [
+                {
+                    FIELDS_ID: key or str(uuid.uuid4()),
+                    FIELDS_CONTENT: chunk.page_content,
+                    FIELDS_CONTENT_VECTOR: vectors[idx],
+                    FIELDS_METADATA: json.dumps(chunk.metadata),
+                }
+                for idx, (chunk, key) in enumerate(batch)
+            ]
+            # Upload stats are recorded when the service acknowledges the documents, see _on_upload_result
+            self._upload_tracker.add(documents)
+            self.index_writer.reset_retries(document[FIELDS_ID] for document in documents)
+            self.index_writer.upload_documents(documents)
+
+        self.index_writer.flush()
+
+    def _on_upload_result(self, succeeded, batch_seconds):
+        # Acknowledged documents and the latency of the batches that carried them
+        self.stats["upload"].record(1 if succeeded else 0, batch_seconds)
+
+    def _write(self, send, documents) -> set:
+        """ Sends the documents with `send` (a writer method) and flushes, returns the keys not acknowledged """
+        tracker = self.index_writer.track(FIELDS_ID)
+        try:
+            tracker.add(documents)
+            self.index_writer.reset_retries(tracker.keys)
+            send(documents)
+            self.index_writer.flush()
+        finally:
+            self.index_writer.untrack(tracker)
+        return tracker.keys - tracker.acknowledged
+
+    def _merge_occurrences(self):
+        # Occurrences are only complete once the whole document was split, so they are merged after the upload
+        documents = [
+            {FIELDS_ID: key, FIELDS_METADATA: json.dumps({**metadata, "occurrences": self.deduplicator.occurrences[canonical_id]})}
+            for canonical_id, (key, metadata) in self._canonical_chunks.items()
+            if len(self.deduplicator.occurrences[canonical_id]) > 1
+        ]
+        if documents:
+            # Canonical chunks are merged again by every upload of their document, a failed merge is retried then
+            failed_keys = self._write(self.index_writer.merge_documents, documents)
+            if failed_keys:
+                print(f"Failed to merge the occurrences of {len(failed_keys)} chunks")
+        print(f"Dropped {self.deduplicator.duplicates} duplicate chunks, {len(documents)} canonical chunks occur on several pages")
+
+    def _sync_manifests(self):
+        # Only runs after every chunk has been uploaded, so a failed run leaves the old manifest in place
+        changed = False
+        stale_keys = dict()
+        for source, current_keys in self._current_keys.items():
+            previous_keys = self._previous_keys.get(source, set())
+            if source in self._incomplete_sources:
+                # Pages that failed to extract must not wipe the chunks indexed by a previous run
+                print(f"Keeping stale chunks of {source}, some pages could not be extracted")
+                self.manifest_store.save(source, previous_keys | current_keys)
+                changed = changed or bool(current_keys - previous_keys)
+                continue
+            stale_keys[source] = previous_keys - current_keys
+
+        deletes = [{FIELDS_ID: key} for keys in stale_keys.values() for key in keys]
+        failed_keys = self._write(self.index_writer.delete_documents, deletes) if deletes else set()
+        for source, source_stale_keys in stale_keys.items():
+            current_keys = self._current_keys[source]
+            new_keys = current_keys - self._previous_keys.get(source, set())
+            # Stale chunks that could not be deleted stay in the manifest, the next upload deletes them again
+            kept_keys = source_stale_keys & failed_keys
+            print(f"{source}: {len(new_keys)} new, {len(source_stale_keys) - len(kept_keys)} stale chunks deleted"
+                  + (f", {len(kept_keys)} failed to delete" if kept_keys else ""))
+            self.manifest_store.save(source, current_keys | kept_keys)
+            changed = changed or bool(new_keys) or len(kept_keys) < len(source_stale_keys)
+
+        if changed:
+            # Invalidates the answers cached for this index
+            self.manifest_store.bump_version()
+
+    def snapshot(self) -> List[dict]:
+        snapshot = [stage.snapshot() for stage in self.stats.values()]
+        if self._upload_tracker is not None:
+            upload_stats = self._upload_tracker.stats()
+            for stage in snapshot:
+                if stage["stage"] == "upload":
+                    stage.update(
+                        failed=upload_stats["failed"],
+                        batches=upload_stats["batches"],
+                        p50_batch_ms=round(upload_stats["p50_batch_ms"]),
+                        max_batch_ms=round(upload_stats["max_batch_ms"]),
+                    )
+        return snapshot
+
+    def run(self, files, on_progress: Optional[Callable[[List[dict]], None]] = None, poll_interval=0.5) -> List[dict]:
+        threads = [
+            threading.Thread(target=self._run_stage, args=("extract", self._extract, files), name="ingest-extract"),
+            threading.Thread(target=self._run_stage, args=("split", self._split), name="ingest-split"),
+            threading.Thread(target=self._run_stage, args=("upload", self._upload), name="ingest-upload"),
+        ]
+        threads += [
+            threading.Thread(target=self._run_stage, args=("embed", self._embed), name=f"ingest-embed-{idx}")
+            for idx in range(self.embed_workers)
+        ]
+
+        start_time = time.perf_counter()
+        # The writer is shared per index, only the outcome of this run's documents is tracked
+        self._upload_tracker = self.index_writer.track(FIELDS_ID, self._on_upload_result)
+        try:
+            for thread in threads:
+                thread.start()
+
+            # Progress is reported from the calling thread so streamlit elements can be updated
+            while any(thread.is_alive() for thread in threads):
+                if on_progress:
+                    on_progress(self.snapshot())
+                time.sleep(poll_interval)
+
+            for thread in threads:
+                thread.join()
+        finally:
+            self.index_writer.untrack(self._upload_tracker)
+
+        snapshot = self.snapshot()
+        if on_progress:
+            on_progress(snapshot)
+
+        if self._error is not None:
+            raise self._error
+
+        # Documents of a batch whose request raised are dropped by the sender without a callback
+        missing_keys = self._upload_tracker.missing()
+        if missing_keys:
+            print(f"{len(missing_keys)} documents were never acknowledged by index [{self.index_writer.index_name}]")
+        failed_actions = len(self._upload_tracker.failed) + len(missing_keys)
+        if failed_actions > 0:
+            # Manifests are left untouched so the next upload retries the missing chunks
+            raise RuntimeError(f"{failed_actions} documents could not be written to index [{self.index_writer.index_name}]")
+
+        if self.deduplicator is not None:
+            self._merge_occurrences()
+
+        if self.manifest_store is not None:
+            self._sync_manifests()
+
+        print(f"Ingestion completed in {time.perf_counter() - start_time:.2f} seconds: {snapshot}")
+        return snapshot
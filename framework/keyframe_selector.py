@@ -0,0 +1,83 @@
+import os
+from typing import Optional
+import cv2
+import numpy as np
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class KeyframeSelector:
+    """
+    Keeps a frame only when the scene changed since the last kept frame.
+
+    Candidate frames (one every `scan_interval` seconds) are downscaled and reduced to a signature:
+    the normalized per-channel colour histogram ("histogram") or the grayscale pixels ("pixel").
+    A candidate becomes a keyframe when its distance to the last keyframe reaches `threshold`, but never
+    sooner than `min_gap` seconds after it; after `max_gap` seconds a frame is kept regardless, so long
+    static scenes are still covered.
+    """
+
+    def __init__(self, method: str = None, threshold: float = None, min_gap: float = None, max_gap: float = None,
+                 scan_interval: float = None, size=(64, 36), bins: int = 16) -> None:
+        self.method = method or os.getenv("KEYFRAME_METHOD") or "histogram"
+        if self.method not in ("histogram", "pixel"):
+            raise ValueError(f"Invalid keyframe method: {self.method}")
+        default_threshold = 0.3 if self.method == "histogram" else 0.1
+        self.threshold = threshold or _env_float("KEYFRAME_THRESHOLD", default_threshold)
+        self.min_gap = min_gap if min_gap is not None else _env_float("KEYFRAME_MIN_GAP_SECONDS", 1.0)
+        self.max_gap = max_gap or _env_float("KEYFRAME_MAX_GAP_SECONDS", 30.0)
+        self.scan_interval = scan_interval or _env_float("KEYFRAME_SCAN_INTERVAL_SECONDS", 0.5)
+        self.size = size
+        self.bins = bins
+
+    def signature(self, frame: np.ndarray) -> np.ndarray:
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if self.method == "pixel":
+            return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255
+        # One bincount over the bin index of every channel value, offset per channel
+        channels = small.shape[2]
+        bin_ids = (small.astype(np.int32) * self.bins >> 8) + np.arange(channels) * self.bins
+        histogram = np.bincount(bin_ids.ravel(), minlength=channels * self.bins).astype(np.float32)
+        return histogram / (small.shape[0] * small.shape[1])
+
+    def distance(self, a: np.ndarray, b: np.ndarray) -> float:
+        if self.method == "pixel":
+            # Mean absolute difference, 0 (same) to 1
+            return float(np.abs(a - b).mean())
+        # Total variation distance averaged over the channels, 0 (same) to 1
+        return float(np.abs(a - b).sum() / 2 / (len(a) / self.bins))
+
+    def session(self) -> "KeyframeSession":
+        """ Selection state of one sequential pass over (a time range of) a video """
+        return KeyframeSession(self)
+
+
+class KeyframeSession:
+
+    def __init__(self, selector: KeyframeSelector) -> None:
+        self.selector = selector
+        self.last_time: Optional[float] = None
+        self.last_signature: Optional[np.ndarray] = None
+        self.candidates = 0
+        self.kept = 0
+
+    def offer(self, timestamp: float, frame: np.ndarray = None, signature: np.ndarray = None) -> bool:
+        """ True when the frame at `timestamp` (seconds) is a keyframe, its signature can be given instead of the frame """
+        self.candidates += 1
+        if self.last_time is not None:
+            gap = timestamp - self.last_time
+            if gap < self.selector.min_gap:
+                return False
+            if signature is None:
+                signature = self.selector.signature(frame)
+            if gap < self.selector.max_gap and self.selector.distance(signature, self.last_signature) < self.selector.threshold:
+                return False
+        elif signature is None:
+            signature = self.selector.signature(frame)
+        self.last_time = timestamp
+        self.last_signature = signature
+        self.kept += 1
+        return True
@@ -18,6 +18,9 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.runnables import Runnable
 
+from .embedding_cache import get_embedding_cache
+from .query_cache import get_query_vector_cache
+
 
 """
 This class is used to create an Embedding Agent that can be used to interact with Azure OpenAI.
@@ -28,6 +31,10 @@ class BaseEmbeddingAgent:
     def __init__(self):
         pass
 
+    @property
+    def model_name(self):
+        return type(self).__name__
+
     def get_text_embeddings(self, text):
         raise NotImplementedError("This method should be implemented in the derived class")
     
@@ -49,6 +56,13 @@ class AzureOpenAIEmbeddingsAgent(BaseEmbeddingAgent):
         Generate embeddings from string of text.
         This will be used to vectorize data and user input for interactions with Azure OpenAI.
         '''
+        return get_embedding_cache().get_or_compute(self.model_name, text, self._create_text_embeddings)
+
+    @property
+    def model_name(self):
+        return os.environ['AZURE_EMBEDDING_DEPLOYMENT_NAME']
+
+    def _create_text_embeddings(self, text):
         response = self.AOAI_client.embeddings.create(input=text, model=os.environ['AZURE_EMBEDDING_DEPLOYMENT_NAME'])
         embeddings =response.model_dump()
         return embeddings['data'][0]['embedding']
@@ -58,11 +72,22 @@ class AzureOpenAIEmbeddingsAgent(BaseEmbeddingAgent):
         
 
 class AIVisionEmbeddingsAgent(BaseEmbeddingAgent):
+
+    MODEL_VERSION = "2023-04-15"
+    DIMENSIONS = 1024
            
     def __init__(self):
         super().__init__()
     
     def get_text_embeddings(self, text):
+        return get_embedding_cache().get_or_compute(
+            self.model_name, text, self._create_text_embeddings, dimensions=self.DIMENSIONS)
+
+    @property
+    def model_name(self):
+        return f"ai-vision-{self.MODEL_VERSION}"
+
+    def _create_text_embeddings(self, text):
         # Create a code snippet for calling post api using requests
         vision_ep = os.environ["COGNITIVE_MULTISVC_ENDPOINT"]
         vision_key = os.environ["COGNITIVE_MULTISVC_API_KEY"]
@@ -103,7 +128,29 @@ class AIVisionEmbeddingsAgent(BaseEmbeddingAgent):
         print(response.json())
 
         return response.json()["vector"]
-        
+
+
+class QueryEmbeddingAgent(BaseEmbeddingAgent):
+    """
+    Embedding agent used at query time: text embeddings are served from the in-process query vector
+    cache before falling back to the wrapped agent.
+    """
+
+    def __init__(self, embedding_agent: BaseEmbeddingAgent):
+        super().__init__()
+        self.embedding_agent = embedding_agent
+        self.query_cache = get_query_vector_cache()
+
+    @property
+    def model_name(self):
+        return self.embedding_agent.model_name
+
+    def get_text_embeddings(self, text):
+        return self.query_cache.get_or_compute(self.model_name, text, self.embedding_agent.get_text_embeddings)
+
+    def get_image_embeddings(self, blob_image_path):
+        return self.embedding_agent.get_image_embeddings(blob_image_path)
+
 
 """
 This class is used to create a Language Model chain agent that can be used to interact with Azure OpenAI.
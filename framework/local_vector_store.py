@@ -0,0 +1,287 @@
+import os
+import json
+import uuid
+import pickle
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+
+# Map the vectors instead of reading them into each process. IO_FLAG_MMAP_IFC (faiss >= 1.9) also
+# covers flat indexes, older builds only map the inverted lists and read the rest into memory.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+INDEX_MODES = ("flat", "fp16", "int8", "pq")
+
+# Product quantization needs enough vectors to train 256 centroids per sub-quantizer
+PQ_MIN_TRAINING_VECTORS = 256 * 39
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# Modes whose quantizer is trained on a sample of the vectors before any is added
+TRAINED_INDEX_MODES = ("int8", "pq")
+
+
+def _new_faiss_index(dimensions: int, index_mode: str, pq_sub_vector_dims: int = 16):
+    if index_mode == "flat":
+        return faiss.IndexFlatL2(dimensions)
+    if index_mode == "fp16":
+        return faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_mode == "int8":
+        return faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if index_mode == "pq":
+        return faiss.IndexPQ(dimensions, dimensions // pq_sub_vector_dims, 8, faiss.METRIC_L2)
+    raise ValueError(f"Invalid index mode: {index_mode}. Supported modes are {INDEX_MODES}")
+
+
+def create_faiss_index(vectors: np.ndarray, index_mode: str = "flat", pq_sub_vector_dims: int = 16):
+    """
+    L2 index over float32 vectors in one of the supported storage modes:
+    flat (4 bytes per dimension), fp16 (2), int8 scalar quantization (1) or product quantization
+    (1 byte per `pq_sub_vector_dims` dimensions, 96 bytes for a 1536 dimensional vector).
+    """
+    if index_mode == "pq" and len(vectors) < PQ_MIN_TRAINING_VECTORS:
+        print(f"Only {len(vectors)} vectors to train product quantization, using int8 instead")
+        index_mode = "int8"
+
+    index = _new_faiss_index(vectors.shape[1], index_mode, pq_sub_vector_dims)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def exact_rescore(query: np.ndarray, candidate_ids: np.ndarray, vectors: np.ndarray, k: int):
+    """ Re-rank candidates of a compressed index by their exact L2 distance to the query """
+    # Rows are read in ascending order, which keeps reads of a memory-mapped matrix sequential
+    candidate_ids = np.sort(candidate_ids[candidate_ids >= 0])
+    distances = ((np.asarray(vectors[candidate_ids]) - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return candidate_ids[order], distances[order]
+
+
+class RescoringFAISS(FAISS):
+    """
+    FAISS store over a compressed index that fetches `rescore_factor` times more candidates
+    and re-ranks them against the full precision vectors, kept memory-mapped on disk.
+    """
+
+    def __init__(self, *args, exact_vectors=None, rescore_factor=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact_vectors = exact_vectors
+        self.rescore_factor = rescore_factor
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter=None, fetch_k: int = 20, **kwargs):
+        if filter is not None or self.exact_vectors is None:
+            return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+        query = np.array([embedding], dtype=np.float32)
+        _, candidate_ids = self.index.search(query, k * self.rescore_factor)
+        ids, distances = exact_rescore(query[0], candidate_ids[0], self.exact_vectors, k)
+
+        docs = list()
+        for idx, distance in zip(ids, distances):
+            doc = self.docstore.search(self.index_to_docstore_id[int(idx)])
+            docs.append((doc, float(distance)))
+        return docs
+
+
+def build_faiss_store(texts: List[str], embeddings, index_mode: str = "flat", rescore_factor: int = 0,
+                      metadatas: Optional[List[dict]] = None, batch_size: int = None, train_size: int = None,
+                      vectors_path=None) -> FAISS:
+    """
+    Embeds the texts and adds them to the index `batch_size` at a time, so besides the index only one
+    batch of vectors is in memory. Quantized indexes are first trained on the vectors of `train_size`
+    texts sampled across the corpus, which are reused when their batch is added. With rescoring the
+    full precision vectors are written to the .npy file `vectors_path` (memory-mapped), or kept in
+    memory without one.
+    """
+    batch_size = batch_size or _env_int("LOCAL_VECTOR_BUILD_BATCH_SIZE", 1024)
+    train_size = train_size or _env_int("LOCAL_VECTOR_TRAIN_SIZE", PQ_MIN_TRAINING_VECTORS)
+    if index_mode == "pq" and len(texts) < PQ_MIN_TRAINING_VECTORS:
+        print(f"Only {len(texts)} vectors to train product quantization, using int8 instead")
+        index_mode = "int8"
+
+    def embed(batch: List[str]) -> np.ndarray:
+        return np.asarray(embeddings.embed_documents(batch), dtype=np.float32)
+
+    index = None
+    sample = dict()
+    if index_mode in TRAINED_INDEX_MODES:
+        if index_mode == "pq":
+            train_size = max(train_size, PQ_MIN_TRAINING_VECTORS)
+        positions = np.sort(np.random.default_rng(0).choice(len(texts), min(train_size, len(texts)), replace=False))
+        training = np.concatenate([embed([texts[position] for position in positions[start:start + batch_size]])
+                                   for start in range(0, len(positions), batch_size)])
+        index = _new_faiss_index(training.shape[1], index_mode)
+        index.train(training)
+        sample = dict(zip(positions.tolist(), training))
+        print(f"Trained {index_mode} index on {len(training)} sampled vectors")
+
+    exact_vectors = None
+    for start in range(0, len(texts), batch_size):
+        end = min(start + batch_size, len(texts))
+        missing = [position for position in range(start, end) if position not in sample]
+        embedded = iter(embed([texts[position] for position in missing]) if missing else [])
+        vectors = np.stack([sample.pop(position) if position in sample else next(embedded) for position in range(start, end)])
+        if index is None:
+            index = _new_faiss_index(vectors.shape[1], index_mode)
+        index.add(vectors)
+
+        if index_mode != "flat" and rescore_factor > 0:
+            if exact_vectors is None:
+                shape = (len(texts), vectors.shape[1])
+                exact_vectors = (np.lib.format.open_memmap(str(vectors_path), mode="w+", dtype=np.float32, shape=shape)
+                                 if vectors_path is not None else np.empty(shape, dtype=np.float32))
+            exact_vectors[start:end] = vectors
+
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        ids[idx]: Document(page_content=text, metadata=metadatas[idx] if metadatas else {})
+        for idx, text in enumerate(texts)
+    })
+    index_to_docstore_id = dict(enumerate(ids))
+
+    if exact_vectors is not None:
+        return RescoringFAISS(embeddings, index, docstore, index_to_docstore_id,
+                              exact_vectors=exact_vectors, rescore_factor=rescore_factor)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def content_key(contents: Iterable[bytes], params: dict) -> str:
+    """ Order independent hash of a set of contents plus the parameters used to index them """
+    digests = sorted(hashlib.sha256(content).hexdigest() for content in contents)
+    payload = json.dumps({"contents": digests, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LocalVectorStoreCache:
+    """
+    Disk backed cache of FAISS vector stores keyed by the content hash of what was indexed.
+
+    Stores are written once with save_local into a temporary directory and renamed into place,
+    then always loaded back with the vectors memory-mapped read-only. Sessions of one process share
+    the same loaded store, and worker processes share the pages of the mapped file.
+
+    Only the vectors are mapped, the docstore of a loaded store is in memory: at most `max_stores`
+    stores stay loaded, the least recently used one is dropped first. A build or load only blocks
+    the sessions waiting for the same key.
+    """
+
+    def __init__(self, root_dir=None, index_mode=None, rescore_factor=None, max_stores=None) -> None:
+        self.root_dir = Path(root_dir or os.getenv("LOCAL_VECTOR_STORE_DIR") or "./.cache/vector_stores")
+        self.index_mode = index_mode or os.getenv("LOCAL_VECTOR_INDEX_MODE") or "flat"
+        self.rescore_factor = rescore_factor if rescore_factor is not None else _env_int("LOCAL_VECTOR_RESCORE_FACTOR", 0)
+        self.max_stores = max_stores or _env_int("LOCAL_VECTOR_STORE_CACHE_SIZE", 4)
+        self._stores = OrderedDict()
+        self._key_locks = dict()
+        self._lock = threading.Lock()
+
+    def _load(self, path: Path, embeddings) -> FAISS:
+        index = faiss.read_index(str(path / "index.faiss"), MMAP_FLAGS)
+        # The pickle is written by save_local of this cache, never from user input
+        with open(path / "index.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        if (path / "vectors.npy").exists():
+            return RescoringFAISS(
+                embeddings, index, docstore, index_to_docstore_id,
+                exact_vectors=np.load(path / "vectors.npy", mmap_mode="r"),
+                rescore_factor=self.rescore_factor
+            )
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id
+        )
+
+    def _save(self, store: FAISS, path: Path) -> None:
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.root_dir / f".{path.name}.{uuid.uuid4().hex}"
+        store.save_local(str(temp_path))
+        exact_vectors = getattr(store, "exact_vectors", None)
+        if isinstance(exact_vectors, np.memmap):
+            # Written by build_faiss_store next to the stores, only moved into place
+            exact_vectors.flush()
+            os.replace(exact_vectors.filename, temp_path / "vectors.npy")
+        elif exact_vectors is not None:
+            np.save(temp_path / "vectors.npy", exact_vectors)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Another process published the same store first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def store_params(self) -> dict:
+        return {"index_mode": self.index_mode, "rescore_factor": self.rescore_factor}
+
+    def build(self, texts: List[str], embeddings, metadatas: Optional[List[dict]] = None) -> FAISS:
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        vectors_path = self.root_dir / f".vectors.{uuid.uuid4().hex}.npy"
+        return build_faiss_store(texts, embeddings, self.index_mode, self.rescore_factor, metadatas, vectors_path=vectors_path)
+
+    def _loaded(self, key: str) -> Optional[FAISS]:
+        with self._lock:
+            store = self._stores.get(key)
+            if store is not None:
+                self._stores.move_to_end(key)
+            return store
+
+    def load_or_build(self, key: str, build: Callable[[], FAISS], embeddings) -> FAISS:
+        store = self._loaded(key)
+        if store is not None:
+            print(f"Using loaded vector store {key}")
+            return store
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another session may have loaded the store while this one waited
+            store = self._loaded(key)
+            if store is not None:
+                print(f"Using loaded vector store {key}")
+                return store
+
+            path = self.root_dir / key
+            if not (path / "index.faiss").exists():
+                print(f"Building vector store {key}")
+                self._save(build(), path)
+            else:
+                print(f"Loading vector store {key} from {path}")
+
+            store = self._load(path, embeddings)
+            # Identifies the indexed content, e.g. for the answer cache
+            store.store_key = key
+            with self._lock:
+                self._stores[key] = store
+                while len(self._stores) > self.max_stores:
+                    evicted, _ = self._stores.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+                    print(f"Unloaded vector store {evicted}")
+            return store
+
+
+_local_vector_store_cache = None
+_local_vector_store_cache_lock = threading.Lock()
+
+
+def get_local_vector_store_cache() -> LocalVectorStoreCache:
+    global _local_vector_store_cache
+    with _local_vector_store_cache_lock:
+        if _local_vector_store_cache is None:
+            _local_vector_store_cache = LocalVectorStoreCache()
+        return _local_vector_store_cache
@@ -0,0 +1,85 @@
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from .schema import VectorSearchItem, VectorSearchResult
+
+
+class PagedVectorSearchResult:
+    """
+    Lazy result of a vector search shared by every backend.
+
+    Wraps the page iterator of the backend (Cosmos NoSQL continuation pages, a Mongo cursor batch,
+    AI Search result pages) and converts raw items to VectorSearchItem as they are consumed. A page
+    is only requested when iteration reaches it, and at most `limit` items are returned. Items that
+    were already fetched are kept, so the result can be iterated or indexed more than once.
+    `query` is the backend query object when it reports more about its pages (e.g. CosmosQueryPages).
+    """
+
+    def __init__(self, pages: Iterable[Iterable[dict]], to_item: Callable[[dict], VectorSearchItem], limit: Optional[int] = None,
+                 name: str = "", query=None) -> None:
+        self.limit = limit
+        self.name = name
+        self.query = query
+        self.pages_fetched = 0
+        self._pages = iter(pages)
+        self._to_item = to_item
+        self._items: List[VectorSearchItem] = list()
+        self._exhausted = False
+
+    def _fetch_page(self) -> bool:
+        if self._exhausted:
+            return False
+        if self.limit is not None and len(self._items) >= self.limit:
+            self._exhausted = True
+            return False
+        try:
+            page = next(self._pages)
+        except StopIteration:
+            self._exhausted = True
+            return False
+
+        self.pages_fetched += 1
+        count = 0
+        for raw_item in page:
+            if self.limit is not None and len(self._items) >= self.limit:
+                break
+            self._items.append(self._to_item(raw_item))
+            count += 1
+        print(f"[{self.name}] Fetched page {self.pages_fetched} with {count} items")
+        return True
+
+    def __iter__(self) -> Iterator[VectorSearchItem]:
+        idx = 0
+        while True:
+            while idx >= len(self._items):
+                if not self._fetch_page():
+                    return
+            yield self._items[idx]
+            idx += 1
+
+    def __getitem__(self, idx: int) -> VectorSearchItem:
+        if idx < 0:
+            return self._fetch_all()[idx]
+        while idx >= len(self._items) and self._fetch_page():
+            pass
+        return self._items[idx]
+
+    def first(self) -> Optional[VectorSearchItem]:
+        return next(iter(self), None)
+
+    def _fetch_all(self) -> List[VectorSearchItem]:
+        while self._fetch_page():
+            pass
+        return self._items
+
+    def __len__(self) -> int:
+        # Fetches every remaining page
+        return len(self._fetch_all())
+
+    def to_result(self) -> VectorSearchResult:
+        return VectorSearchResult(items=list(self._fetch_all()))
+
+
+def split_document(raw_item: dict, score_field: str) -> VectorSearchItem:
+    """ VectorSearchItem of a raw backend item that carries its score next to the document fields """
+    document = {key: value for key, value in raw_item.items() if key != score_field and not key.startswith("@search.")}
+    return VectorSearchItem(similarity_score=raw_item.get(score_field) or 0.0, document=document)
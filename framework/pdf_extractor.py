@@ -0,0 +1,98 @@
+import os
+import multiprocessing
+from collections import deque
+from io import BytesIO
+from typing import Iterator
+from PyPDF2 import PdfReader
+from langchain.docstore.document import Document
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+PDF_EXTRACTION_WORKERS = _env_int("PDF_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1))
+PDF_PAGE_TIMEOUT = _env_int("PDF_PAGE_TIMEOUT", 30)
+
+# Parsed once per worker process by the pool initializer
+_worker_reader = None
+
+
+def _init_worker(pdf_bytes):
+    global _worker_reader
+    _worker_reader = PdfReader(BytesIO(pdf_bytes))
+
+
+def _extract_page(page_index):
+    return _worker_reader.pages[page_index].extract_text() or ""
+
+
+def read_pdf_bytes(pdf_file) -> bytes:
+    # Accepts streamlit uploads, file objects and paths
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    if hasattr(pdf_file, "read"):
+        if hasattr(pdf_file, "seek"):
+            pdf_file.seek(0)
+        return pdf_file.read()
+    with open(pdf_file, "rb") as f:
+        return f.read()
+
+
+def iter_pdf_pages(pdf_file, max_workers=None, page_timeout=None, prefetch=None) -> Iterator[Document]:
+    """
+    Extract the text of every page of a PDF on a process pool and yield one Document per page in page order.
+    At most `prefetch` pages are in flight, so memory does not grow with the page count. A page that takes
+    longer than `page_timeout` seconds is yielded empty with `extraction_timeout` set in its metadata and
+    the pool is recycled so the stuck worker does not hold a slot for the rest of the file.
+    """
+    source = getattr(pdf_file, "name", str(pdf_file))
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    page_count = len(PdfReader(BytesIO(pdf_bytes)).pages)
+    if page_count == 0:
+        return
+
+    workers = max(1, min(max_workers or PDF_EXTRACTION_WORKERS, page_count))
+    page_timeout = page_timeout or PDF_PAGE_TIMEOUT
+    window = prefetch or workers * 2
+
+    def create_pool():
+        return multiprocessing.Pool(processes=workers, initializer=_init_worker, initargs=(pdf_bytes,))
+
+    pool = create_pool()
+    pending = deque()
+    next_page = 0
+    try:
+        while next_page < page_count and len(pending) < window:
+            pending.append((next_page, pool.apply_async(_extract_page, (next_page,))))
+            next_page += 1
+
+        while pending:
+            page_index, result = pending.popleft()
+            metadata = {'source': source, 'page': page_index + 1}
+            try:
+                text = result.get(timeout=page_timeout)
+            except multiprocessing.TimeoutError:
+                print(f"Timed out extracting page {page_index + 1} of {source} after {page_timeout} seconds")
+                text = ""
+                metadata['extraction_timeout'] = True
+                # Replace the pool to get rid of the stuck worker and resubmit the pages in flight
+                pool.terminate()
+                pool.join()
+                pool = create_pool()
+                pending = deque(
+                    (idx, pool.apply_async(_extract_page, (idx,))) for idx, _ in pending)
+            except Exception as e:
+                print(f"Error extracting page {page_index + 1} of {source}: {e}")
+                text = ""
+                metadata['extraction_error'] = str(e)
+
+            if next_page < page_count:
+                pending.append((next_page, pool.apply_async(_extract_page, (next_page,))))
+                next_page += 1
+
+            yield Document(page_content=text, metadata=metadata)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+from .embedding_cache import EmbeddingCache
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class QueryVectorCache:
+    """
+    In-process LRU cache of query embeddings bounded by entry count and age.
+
+    Sits in front of the embedding agents at query time so a prompt that was searched recently,
+    by any session of the process, is not sent to the embedding endpoint again. Every entry keeps
+    the time its embedding took, which is what a hit on it saves.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None) -> None:
+        self.max_entries = max_entries or _env_int("QUERY_VECTOR_CACHE_SIZE", 1024)
+        self.ttl_seconds = ttl_seconds or _env_int("QUERY_VECTOR_CACHE_TTL", 600)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.saved_seconds = 0.0
+        self.compute_seconds = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model: str, text: str):
+        key = (model, EmbeddingCache.normalize(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+    def put(self, model: str, text: str, vector, compute_seconds: float = 0.0) -> None:
+        key = (model, EmbeddingCache.normalize(text))
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic(), compute_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, model: str, text: str, compute: Callable) -> List[float]:
+        vector = self.get(model, text)
+        if vector is not None:
+            return vector
+
+        start_time = time.perf_counter()
+        vector = compute(text)
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self.compute_seconds += elapsed
+        if vector:
+            self.put(model, text, vector, elapsed)
+        return vector
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_ms": self.saved_seconds * 1000,
+                "avg_embedding_ms": self.compute_seconds * 1000 / self.misses if self.misses else 0.0,
+            }
+
+
+_query_vector_cache = None
+_query_vector_cache_lock = threading.Lock()
+
+
+def get_query_vector_cache() -> QueryVectorCache:
+    """ Process wide cache shared by every query time embedding call """
+    global _query_vector_cache
+    with _query_vector_cache_lock:
+        if _query_vector_cache is None:
+            _query_vector_cache = QueryVectorCache()
+        return _query_vector_cache
@@ -126,9 +126,12 @@ class MediaAssetInfo(BaseModel):
 
 class VideoFrameSummary(BaseModel):
     id: str
+    # Offset of the frame in whole seconds, also the name of its blob
     frame_id: int
     asset_name: str
     url: str
+    # Position of the frame in the video, in seconds
+    timestamp: float = 0.0
     summary: str = ''
     summary_vector: List = list()
     created_at: str = datetime.now().isoformat()
@@ -1,7 +1,7 @@
 import os
 from azure.identity import ClientSecretCredential, DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ContentSettings
-from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
 from datetime import datetime, timezone, timedelta
 from azure.storage.blob import ResourceTypes, AccountSasPermissions, generate_blob_sas, generate_account_sas
 
@@ -69,9 +69,16 @@ class StorageHelper(object):
         return blob_client.url
 
     def download_blob(self, blob_key, file_path):
-         with open(file_path, "wb") as blob_file:
-                download_stream = self.blob_client.download_blob()
-                blob_file.write(download_stream.readall())
+        with open(file_path, "wb") as blob_file:
+            download_stream = self.container_client.get_blob_client(blob_key).download_blob()
+            download_stream.readinto(blob_file)
+
+    def download_blob_bytes(self, blob_key):
+        # Content of the blob, None when it does not exist
+        try:
+            return self.container_client.get_blob_client(blob_key).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
 
     def list_blobs(self):
         # List the blobs in the container
@@ -80,6 +87,10 @@ class StorageHelper(object):
             print(blob.name)
         return blob_list
     
+    def list_blob_names(self, prefix):
+        # Names of the blobs under a prefix
+        return [blob.name for blob in self.container_client.list_blobs(name_starts_with=prefix)]
+
     def delete_blob(self, blob_key):
         # Delete a blob
         self.container_client.delete_blob(blob_key)
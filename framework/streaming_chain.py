@@ -0,0 +1,193 @@
+import time
+import queue
+import asyncio
+import threading
+from typing import Callable, Iterator, List, Optional
+from langchain.docstore.document import Document
+from langchain_core.messages import get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+
+from .answer_cache import describe_vector_store, get_answer_cache
+from .query_cache import get_query_vector_cache
+
+
+# Marks the end of the token stream
+_END = object()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop of the process, run forever on a daemon thread. The async clients of the LLMs pool
+    their connections on the loop that opened them, so every request has to run on the same loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-stream-loop", daemon=True).start()
+        return _loop
+
+
+class StreamingAnswer:
+    """
+    Answer of a StreamingRAGChain request that is still being generated.
+
+    The retrieved documents are available from `wait_for_docs()` before the first token, iterating
+    the answer yields the tokens as they arrive (e.g. into st.write_stream), and `ttft_ms` /
+    `total_ms` are set once the first token / the whole answer arrived.
+    """
+
+    def __init__(self, question: str) -> None:
+        self.question = question
+        self.docs: Optional[List[Document]] = None
+        self.answer = ""
+        self.cached = False
+        self.ttft_ms = None
+        self.total_ms = None
+        self._docs_ready = threading.Event()
+        self._tokens = queue.Queue()
+        self._error: Optional[BaseException] = None
+
+    def set_docs(self, docs: List[Document]):
+        self.docs = docs
+        self._docs_ready.set()
+
+    def wait_for_docs(self, timeout=None) -> List[Document]:
+        self._docs_ready.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self.docs or list()
+
+    def put(self, token: str):
+        self.answer += token
+        self._tokens.put(token)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self._error = error
+        self._docs_ready.set()
+        self._tokens.put(_END)
+
+    def __iter__(self) -> Iterator[str]:
+        while (token := self._tokens.get()) is not _END:
+            yield token
+        if self._error is not None:
+            raise self._error
+
+
+class StreamingRAGChain:
+    """
+    Retrieval augmented chain that streams the completion token by token.
+
+    Every request runs as a coroutine on the event loop thread shared by the process: the (condensed) question is
+    answered from the semantic answer cache when possible, otherwise documents are retrieved and
+    published first, then the LLM output is streamed with `astream`. Time to first token is logged
+    for every request. With a memory, follow-up questions are condensed with the chat history first
+    and every answer is saved to the memory.
+
+    `combine_documents(docs, question)` builds the context string of the prompt.
+    """
+
+    def __init__(self, llm, retriever, prompt, combine_documents: Callable, vector_store=None, embed_query: Callable = None,
+                 model_name: str = None, memory=None, condense_prompt=None, index_name: str = None,
+                 chain_id: str = None) -> None:
+        self.llm = llm
+        self.retriever = retriever
+        self.answer_chain = prompt | llm | StrOutputParser()
+        self.combine_documents = combine_documents
+        self.memory = memory
+        self.condense_chain = (condense_prompt | llm | StrOutputParser()) if condense_prompt is not None else None
+        self.embed_query = embed_query
+        self.model_name = model_name
+        self.answer_cache = None
+        if (vector_store is not None or index_name is not None) and embed_query is not None:
+            self.cache_scope, self.cache_version = describe_vector_store(vector_store, index_name)
+            if self.cache_scope is not None:
+                self.answer_cache = get_answer_cache()
+                if chain_id:
+                    self.cache_scope = f"{self.cache_scope}|{chain_id}"
+
+    @property
+    def chat_history(self) -> list:
+        return self.memory.chat_memory.messages if self.memory is not None else list()
+
+    async def _run(self, answer: StreamingAnswer, inputs: dict):
+        start_time = time.perf_counter()
+        question = answer.question
+        first_turn = len(self.chat_history) == 0
+
+        cache_key = None
+        if self.answer_cache is not None and first_turn:
+            persona = inputs.get("persona")
+            scope = f"{self.cache_scope}|{persona}" if persona else self.cache_scope
+            version = self.cache_version()
+            vector = await asyncio.to_thread(get_query_vector_cache().get_or_compute, self.model_name, question, self.embed_query)
+            hit = self.answer_cache.lookup(scope, question, vector, version)
+            if hit is not None:
+                payload, _ = hit
+                answer.cached = True
+                answer.set_docs(payload.get("docs") or list())
+                answer.ttft_ms = (time.perf_counter() - start_time) * 1000
+                answer.put(payload["answer"])
+                self._save(question, answer)
+                print(f"Served cached answer in {answer.ttft_ms:.0f} ms")
+                return
+            cache_key = (scope, vector, version)
+
+        standalone_question = question
+        if self.condense_chain is not None and not first_turn:
+            standalone_question = await self.condense_chain.ainvoke({
+                "question": question, "chat_history": get_buffer_string(self.chat_history)
+            })
+
+        # The retrievers are synchronous (AI Search has no async retriever), run them off the loop
+        docs = await asyncio.to_thread(self.retriever.invoke, standalone_question)
+        answer.set_docs(docs)
+        retrieval_ms = (time.perf_counter() - start_time) * 1000
+
+        context = self.combine_documents(docs, standalone_question)
+        async for token in self.answer_chain.astream({**inputs, "question": standalone_question, "context": context}):
+            if answer.ttft_ms is None:
+                answer.ttft_ms = (time.perf_counter() - start_time) * 1000
+                print(f"Time to first token: {answer.ttft_ms:.0f} ms (retrieval {retrieval_ms:.0f} ms)")
+            answer.put(token)
+
+        answer.total_ms = (time.perf_counter() - start_time) * 1000
+        print(f"Streamed answer of {len(answer.answer)} chars in {answer.total_ms:.0f} ms")
+        self._save(question, answer)
+        if cache_key is not None:
+            scope, vector, version = cache_key
+            self.answer_cache.store(scope, question, vector, version, {"answer": answer.answer, "docs": docs})
+
+    def _save(self, question: str, answer: StreamingAnswer):
+        if self.memory is not None:
+            self.memory.save_context({"question": question}, {"answer": answer.answer})
+
+    def stream(self, question: str, **inputs) -> StreamingAnswer:
+        """ Starts answering on a background event loop and returns the answer being streamed """
+        answer = StreamingAnswer(question)
+
+        def done(future):
+            error = asyncio.CancelledError() if future.cancelled() else future.exception()
+            if error is not None:
+                print(f"Streaming request failed: {error}")
+            answer.finish(error)
+
+        asyncio.run_coroutine_threadsafe(self._run(answer, inputs), _get_event_loop()).add_done_callback(done)
+        return answer
+
+    async def astream(self, question: str, **inputs):
+        """ Async generator of the answer tokens, for callers that already run an event loop """
+        # Still runs on the shared loop, the LLM clients may already be bound to it
+        answer = self.stream(question, **inputs)
+        while (token := await asyncio.to_thread(answer._tokens.get)) is not _END:
+            yield token
+        if answer._error is not None:
+            raise answer._error
+
+    def invoke(self, question: str, **inputs) -> dict:
+        answer = self.stream(question, **inputs)
+        text = "".join(answer)
+        return {"question": question, "answer": text, "docs": answer.docs, "chat_history": self.chat_history}
@@ -9,11 +9,13 @@ from PyPDF2 import PdfReader
 from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.vectorstores import faiss as FAISS
+from langchain_community.vectorstores import FAISS as FAISSVectorStore
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_openai import AzureChatOpenAI
 from langchain_openai import AzureOpenAIEmbeddings
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT, QA_PROMPT
 from azure.core.credentials import AzureKeyCredential
 from langchain_community.vectorstores import AzureSearch
 from langchain.schema import format_document
@@ -36,7 +38,22 @@ from .prompts import MSSQL_PROMPT
 from .utilities import ChainLogger
 from .storage_helper import StorageHelper
 from .cosmos_mongo_util import CosmosMongoClient
-from .llm_chain_agent import AzureOpenAIEmbeddingsAgent, AIVisionEmbeddingsAgent
+from .llm_chain_agent import AzureOpenAIEmbeddingsAgent, AIVisionEmbeddingsAgent, QueryEmbeddingAgent
+from .query_cache import get_query_vector_cache
+from .embedding_engine import BatchEmbeddingEngine
+from .embedding_cache import get_embedding_cache
+from .pdf_extractor import iter_pdf_pages, read_pdf_bytes
+from .chunker import TokenTextChunker
+from .dedup import deduplicate_documents, deduplicate_texts
+from .local_vector_store import content_key, get_local_vector_store_cache
+from .ingestion_pipeline import IngestionPipeline
+from .ingestion_manifest import ManifestStore
+from .index_writer import get_index_writer
+from .hybrid_retriever import get_hybrid_retriever
+from .answer_cache import CachedAnswerChain, chain_identity
+from .fanout_search import get_fanout_retriever
+from .streaming_chain import StreamingRAGChain
+from .context_packer import ContextPacker
 
 import dotenv
 from .az_ai_search_helper import *
@@ -73,18 +90,17 @@ client = AzureOpenAI(
     api_key= os.environ["AZURE_OPENAI_API_KEY"]
 )
 
-embeddings: AzureOpenAIEmbeddings = AzureOpenAIEmbeddings(
-    azure_deployment=model,
-    model=model,
-    chunk_size=1,
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    openai_api_type="azure",
-    openai_api_key=os.environ["AZURE_OPENAI_API_KEY"]
+# Batches chunks by token count and keeps several embedding requests in flight
+embeddings: BatchEmbeddingEngine = BatchEmbeddingEngine(
+    client=client,
+    deployment=model,
+    cache=get_embedding_cache()
 )
 
 langchain.verbose = False
 
-CHUNK_SIZE = 500
+# Chunk sizes are measured in tokens of the embedding model
+CHUNK_SIZE = 128
 OVERLAP_PCT = 25
 
 CHUNK_OVERLAP = int(CHUNK_SIZE * (OVERLAP_PCT / 100))
@@ -97,8 +113,11 @@ DEFAULT_DOCUMENT_PROMPT = PromptTemplate.from_template(
 def vectorize(text):
     global client
 
-    vector = client.embeddings.create(input=text, model=os.environ["AZURE_EMBEDDING_DEPLOYMENT_NAME"])
-    return vector.data[0].embedding if (vector and vector.data) else None
+    def create_embedding(text):
+        vector = client.embeddings.create(input=text, model=os.environ["AZURE_EMBEDDING_DEPLOYMENT_NAME"])
+        return vector.data[0].embedding if (vector and vector.data) else None
+
+    return get_embedding_cache().get_or_compute(os.environ["AZURE_EMBEDDING_DEPLOYMENT_NAME"], text, create_embedding)
 
 
 def generate_embeddings(input_text):
@@ -113,17 +132,16 @@ def generate_embeddings(input_text):
 
 
 def get_pdf_text(files):
-    text = ""
+    page_texts = []
     for f in files:
         print(f"Processing {f.name}")
-        # print(f"f object: {dir(f)}")
-        reader = PdfReader(f)
-        page_count = len(reader.pages)
-        for page in reader.pages:
-            text += page.extract_text()
+        page_count = 0
+        for page in iter_pdf_pages(f):
+            page_texts.append(page.page_content)
+            page_count += 1
         print(f"Page count: {page_count}")
 
-    return text
+    return "".join(page_texts)
 
 
 def load_csv(csv_file):
@@ -131,19 +149,18 @@ def load_csv(csv_file):
     return csv_loader.load()
 
 
+def get_text_chunker():
+    return TokenTextChunker(chunk_tokens=CHUNK_SIZE, overlap_tokens=CHUNK_OVERLAP)
+
+
 def get_text_chunks(text):
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
+    text_splitter = get_text_chunker()
+    chunks = deduplicate_texts(text_splitter.split_text(text))
     print(f"Number of chunks: {len(chunks)}")
     return chunks
 
 
-def get_vectors(chunks):
+def get_vectors(chunks, store_key=None):
 
     global embeddings
     if not embeddings:
@@ -152,7 +169,16 @@ def get_vectors(chunks):
     # text_embeddings = embeddings.embed_documents(chunks)
     # text_embeddings = [vectorize_with_delay(
     #     embeddings, chunk) for chunk in chunks]
-    vector_store = FAISS.from_texts(chunks, embeddings)
+    store_cache = get_local_vector_store_cache()
+    if store_key is None:
+        store_key = content_key([chunk.encode("utf-8") for chunk in chunks], {"model": model, **store_cache.store_params()})
+
+    # Built once per content, then shared memory-mapped across sessions and processes
+    vector_store = store_cache.load_or_build(
+        store_key,
+        lambda: store_cache.build(chunks, embeddings),
+        embeddings
+    )
 
     # text_embeddings = embed_with_delay(embeddings, chunks)
     # text_embedding_pairs = zip(chunks, text_embeddings)
@@ -162,23 +188,34 @@ def get_vectors(chunks):
     return vector_store
 
 
-def extract_and_split_documents(pdf_file):
-    reader = PdfReader(pdf_file)
-    docs = []
-    page_num = 1
-    for page in reader.pages:
-        docs.append(Document(page_content=page.extract_text(),
-                    metadata={'source': f"{pdf_file.name}", 'page': page_num}))
-        page_num += 1
+def iter_split_documents(pdf_file):
+    text_splitter = get_text_chunker()
 
-    text_splitter = CharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    pages = text_splitter.split_documents(docs)
+    # Pages are split as soon as they are extracted
+    for page in iter_pdf_pages(pdf_file):
+        yield from text_splitter.split_documents([page])
 
-    return pages
+
+def get_vectors_for_files(files):
+    # Keyed by the uploaded bytes, a cached store skips extraction and chunking entirely
+    store_cache = get_local_vector_store_cache()
+    store_key = content_key(
+        [read_pdf_bytes(f) for f in files],
+        {"model": model, "chunking": get_text_chunker().params(), "dedup": "text-confirmed", **store_cache.store_params()}
+    )
+    return store_cache.load_or_build(
+        store_key,
+        lambda: store_cache.build(get_text_chunks(get_pdf_text(files)), embeddings),
+        embeddings
+    )
+
+
+def extract_and_split_documents(pdf_file):
+    # One canonical copy per repeated header, footer or disclaimer, with the pages it occurs on
+    return deduplicate_documents(list(iter_split_documents(pdf_file)))
 
 
-def upload_docs_to_cogsearch_index(index_name, pdf_files):
+def upload_docs_to_cogsearch_index(index_name, pdf_files, on_progress=None):
 
     global embeddings
     if not embeddings:
@@ -192,17 +229,24 @@ def upload_docs_to_cogsearch_index(index_name, pdf_files):
         azure_search_endpoint=endpoint,
         azure_search_key=key,
         index_name=index_name,
-        embedding_function=embeddings.embed_query,
+        embedding_function=embeddings,
     )
 
     if not vector_store:
         raise ValueError(
             f"Index {index_name} does not exist. Please create the index first.")
 
-    for file in pdf_files:
-        docs = extract_and_split_documents(file)
-        print(f"Number of pages: {len(docs)}")
-        vector_store.add_documents(documents=docs)
+    text_splitter = get_text_chunker()
+
+    # Only chunks whose fingerprint is not in the manifest of their document get embedded
+    manifest_store = ManifestStore(index_name, chunking_params=text_splitter.params())
+    # The manifests are local, the index may have been deleted or recreated since they were written
+    index = get_az_search_index_client().get_index(index_name)
+    manifest_store.validate(index.e_tag, vector_store.client.get_document_count())
+
+    # Extraction, splitting, embedding and upload overlap through bounded queues
+    pipeline = IngestionPipeline(get_index_writer(index_name), embeddings, text_splitter, manifest_store=manifest_store)
+    return pipeline.run(pdf_files, on_progress=on_progress)
 
 
 def get_az_search_vector_store(index_name):
@@ -219,7 +263,7 @@ def get_az_search_vector_store(index_name):
         azure_search_endpoint=os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"],
         azure_search_key=os.environ["AZURE_SEARCH_ADMIN_KEY"],
         index_name=index_name,
-        embedding_function=embeddings.embed_query,
+        embedding_function=embeddings,
         fields=fields
     )
 
@@ -236,7 +280,7 @@ def embed_with_delay(embeddings, document):
     return embeddings.embed_documents(document)
 
 
-def get_conversation_chain(vector_store):
+def get_conversation_chain(vector_store, retriever=None):
 
     llm = AzureChatOpenAI(
         azure_deployment=os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"],
@@ -250,11 +294,53 @@ def get_conversation_chain(vector_store):
         memory_key="chat_history", return_messages=True)
     conversation_chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=vector_store.as_retriever(),
+        retriever=retriever or get_hybrid_retriever(vector_store),
         memory=memory
     )
 
-    return conversation_chain
+    # Repeated opening questions are answered from the semantic answer cache
+    chain_id = chain_identity("conversation", deployment_name=os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"], top_k=4)
+    return CachedAnswerChain(conversation_chain, vector_store, embeddings.embed_query, model, memory=memory, chain_id=chain_id)
+
+
+def get_fanout_conversation_chain(index_names):
+    # Searches every index concurrently with a single embedding of the question
+    query_cache = get_query_vector_cache()
+    retriever = get_fanout_retriever(index_names, lambda question: query_cache.get_or_compute(model, question, embeddings.embed_query))
+    return get_conversation_chain(retriever, retriever=retriever)
+
+
+def get_streaming_conversation_chain(vector_store, retriever=None):
+    # Same flow as get_conversation_chain, with the answer streamed token by token
+    llm = AzureChatOpenAI(
+        azure_deployment=os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"],
+        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        openai_api_type="azure",
+        openai_api_version=os.environ["OPENAI_API_VERSION"],
+        openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        streaming=True
+    )
+
+    memory = ConversationBufferMemory(
+        memory_key="chat_history", return_messages=True)
+    return StreamingRAGChain(
+        llm,
+        retriever or get_hybrid_retriever(vector_store),
+        QA_PROMPT,
+        lambda docs, question: _combine_documents(docs),
+        vector_store=vector_store,
+        embed_query=embeddings.embed_query,
+        model_name=model,
+        memory=memory,
+        condense_prompt=CONDENSE_QUESTION_PROMPT,
+        chain_id=chain_identity("streaming_conversation", QA_PROMPT, os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"], top_k=4)
+    )
+
+
+def get_streaming_fanout_conversation_chain(index_names):
+    query_cache = get_query_vector_cache()
+    retriever = get_fanout_retriever(index_names, lambda question: query_cache.get_or_compute(model, question, embeddings.embed_query))
+    return get_streaming_conversation_chain(retriever, retriever=retriever)
 
 
 def get_llm_conversation_chain():
@@ -275,6 +361,24 @@ def _combine_documents(docs, document_prompt=DEFAULT_DOCUMENT_PROMPT, document_s
     return document_separator.join(doc_strings)
 
 
+def get_context_packer():
+    # Document vectors come with the retrieved documents, the query vector from the query cache
+    query_cache = get_query_vector_cache()
+    return ContextPacker(
+        embed_query=lambda question: query_cache.get_or_compute(model, question, embeddings.embed_query)
+    )
+
+
+def show_query_cache_metrics(placeholder):
+    """ Hit ratio and embedding time saved by the query vector cache, rendered in a streamlit placeholder """
+    # Only the pages render streamlit elements, the framework is usable without it
+    import streamlit as st
+    stats = get_query_vector_cache().stats()
+    with placeholder.container():
+        st.metric(":blue[Query Cache Hit Ratio]", f"{stats['hit_ratio'] * 100:.0f}%", f"{stats['hits']} hits / {stats['misses']} misses", delta_color="off")
+        st.metric(":blue[Embedding Time Saved]", f"{stats['saved_ms']:.0f} ms", f"{stats['avg_embedding_ms']:.0f} ms per embedding", delta_color="off")
+
+
 def get_llm_chain_v2(prompt, vector_store, deployment_name="", top_k=5):
 
     if not deployment_name:
@@ -288,19 +392,18 @@ def get_llm_chain_v2(prompt, vector_store, deployment_name="", top_k=5):
         openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
         temperature=0.5
     )
-    retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": top_k}
-    )
+    # BM25 + vector for FAISS stores, a single text + vector query for AI Search
+    retriever = get_hybrid_retriever(vector_store, k=top_k)
 
     # Now we retrieve the documents
     retrieved_docs = RunnablePassthrough.assign(
         docs=itemgetter("question") | retriever
     )
 
-    # Now we construct the inputs for the final prompt
+    # Now we construct the inputs for the final prompt, packed into the context token budget
+    context_packer = get_context_packer()
     final_inputs = {
-        "context": lambda x: _combine_documents(x["docs"]),
+        "context": lambda x: context_packer(x["docs"], x["question"]),
         "question": itemgetter("question"),
         "persona": itemgetter("persona") or "",
     }
@@ -313,7 +416,34 @@ def get_llm_chain_v2(prompt, vector_store, deployment_name="", top_k=5):
     # And now we put it all together!
     chain = retrieved_docs | answer
 
-    return chain
+    chain_id = chain_identity("llm_chain_v2", prompt, deployment_name, top_k=top_k)
+    return CachedAnswerChain(chain, vector_store, embeddings.embed_query, model, chain_id=chain_id)
+
+
+def get_streaming_llm_chain(prompt, vector_store, deployment_name="", top_k=5):
+    """ Streaming variant of get_llm_chain_v2, answers with chain.stream(question, persona=...) """
+    if not deployment_name:
+        deployment_name = os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"]
+
+    llm = AzureChatOpenAI(
+        azure_deployment=deployment_name,
+        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        openai_api_type="azure",
+        openai_api_version=os.environ["OPENAI_API_VERSION"],
+        openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        temperature=0.5,
+        streaming=True
+    )
+    return StreamingRAGChain(
+        llm,
+        get_hybrid_retriever(vector_store, k=top_k),
+        prompt,
+        get_context_packer(),
+        vector_store=vector_store,
+        embed_query=embeddings.embed_query,
+        model_name=model,
+        chain_id=chain_identity("streaming_llm_chain", prompt, deployment_name, top_k=top_k)
+    )
 
 
 def get_llm_chain(prompt, vector_store):
@@ -325,7 +455,7 @@ def get_llm_chain(prompt, vector_store):
         openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
         temperature=0.5
     )
-    retriever = vector_store.as_retriever()
+    retriever = get_hybrid_retriever(vector_store)
 
     inputs = RunnableMap({
         "docs": RunnablePassthrough() | retriever,
@@ -339,8 +469,9 @@ def get_llm_chain(prompt, vector_store):
         "docs": RunnablePassthrough() | retriever,
     })
 
+    context_packer = get_context_packer()
     context2 = RunnablePassthrough.assign(
-        context=lambda x: _combine_documents(x["docs"]),
+        context=lambda x: context_packer(x["docs"], x["question"]),
     )
 
     find_answer = RunnableMap({
@@ -353,7 +484,8 @@ def get_llm_chain(prompt, vector_store):
     # c1 = context | find_answer
     # c = context | prompt | chat_llm  | StrOutputParser()
 
-    return c2
+    chain_id = chain_identity("llm_chain", prompt, os.environ["AZURE_CHATGPT_DEPLOYMENT_NAME"], top_k=4)
+    return CachedAnswerChain(c2, vector_store, embeddings.embed_query, model, chain_id=chain_id)
 
 
 def ask(question, llm_chain):
@@ -361,6 +493,11 @@ def ask(question, llm_chain):
     return answer
 
 
+def ask_streaming(question, llm_chain: StreamingRAGChain, **inputs):
+    """ Starts the answer and returns it right away; iterate it for the tokens, wait_for_docs() for the sources """
+    return llm_chain.stream(question, **inputs)
+
+
 # generate a function to take a list of array and sort it by the first element
 def sort_by_first_element(arr):
     return sorted(arr, key=lambda x: x[0])
@@ -463,15 +600,15 @@ def create_cosmos_nosql_vector_search_agent(container_names):
     cosmos_sql_agent = CosmosUtil(
             database=os.environ["AZURE_COSMOS_DATABASE_NAME"],
             containers=container_names,
-            embedding_agent = AzureOpenAIEmbeddingsAgent()
+            embedding_agent = QueryEmbeddingAgent(AzureOpenAIEmbeddingsAgent())
         )
     return cosmos_sql_agent
 
 def create_cosmos_mongo_vector_search_agent(container_names, db="ClipCognition", embedding_agent_type="aoai"):
     if embedding_agent_type == "aoai":
-        embedding_agent = AzureOpenAIEmbeddingsAgent()
+        embedding_agent = QueryEmbeddingAgent(AzureOpenAIEmbeddingsAgent())
     elif embedding_agent_type == "ai_vision":
-        embedding_agent = AIVisionEmbeddingsAgent()
+        embedding_agent = QueryEmbeddingAgent(AIVisionEmbeddingsAgent())
     else:
         raise ValueError(f"Invalid embedding agent type: {embedding_agent_type}")
 
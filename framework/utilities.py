@@ -80,3 +80,14 @@ class ChainLogger(BaseCallbackHandler):
 
     def on_agent_finish(self, output, **kwargs):
         self.logs.append(f"Agent finished with output: {output}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoder(encoding_name="cl100k_base"):
+    """ Load the tiktoken encoder once per process and reuse it """
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text, encoding_name="cl100k_base"):
+    return len(get_token_encoder(encoding_name).encode(text, disallowed_special=()))
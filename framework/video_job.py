@@ -0,0 +1,122 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from .ingestion_manifest import _write_atomic
+
+
+def video_asset_id(video_data: bytes, asset_name: str, vector_store_type) -> str:
+    """ Asset id derived from the video content, so the same upload resumes the same job """
+    digest = hashlib.sha256(video_data).hexdigest()
+    store = getattr(vector_store_type, "value", vector_store_type)
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"clipcognition:{store}:{asset_name}:{digest}"))
+
+
+class _LocalJobStore:
+
+    def __init__(self, job_dir=None) -> None:
+        self.job_dir = Path(job_dir or os.getenv("VIDEO_JOB_DIR") or "./.cache/video_jobs")
+
+    def load(self, asset_id: str) -> Optional[str]:
+        path = self.job_dir / f"{asset_id}.json"
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+    def save(self, asset_id: str, text: str) -> None:
+        _write_atomic(self.job_dir / f"{asset_id}.json", text)
+
+    def load_frames(self, asset_id: str, run: str) -> List[str]:
+        frame_dir = self.job_dir / asset_id / run
+        return [path.read_text(encoding="utf-8") for path in frame_dir.glob("*.json")] if frame_dir.exists() else []
+
+    def save_frame(self, asset_id: str, run: str, index: int, text: str) -> None:
+        _write_atomic(self.job_dir / asset_id / run / f"{index}.json", text)
+
+    def discard_frames(self, asset_id: str, run: str) -> None:
+        shutil.rmtree(self.job_dir / asset_id / run, ignore_errors=True)
+
+
+class _BlobJobStore:
+
+    def __init__(self, storage_helper) -> None:
+        self.storage_helper = storage_helper
+
+    def load(self, asset_id: str) -> Optional[str]:
+        data = self.storage_helper.download_blob_bytes(f"jobs/video/{asset_id}.json")
+        return data.decode("utf-8") if data is not None else None
+
+    def save(self, asset_id: str, text: str) -> None:
+        self.storage_helper.upload_blob_from_stream(text.encode("utf-8"), f"jobs/video/{asset_id}.json", "application/json")
+
+    def _frame_keys(self, asset_id: str, run: str) -> List[str]:
+        return self.storage_helper.list_blob_names(f"jobs/video/{asset_id}/{run}/")
+
+    def load_frames(self, asset_id: str, run: str) -> List[str]:
+        texts = (self.storage_helper.download_blob_bytes(key) for key in self._frame_keys(asset_id, run))
+        return [data.decode("utf-8") for data in texts if data is not None]
+
+    def save_frame(self, asset_id: str, run: str, index: int, text: str) -> None:
+        self.storage_helper.upload_blob_from_stream(text.encode("utf-8"), f"jobs/video/{asset_id}/{run}/{index}.json", "application/json")
+
+    def discard_frames(self, asset_id: str, run: str) -> None:
+        for key in self._frame_keys(asset_id, run):
+            self.storage_helper.delete_blob(key)
+
+
+class VideoJobManifest:
+    """
+    Checkpoints of the ingestion of one video asset: the completed stages with what they produced
+    (blob URLs, frame ids, transcription, ...) and the summary of every completed frame.
+
+    The manifest is saved after every stage, locally under VIDEO_JOB_DIR or, with VIDEO_JOB_STORE=blob,
+    next to the asset in blob storage. Frame summaries are appended as one record per frame under the
+    manifest's `run`, so completing a frame never rewrites the manifest. A job restarted for the same
+    asset id skips what is recorded. Checkpoints recorded with other `settings` (frame offset, frame
+    selection) are discarded, the frames they describe would differ.
+    """
+
+    def __init__(self, asset_id: str, asset_name: str, settings: dict, storage_helper=None, store_type=None) -> None:
+        self.asset_id = asset_id
+        store_type = store_type or os.getenv("VIDEO_JOB_STORE") or "local"
+        self.store = _BlobJobStore(storage_helper) if store_type == "blob" else _LocalJobStore()
+        self.manifest = {"asset_id": asset_id, "asset_name": asset_name, "settings": settings,
+                         "run": uuid.uuid4().hex, "stages": {}}
+        self.frames = dict()
+
+        text = self.store.load(asset_id)
+        if text:
+            manifest = json.loads(text)
+            if manifest.get("settings") == settings and "run" in manifest:
+                self.manifest = manifest
+                for record in self.store.load_frames(asset_id, manifest["run"]):
+                    record = json.loads(record)
+                    self.frames[record["index"]] = record
+                print(f"Resuming video job {asset_id}: stages {list(manifest['stages'])}, {len(self.frames)} frames summarized")
+            else:
+                print(f"Video job {asset_id} was recorded with other settings, starting over")
+                if "run" in manifest:
+                    self.store.discard_frames(asset_id, manifest["run"])
+
+    def _save(self):
+        self.manifest["updated_at"] = datetime.now().isoformat()
+        self.store.save(self.asset_id, json.dumps(self.manifest))
+
+    def stage(self, name: str) -> Optional[dict]:
+        """ Data recorded by a completed stage, None while the stage has not completed """
+        return self.manifest["stages"].get(name)
+
+    def complete(self, name: str, **data) -> None:
+        self.manifest["stages"][name] = data
+        self._save()
+
+    def frame(self, index: int) -> Optional[dict]:
+        return self.frames.get(index)
+
+    def complete_frame(self, index: int, record: dict) -> None:
+        record = dict(record, index=index)
+        self.frames[index] = record
+        self.store.save_frame(self.asset_id, self.manifest["run"], index, json.dumps(record))
@@ -4,13 +4,22 @@ import uuid
 from io import BytesIO
 from moviepy.editor import VideoFileClip, AudioFileClip
 import time
+import tempfile
+import queue
+import threading
 import base64
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from .storage_helper import StorageHelper
 from .az_ai_search_helper import *
 from .cosmos_util import CosmosUtil
 from .llm_chain_agent import AzureOpenAIEmbeddingsAgent
 from .cosmos_mongo_util import CosmosMongoClient
+from .index_writer import get_index_writer
+from .frame_sampler import FrameSampler, spool_video
+from .keyframe_selector import KeyframeSelector
+from .audio_transcriber import AudioTranscriber, AudioTrack, extract_audio
+from .video_job import VideoJobManifest, video_asset_id
 from openai import AzureOpenAI
 import requests
 from typing import List
@@ -25,26 +34,69 @@ from azure.core.exceptions import ResourceNotFoundError
 np.set_printoptions(precision=16)
 
 
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+FRAME_PROMPT_TEMPLATE = """
+
+            You an expert in extracting scene by scene details from sequence of frames of the video. 
+            While analyzing the frames, you are required to follow the following steps:
+
+            - Understand the overall context of the frames and Generate a detailed Chapter Analysis of the video based on the frames provided.
+            - Identify the scenes in each frame and build a detailed representation of the scenes.
+            - Considering the context of the previous frames and current frame, create a dense Chapter, Scene and Action summary of the video in markdown format.
+            - Never drop the context of the previous frames while analyzing the current frame.
+
+            ### Previous Frame Scene Representation
+
+            %s
+
+        """
+
+MERGE_PROMPT = """You are an expert in editing video analyses. The video was analyzed in consecutive, slightly overlapping segments and 
+you are given the Chapter, Scene and Action summary of every segment in order. Stitch them into one dense Chapter, Scene and Action 
+summary of the whole video: merge chapters that continue across segment boundaries, remove the repetitions caused by the overlap and 
+keep the order of events. Respond in Markdown."""
+
+# Marks the end of the frames of a segment
+_SEGMENT_DONE = object()
+
+
 class VideoProcessingAgent(object):
-    def __init__(self, video_file, vector_store_type, fps=5):
+    def __init__(self, video_file, vector_store_type, fps=5, summary_mode=None, frame_selection=None, asset_id=None):
         self.vector_store_type = vector_store_type
-        self.id = str(uuid.uuid4())
         self.video_data = video_file.getvalue()
+        # The same upload gets the same id, which resumes its job
+        self.id = asset_id or video_asset_id(self.video_data, video_file.name, vector_store_type)
         self.audio_data = None
         self.is_complete = False
         self.fps = fps
         self.video_file_name = video_file.name
-        self.blob_key_video = f"raw_files/video/{self.video_file_name}"
-        self.blob_key_video_frame = f"raw_files/frames/{self.video_file_name}"
-        self.blob_key_audio = f"raw_files/audio/{self.video_file_name.split('.')[0]}.mp3"
+        # Blobs are keyed by asset id, a resumed job never picks up another upload of the same file name
+        self.blob_key_video = f"raw_files/video/{self.id}/{self.video_file_name}"
+        self.blob_key_video_frame = f"raw_files/frames/{self.id}"
+        self.blob_key_audio = f"raw_files/audio/{self.id}/{self.video_file_name.split('.')[0]}.mp3"
         self.blob_url_video = None
         self.blob_url_audio = None
         self.blob_url_frames = list()
-        self.video_frames = list()
+        # JPEG bytes of every extracted frame, base64 is only produced for the vision prompt
+        self.video_frames: List[bytes] = list()
+        # Blob / summary id and position (seconds) of every extracted frame
+        self.frame_ids: List[int] = list()
+        self.frame_timestamps: List[float] = list()
+        self.duration = 0
+        # "keyframes" keeps a frame when the scene changes, "interval" one frame every `fps` seconds
+        self.frame_selection = frame_selection or os.getenv("VIDEO_FRAME_SELECTION") or "keyframes"
         self.audio_transcription: str = None
+        # Timestamped transcription segments: {"start", "end", "text"}, seconds from the start of the video
+        self.audio_segments: List[dict] = list()
         self.audio_summary: str = None
         self.video_summary: str = None
-        self.temp_folder = "./temp/"
+        self.video_asset_dict: dict = None
+        # "sequential" chains every frame on the previous one, "windowed" summarizes overlapping segments concurrently
+        self.summary_mode = summary_mode or os.getenv("VIDEO_SUMMARY_MODE") or "sequential"
 
         if vector_store_type == VectorStoreType.CosmosNoSQL:
             print("Initializing CosmosNoSQL as Vector Store")
@@ -60,6 +112,11 @@ class VideoProcessingAgent(object):
 
         self._init_storage_helper()
         self._init_openai_client()
+        self.job = VideoJobManifest(
+            self.id, self.video_file_name,
+            settings={"fps": self.fps, "frame_selection": self.frame_selection, "summary_mode": self.summary_mode,
+                      "blob_keys": "asset_id", "frame_id": "seconds"},
+            storage_helper=self.storage_helper)
 
     def init_search_index_clients(self):
         index_names = get_az_search_indices()
@@ -67,9 +124,15 @@ class VideoProcessingAgent(object):
         if "cc-video-asset-index" not in index_names:
             print("Creating Clip Cognition Video Asset Index")
             create_clip_cognition_indices()
+        else:
+            # Frame indices created before frames carried their timestamp
+            ensure_index_field("cc-video-asset-frames-index", SimpleField(
+                name="timestamp", type=SearchFieldDataType.Double, filterable=True, sortable=True))
 
         self.asset_index_client = get_ai_search_index_client("cc-video-asset-index")
         self.asset_frames_index_client = get_ai_search_index_client("cc-video-asset-frames-index")
+        self.asset_index_writer = get_index_writer("cc-video-asset-index")
+        self.asset_frames_index_writer = get_index_writer("cc-video-asset-frames-index")
         
         # try:
         #     self.asset_index_client = get_ai_search_index_client("cc-video-asset-index")
@@ -151,7 +214,7 @@ class VideoProcessingAgent(object):
         return blob_url
     
     def get_video_frame_sas_url(self, frame_id):
-        return self.storage_helper.generate_blob_sas_token(f"{self.blob_key_video_frame}/{frame_id}.png")
+        return self.storage_helper.generate_blob_sas_token(f"{self.blob_key_video_frame}/{frame_id}.jpg")
     
     def clip_video(self, start_time, end_time):
         clip = VideoFileClip(BytesIO(self.video_data))
@@ -175,7 +238,7 @@ class VideoProcessingAgent(object):
         if self.vector_store_type == VectorStoreType.CosmosNoSQL:
             self.cosmos_util.upsert_items("CC_VideoAssets", video_asset_dict)
         elif self.vector_store_type == VectorStoreType.AISearch:
-            self.asset_index_client.upload_documents([video_asset_dict])
+            self.asset_index_writer.merge_or_upload_documents(video_asset_dict)
         elif self.vector_store_type == VectorStoreType.CosmosMongoVCore:
             self.cosmos_mongo_client.insert("CC_VideoAssets", video_asset_dict)
         else:
@@ -186,76 +249,112 @@ class VideoProcessingAgent(object):
         if self.vector_store_type == VectorStoreType.CosmosNoSQL:
             self.cosmos_util.upsert_items("CC_VideoAssetFrames", video_asset_frame_dict)
         elif self.vector_store_type == VectorStoreType.AISearch:
-            self.asset_frames_index_client.upload_documents([video_asset_frame_dict])
+            self.asset_frames_index_writer.merge_or_upload_documents(video_asset_frame_dict)
         elif self.vector_store_type == VectorStoreType.CosmosMongoVCore:
             self.cosmos_mongo_client.insert("CC_VideoAssetFrames", video_asset_frame_dict)
         else:
             raise ValueError(f"Invalid Vector Store Type: {self.vector_store_type}")
 
-    def process_video(self):
-        # base_video_path, _ = os.path.splitext(video_path)
+    def update_video_asset(self, video_asset_dict):
 
-        # Upload video to blob storage
-        self.blob_url_video = self.upload_blob_from_stream(self.video_data, self.blob_key_video, "video/mp4")
-
-        video_link = self.storage_helper.generate_blob_sas_token(self.blob_key_video)
-        print(f"SAS Token Link: {video_link}")
-
-        # video = cv2.VideoCapture(videoBytesIO(_path)
-        # video_array = np.frombuffer(self.video_data, dtype=np.uint8)
-        video = cv2.VideoCapture(video_link)
-        # video.open(self.video_data)
-        # video = cv2.VideoCapture(BytesIO(self.video_data), apiPreference=cv2.CAP_FFMPEG)
-        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = video.get(cv2.CAP_PROP_FPS)
-        frames_to_skip = int(fps * self.fps)
-        curr_frame=0
-
-        # Loop through the video and extract frames at specified sampling rate
-        while curr_frame < total_frames - 1:
-            video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
-            success, frame = video.read()
-            if not success:
-                break
-            _, buffer = cv2.imencode(".jpg", frame)
-            self.video_frames.append(base64.b64encode(buffer).decode("utf-8"))
-            # base64Frames.append(base64.b64encode(buffer).decode("utf-8"))
-            curr_frame += frames_to_skip
-        video.release()
-        print(f"Extracted {len(self.video_frames)} frames")
-
-        # Extract audio from video
-        clip = VideoFileClip(video_link) 
-        # clip = VideoFileClip(self.video_data)
-        if clip.audio is None:
-            print("No audio found in the video")
+        if self.vector_store_type == VectorStoreType.CosmosMongoVCore:
+            self.cosmos_mongo_client.upsert("CC_VideoAssets", {"id": video_asset_dict["id"]}, video_asset_dict)
         else:
-            print("Current working directory: ", os.getcwd())
+            # Cosmos NoSQL upserts and AI Search merges on the id already
+            self.insert_video_asset(video_asset_dict)
 
-            audio_path = f"{self.temp_folder}/{self.blob_key_audio}"
-            self.create_directory_from_file_path(audio_path)
-            clip.audio.write_audiofile(audio_path, bitrate="32k")
-            # audio_data = clip.audio.to_soundarray()
-            clip.audio.close()
-            clip.close()
+    def flush_index_writers(self):
+        # AI Search writes are buffered, push whatever is pending to the indices
+        if self.vector_store_type == VectorStoreType.AISearch:
+            print(f"Asset index: {self.asset_index_writer.flush()}")
+            print(f"Asset frames index: {self.asset_frames_index_writer.flush()}")
 
-            # Get the absolute path
-            absolute_path = os.path.abspath(audio_path)
-            # Upload audio to blob storage
-            self.blob_url_audio = self.upload_blob_from_file(absolute_path, self.blob_key_audio, "audio/mp3")
+    def process_video(self):
+        # base_video_path, _ = os.path.splitext(video_path)
+
+        # Every stage is checkpointed in the job manifest, a restarted job skips the completed ones
+        stage = self.job.stage("video")
+        if stage is not None:
+            self.blob_url_video = stage["blob_url_video"]
+        else:
+            # Upload video to blob storage
+            self.blob_url_video = self.upload_blob_from_stream(self.video_data, self.blob_key_video, "video/mp4")
+            self.job.complete("video", blob_url_video=self.blob_url_video)
+
+        if self.job.stage("asset") is not None:
+            self._restore_frames(self.job.stage("frames"))
+            self._restore_audio(self.job.stage("audio"))
+            self.video_asset_dict = dict(self.job.stage("asset")["video_asset"])
+            # The vectors are not checkpointed, the asset may still be updated with the video summary
+            self.video_asset_dict.update(
+                audio_summary_vector=vectorize(self.audio_summary) if self.audio_summary else [],
+                video_summary_vector=vectorize(self.video_asset_dict["video_summary"]) if self.video_asset_dict.get("video_summary") else [])
+            print("Video processing restored from the job manifest.")
+            self.is_complete = True
+            return
+
+        # Decode from a local copy of the upload instead of seeking through the blob SAS URL
+        video_path = spool_video(self.video_data, self.video_file_name)
+        try:
+            self._process_local_video(video_path)
+        finally:
+            os.remove(video_path)
+
+    def _restore_frames(self, stage):
+        self.frame_ids = stage["frame_ids"]
+        self.frame_timestamps = stage["frame_timestamps"]
+        self.blob_url_frames = stage["blob_url_frames"]
+        self.duration = stage["duration"]
+        # Frames are downloaded again only for the summaries still missing
+        self.video_frames = [None] * len(self.frame_ids)
+        print(f"Restored {len(self.frame_ids)} uploaded frames")
+        return stage["total_frames"]
+
+    def _restore_audio(self, stage):
+        self.blob_url_audio = stage["blob_url_audio"]
+        self.audio_transcription = stage["audio_transcription"]
+        self.audio_segments = stage.get("audio_segments", [])
+        self.audio_summary = stage["audio_summary"]
+        if self.blob_url_audio is not None:
             self.blob_url_audio_with_sas = self.storage_helper.generate_blob_sas_token(self.blob_key_audio)
-            
-            print(f"Uploaded audio to {self.blob_url_audio}")
-                       
-            # Summarize the audio
-            self.summarize_audio(absolute_path)
 
-            # delete the local audio file
-            # os.remove(absolute_path)
-            # print(f"{absolute_path} has been successfully deleted.")
+    def _frame_data(self, index):
+        if self.video_frames[index] is None:
+            self.video_frames[index] = self.storage_helper.download_blob_bytes(f"{self.blob_key_video_frame}/{self.frame_ids[index]}.jpg")
+        return self.video_frames[index]
 
-        # Upload video frames to blob storage
-        self.upload_video_frames_to_blob(self.video_frames)
+    def _process_local_video(self, video_path):
+        stage = self.job.stage("frames")
+        if stage is not None:
+            total_frames = self._restore_frames(stage)
+        else:
+            selector = KeyframeSelector() if self.frame_selection == "keyframes" else None
+            sampler = FrameSampler(video_path, self.fps, selector=selector)
+            total_frames = sampler.total_frames
+            self.duration = int(total_frames / sampler.fps)
+            for frame_idx, jpeg in sampler.sample():
+                # frame_id is the offset of the frame in whole seconds in both modes, the exact position is
+                # in frame_timestamps; a keyframe in the same second as the previous one is dropped
+                frame_id = int(sampler.timestamp(frame_idx)) if selector is not None else len(self.frame_ids) * self.fps
+                if self.frame_ids and frame_id == self.frame_ids[-1]:
+                    continue
+                self.video_frames.append(jpeg)
+                self.frame_ids.append(frame_id)
+                self.frame_timestamps.append(sampler.timestamp(frame_idx))
+            print(f"Extracted {len(self.video_frames)} frames")
+
+            # Upload video frames to blob storage
+            self.upload_video_frames_to_blob(self.video_frames)
+            self.job.complete("frames", frame_ids=self.frame_ids, frame_timestamps=self.frame_timestamps,
+                              blob_url_frames=self.blob_url_frames, duration=self.duration, total_frames=total_frames)
+
+        stage = self.job.stage("audio")
+        if stage is not None:
+            self._restore_audio(stage)
+        else:
+            self._process_audio(video_path)
+            self.job.complete("audio", blob_url_audio=self.blob_url_audio, audio_transcription=self.audio_transcription,
+                              audio_segments=self.audio_segments, audio_summary=self.audio_summary)
 
         # Add video asset to Cosmos DB
         video_asset = MediaAssetInfo(
@@ -267,7 +366,7 @@ class VideoProcessingAgent(object):
             blob_audio_url=self.blob_url_audio,
             frame_offset=self.fps,
             frame_count=len(self.video_frames),
-            duration=self.fps * len(self.video_frames),
+            duration=self.duration,
             total_frames=total_frames,
             audio_transcription=self.audio_transcription,
             audio_summary=self.audio_summary,
@@ -276,20 +375,45 @@ class VideoProcessingAgent(object):
             video_summary_vector=vectorize(self.video_summary) if (self.video_summary) else []
         )
         video_asset_dict = video_asset.model_dump()
+        self.video_asset_dict = video_asset_dict
 
-        # Insert the video asset into the vector store based on the vector store type
-        self.insert_video_asset(video_asset_dict)
+        # Insert the video asset into the vector store based on the vector store type; an upsert, so a
+        # rerun of the job does not duplicate it
+        self.update_video_asset(video_asset_dict)
+        self.flush_index_writers()
+        self.job.complete("asset", video_asset={key: value for key, value in video_asset_dict.items() if not key.endswith("_vector")})
 
         print(f"Video Asset: {video_asset_dict}")
 
         print("Video processing completed.")
         self.is_complete = True
-    
+
+    def _process_audio(self, video_path):
+        # Demux the audio of the local copy once, the work directory is removed with everything extracted into it
+        with tempfile.TemporaryDirectory(prefix="video-audio-") as work_dir:
+            track = extract_audio(video_path, work_dir)
+            if track is None:
+                print("No audio found in the video")
+                return
+
+            # Upload audio to blob storage
+            self.blob_url_audio = self.upload_blob_from_file(track.mp3_path, self.blob_key_audio, "audio/mp3")
+            self.blob_url_audio_with_sas = self.storage_helper.generate_blob_sas_token(self.blob_key_audio)
+            print(f"Uploaded audio to {self.blob_url_audio}")
+
+            # Summarize the audio
+            self.summarize_audio(track)
+
     def upload_video_frames_to_blob(self, frames):
-        for idx, frame in enumerate(frames):
-            frame_name = f"{self.blob_key_video_frame}/{idx * self.fps}.png"
-            url = self.upload_blob_from_stream(base64.b64decode(frame), frame_name, "image/png")
-            self.blob_url_frames.append(url)
+        # Every frame is a single small Put Blob, FRAME_UPLOAD_CONCURRENCY of them are in flight at a time
+        start_time = time.perf_counter()
+
+        def upload(idx):
+            return self.upload_blob_from_stream(frames[idx], f"{self.blob_key_video_frame}/{self.frame_ids[idx]}.jpg", "image/jpeg")
+
+        with ThreadPoolExecutor(max_workers=_env_int("FRAME_UPLOAD_CONCURRENCY", 8), thread_name_prefix="frame-upload") as executor:
+            self.blob_url_frames.extend(executor.map(upload, range(len(frames))))
+        print(f"Uploaded {len(frames)} frames in {time.perf_counter() - start_time:.1f} s")
     
     def create_directory_from_file_path(self, file_path):
         # Get the directory path from the file path
@@ -302,23 +426,23 @@ class VideoProcessingAgent(object):
         else:
             print(f"Directory '{directory_path}' already exists.")
 
-    def summarize_audio(self, audio_path):
+    def summarize_audio(self, track: AudioTrack):
         print("Summarizing audio...")
         gpt4o_deployment_name = os.environ["AZURE_GPT4_TURBO_DEPLOYMENT_NAME"]
         whisper_deployment_name = os.environ["AZURE_WHISPER_DEPLOYMENT_NAME"]
 
-        # f = urllib.request.urlopen(self.blob_url_audio_with_sas)
-        # audio_file = f.read()
-        # f = requests.get(self.blob_url_audio_with_sas)
-        # Transcribe the audio
-        transcription = self.aoai_client.audio.transcriptions.create(
-            model=whisper_deployment_name,
-            file=open(audio_path, "rb"),
-        )
-        self.audio_transcription = transcription.text
+        # Transcribe the audio, unless a previous run of the job already did
+        stage = self.job.stage("transcription")
+        if stage is not None:
+            self.audio_transcription = stage["text"]
+            self.audio_segments = stage.get("segments", [])
+        else:
+            transcriber = AudioTranscriber(self.aoai_client, whisper_deployment_name)
+            self.audio_transcription, self.audio_segments = transcriber.transcribe(track)
+            self.job.complete("transcription", text=self.audio_transcription, segments=self.audio_segments)
 
         ## OPTIONAL: Uncomment the line below to print the transcription
-        print("Transcript: ", transcription.text + "\n\n")
+        print("Transcript: ", self.audio_transcription + "\n\n")
 
         response = self.aoai_client.chat.completions.create(
             model=gpt4o_deployment_name,
@@ -330,7 +454,7 @@ class VideoProcessingAgent(object):
                 {
                     "role": "user", 
                     "content": [
-                        {"type": "text", "text": f"The audio transcription is: {transcription.text}"}
+                        {"type": "text", "text": f"The audio transcription is: {self.audio_transcription}"}
                     ],
                 }
             ],
@@ -339,57 +463,153 @@ class VideoProcessingAgent(object):
         print(f"Summary: {response.choices[0].message.content}")
         self.audio_summary = response.choices[0].message.content
 
-    def summarize_video(self):
-        PROMPT_TEMPLATE = """
+    def _summarize_frame(self, frame, previous_context):
+        gpt4o_deployment_name = os.environ["AZURE_GPT4_TURBO_DEPLOYMENT_NAME"]
+        response = self.aoai_client.chat.completions.create(
+            model=gpt4o_deployment_name,
+            messages=[
+                {
+                    "role": "system", 
+                    "content": FRAME_PROMPT_TEMPLATE % previous_context
+                },
+                {
+                    "role": "user", 
+                    "content": [
+                        {"type": "image_url", 
+                            "image_url": {"url": f'data:image/jpeg;base64,{base64.b64encode(frame).decode("ascii")}', "detail": "low"}}
+                    ],
+                }
+            ],
+            temperature=0,
+        )
+        return response.choices[0].message.content
+
+    def _frame_summary(self, index, summary, vectorized=True):
+        # Ids derive from the asset, a frame summarized again replaces its document
+        frame_summary = VideoFrameSummary(id=str(uuid.uuid5(uuid.UUID(self.id), str(self.frame_ids[index]))), frame_id=self.frame_ids[index],
+                                          timestamp=self.frame_timestamps[index], asset_name=self.video_file_name, url=self.blob_url_frames[index])
+        frame_summary.summary = summary
+        if vectorized:
+            frame_summary.summary_vector = vectorize(summary)
+        return frame_summary
+
+    def _restored_frame_summary(self, index):
+        """ Summary of a frame completed by a previous run of the job, already stored """
+        record = self.job.frame(index)
+        return self._frame_summary(index, record["summary"], vectorized=False) if record is not None else None
+
+    def _store_frame_summary(self, index, frame_summary):
+        # Insert the video frame asset into the vector store based on the vector store type
+        self.insert_video_frame_asset(frame_summary.model_dump())
+        self.job.complete_frame(index, {"id": frame_summary.id, "summary": frame_summary.summary})
 
-            You an expert in extracting scene by scene details from sequence of frames of the video. 
-            While analyzing the frames, you are required to follow the following steps:
+    def summarize_video(self):
+        if self.summary_mode == "windowed":
+            yield from self.summarize_video_windowed()
+            return
 
-            - Understand the overall context of the frames and Generate a detailed Chapter Analysis of the video based on the frames provided.
-            - Identify the scenes in each frame and build a detailed representation of the scenes.
-            - Considering the context of the previous frames and current frame, create a dense Chapter, Scene and Action summary of the video in markdown format.
-            - Never drop the context of the previous frames while analyzing the current frame.
+        print(f"Summarizing {len(self.video_frames)} frames...")
+        previous_context = ""
+        for index in range(len(self.video_frames)):
+            frame_summary = self._restored_frame_summary(index)
+            if frame_summary is None:
+                print(f"Processing frame {self.frame_ids[index]}")
+                frame_summary = self._frame_summary(index, self._summarize_frame(self._frame_data(index), previous_context))
+                self._store_frame_summary(index, frame_summary)
+            previous_context: str = frame_summary.summary
+            yield frame_summary
 
-            ### Previous Frame Scene Representation
+        self.flush_index_writers()
 
-            %s
+    def _segments(self, segment_frames, overlap):
+        """ (first frame, first frame owned, end) of every segment; the frames before the owned ones only warm up the context """
+        step = max(segment_frames - overlap, 1)
+        segments = list()
+        for owned_start in range(0, len(self.video_frames), step):
+            start = max(owned_start - overlap, 0)
+            segments.append((start, owned_start, min(owned_start + step, len(self.video_frames))))
+        return segments
 
+    def _summarize_segment(self, segment, frames: queue.Queue, stop: threading.Event):
+        start, owned_start, end = segment
+        previous_context = ""
+        try:
+            for index in range(start, end):
+                # Set once the consumer stopped, the frame in flight is the last one summarized
+                if stop.is_set():
+                    break
+                # Frames of a previous run of the job are not summarized again, their summary carries the context on
+                frame_summary = self._restored_frame_summary(index)
+                if frame_summary is not None:
+                    previous_context = frame_summary.summary
+                    if index >= owned_start:
+                        frames.put((index, frame_summary, False))
+                    continue
+                previous_context = self._summarize_frame(self._frame_data(index), previous_context)
+                if index >= owned_start:
+                    frames.put((index, self._frame_summary(index, previous_context), True))
+        finally:
+            frames.put(_SEGMENT_DONE)
+        # The last summary carries the context of the whole segment
+        return previous_context
+
+    def summarize_video_windowed(self, segment_frames=None, overlap=None, concurrency=None):
         """
-        print(f"Summarizing {len(self.video_frames)} frames...")
+        Summarizes overlapping segments of frames concurrently and stitches the segment chapters with a
+        final merge pass into `video_summary`. Frames are still yielded in order, as soon as they and every
+        frame before them are summarized.
+        """
+        segment_frames = segment_frames or _env_int("VIDEO_SUMMARY_SEGMENT_FRAMES", 12)
+        overlap = overlap if overlap is not None else _env_int("VIDEO_SUMMARY_SEGMENT_OVERLAP", 2)
+        concurrency = concurrency or _env_int("VIDEO_SUMMARY_CONCURRENCY", 4)
+        segments = self._segments(segment_frames, overlap)
+        print(f"Summarizing {len(self.video_frames)} frames in {len(segments)} segments, {concurrency} at a time...")
+
+        start_time = time.perf_counter()
+        segment_queues = [queue.Queue() for _ in segments]
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="video-summary")
+        try:
+            futures = [executor.submit(self._summarize_segment, segment, frames, stop) for segment, frames in zip(segments, segment_queues)]
+            chapters = list()
+            for future, frames in zip(futures, segment_queues):
+                while (item := frames.get()) is not _SEGMENT_DONE:
+                    index, frame_summary, summarized = item
+                    if summarized:
+                        print(f"Processing frame {frame_summary.frame_id}")
+                        self._store_frame_summary(index, frame_summary)
+                    yield frame_summary
+                # Raises the error of a failed segment before any later frame is yielded
+                chapters.append(future.result())
+        finally:
+            # Segments not started yet are dropped and running ones stop after their current frame when
+            # the consumer stops early or a segment failed
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        print(f"Summarized {len(segments)} segments in {time.perf_counter() - start_time:.1f} s")
+
+        stage = self.job.stage("video_summary")
+        if stage is not None:
+            self.video_summary = stage["text"]
+        else:
+            self.video_summary = self.merge_chapters(chapters)
+            self.job.complete("video_summary", text=self.video_summary)
+        if self.video_asset_dict is not None:
+            self.video_asset_dict.update(video_summary=self.video_summary, video_summary_vector=vectorize(self.video_summary))
+            self.update_video_asset(self.video_asset_dict)
+        self.flush_index_writers()
+
+    def merge_chapters(self, chapters):
+        if len(chapters) == 1:
+            return chapters[0]
         gpt4o_deployment_name = os.environ["AZURE_GPT4_TURBO_DEPLOYMENT_NAME"]
-
-        previous_context = ""
-        index = 0
-        for frame in self.video_frames:
-            frame_url = self.blob_url_frames[index]
-            frame_summary = VideoFrameSummary(id=str(uuid.uuid4()), frame_id=index * self.fps, asset_name=self.video_file_name, url=frame_url)
-            print(f"Processing frame {frame_summary.frame_id}")
-            response = self.aoai_client.chat.completions.create(
-                model=gpt4o_deployment_name,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": PROMPT_TEMPLATE % previous_context
-                    },
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "image_url", 
-                                "image_url": {"url": f'data:image/jpg;base64,{frame}', "detail": "low"}}
-                        ],
-                    }
-                ],
-                temperature=0,
-            )
-            previous_context: str = response.choices[0].message.content
-            frame_summary.summary = previous_context
-            frame_summary.summary_vector=vectorize(previous_context)
-            frame_summary_dict = frame_summary.model_dump()
-            # print(f"Frame Summary Dict: {frame_summary_dict}")
-            # Insert the video frame asset into the vector store based on the vector store type
-            self.insert_video_frame_asset(frame_summary_dict)
-
-            # print(response.choices[0].message.content)
-            index += 1
-            yield frame_summary
-
+        segments = "\n\n".join(f"### Segment {idx + 1}\n\n{chapter}" for idx, chapter in enumerate(chapters))
+        response = self.aoai_client.chat.completions.create(
+            model=gpt4o_deployment_name,
+            messages=[
+                {"role": "system", "content": MERGE_PROMPT},
+                {"role": "user", "content": segments},
+            ],
+            temperature=0,
+        )
+        return response.choices[0].message.content
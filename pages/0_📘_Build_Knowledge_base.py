@@ -16,6 +16,19 @@ from framework.az_ai_search_helper import *
 # # print(os.environ)
 
 
+def show_ingestion_progress(placeholder, snapshot):
+    with placeholder.container():
+        columns = st.columns(len(snapshot))
+        for column, stage in zip(columns, snapshot):
+            with column:
+                st.metric(
+                    f":blue[{stage['stage'].capitalize()}]",
+                    f"{stage['rate']:.1f} {stage['unit']}/sec",
+                    f"{stage['items']} {stage['unit']}",
+                    delta_color="off"
+                )
+
+
 def main():
 
     st.set_page_config(page_title="Bing Search", page_icon=":books:")
@@ -45,8 +58,10 @@ def main():
                 # Step 1: Create Azure Cognitive Search Index
                 # Step 2: Upload PDFs to Azure Cognitive Search Index
                 create_cogsearch_index(st.session_state.index_name, embeddings)
+                progress = st.empty()
                 upload_docs_to_cogsearch_index(
-                    st.session_state.index_name, pdf_docs)
+                    st.session_state.index_name, pdf_docs,
+                    on_progress=lambda snapshot: show_ingestion_progress(progress, snapshot))
                 st.success("Index created successfully")
         else:
             st.write("Please upload PDF documents")
@@ -6,6 +6,7 @@ import urllib.request
 import dotenv
 import pandas as pd
 from framework.text_loader import * 
+from framework.text_loader import show_query_cache_metrics
 
 @st.cache_resource
 def create_ignite_cosmos_agent():
@@ -23,16 +24,16 @@ def handle_user_input(search_text):
     for item in response:
         col1, col2 = st.columns([5, 3])
         with col1:
-            image_url = st.session_state.ignite_storage_agent.generate_blob_sas_token(item['document']['key'])
+            image_url = st.session_state.ignite_storage_agent.generate_blob_sas_token(item.document['key'])
             print(f"Asset URL: {image_url}")
             # resp = urllib.request.urlopen(image_url)
             # image = np.asarray(bytearray(resp.read()), dtype="uint8")
             st.image(image_url, width=400)  
             # st.markdown(image_url)
         with col2:
-            st.markdown(f">:blue[Similarity Score] \n > \n >**{item['similarityScore']}**")
-            st.markdown(f"> :blue[Name] \n > \n >**{item['document']['name']}**")
-            st.markdown(f">:blue[Id] \n > \n >**{item['document']['_id']}**")
+            st.markdown(f">:blue[Similarity Score] \n > \n >**{item.similarity_score}**")
+            st.markdown(f"> :blue[Name] \n > \n >**{item.document['name']}**")
+            st.markdown(f">:blue[Id] \n > \n >**{item.document['_id']}**")
             
 
         # st.image(image_url, caption=f"{item['product_name']}", use_column_width=True)
@@ -82,9 +83,13 @@ def main():
 
                     st.button("Search")
 
+        query_cache_placeholder = st.empty()
+
     # Handle user input and search the product images based on the text
     if st.session_state.search_text:
         handle_user_input(st.session_state.search_text)
 
+    show_query_cache_metrics(query_cache_placeholder)
+
 if __name__ == "__main__":
     main()
@@ -11,10 +11,10 @@ from langchain.schema import (
     SystemMessage
 )
 
-from langchain_community.callbacks import get_openai_callback
-
 from html_template import css, bot_template, user_template
 
+ALL_INDICES = "All indices"
+
 # env_name = os.environ["APP_ENV"] if "APP_ENV" in os.environ else "local"
 
 # # Load env settings
@@ -25,37 +25,45 @@ from html_template import css, bot_template, user_template
 # # print(os.environ)
 
 
-def handle_user_input(question):
-    with get_openai_callback() as cb:
-        if not st.session_state.has_vectorized_data:
+def show_chat_history(chat_history):
+    for i, message in enumerate(chat_history or []):
+        print(F"Idx: {i}, Message: {message}")
+        if type(message) == HumanMessage:
+            with st.chat_message("user"):
+                st.write(message.content)
+
+        elif type(message) == AIMessage:
+            with st.chat_message("assistant"):
+                st.write(message.content)
+
+        else:
             st.write(
-                "Please upload your documents and hit Process to build vector store.")
-            return
-
-        response = st.session_state.conversation.invoke({"question": question})
-        st.session_state.chat_history = response['chat_history']
-        # st.write(response)
-        # print(f"Chat History Type: {type(st.session_state.chat_history)}")
-        # for i, message in enumerate(reversed(st.session_state.chat_history)):
-        for i, message in enumerate(st.session_state.chat_history):
-            print(F"Idx: {i}, Message: {message}")
-            if type(message) == HumanMessage:
-                # st.write(user_template.replace(
-                #     "{{MSG}}", message.content), unsafe_allow_html=True)
-                with st.chat_message("user"):
-                    st.write(message.content)
-
-            elif type(message) == AIMessage:
-                # st.write(bot_template.replace(
-                #     "{{MSG}}", message.content), unsafe_allow_html=True)
-                with st.chat_message("assistant"):
-                    st.write(message.content)
-
-            else:
-                st.write(
-                    f"Error displaying message of Type[{type(message)}], Content[{message.content}]")
-
-        print(cb)
+                f"Error displaying message of Type[{type(message)}], Content[{message.content}]")
+
+
+def handle_user_input(question):
+    if not st.session_state.has_vectorized_data:
+        st.write(
+            "Please upload your documents and hit Process to build vector store.")
+        return
+
+    show_chat_history(st.session_state.chat_history)
+    with st.chat_message("user"):
+        st.write(question)
+
+    with st.chat_message("assistant"):
+        # Tokens are written as they arrive, the sources are shown as soon as retrieval is done
+        answer = ask_streaming(question, st.session_state.conversation)
+        docs = answer.wait_for_docs()
+        if docs:
+            with st.expander(f"Sources ({len(docs)})"):
+                for doc in docs:
+                    st.caption(f"{doc.metadata.get('source', '')} p.{doc.metadata.get('page', '')}: {doc.page_content[:200]}")
+        st.write_stream(answer)
+
+    st.session_state.chat_history = st.session_state.conversation.chat_history
+    # ttft_ms stays None when the stream produced no token
+    print(f"Answered in {answer.total_ms or answer.ttft_ms or 0:.0f} ms, time to first token {answer.ttft_ms or 0:.0f} ms")
 
 
 def main():
@@ -105,7 +113,7 @@ def main():
         indices = get_az_search_indices()
         selected_index = st.selectbox(
             'Choose Vector Index to use',
-            indices
+            list(indices) + [ALL_INDICES]
         )
         st.write('You selected:', selected_index)
 
@@ -114,12 +122,16 @@ def main():
             st.session_state.selected_index = selected_index
             with st.spinner("Processing"):
 
-                # Step 3: Create embeddings and store in Vector store
-                vector_store = get_az_search_vector_store(selected_index)
+                if selected_index == ALL_INDICES:
+                    # Every index is searched concurrently and the results merged by score
+                    st.session_state.conversation = get_streaming_fanout_conversation_chain(list(indices))
+                else:
+                    # Step 3: Create embeddings and store in Vector store
+                    vector_store = get_az_search_vector_store(selected_index)
 
-                # Step 4: Get conversation chain
-                st.session_state.conversation = get_conversation_chain(
-                    vector_store=vector_store)
+                    # Step 4: Get conversation chain
+                    st.session_state.conversation = get_streaming_conversation_chain(
+                        vector_store=vector_store)
                 st.session_state.has_vectorized_data = True
 
         # add_sidebar = st.sidebar.selectbox(
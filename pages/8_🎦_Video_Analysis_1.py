@@ -1,4 +1,5 @@
 import os
+import base64
 import streamlit as st
 from pathlib import Path
 from PIL import Image
@@ -35,7 +36,10 @@ def show_details():
             st.subheader(f"{len(st.session_state.agent.video_data)}")
             
             st.write(":blue[Duration]")
-            st.subheader(f"{len(st.session_state.agent.video_frames) * st.session_state.agent.fps}")
+            st.subheader(f"{st.session_state.agent.duration}")
+
+            st.write(":blue[Frames]")
+            st.subheader(f"{len(st.session_state.agent.video_frames)}")
             
             st.write(":blue[Frame Offset]")
             st.subheader(f"{st.session_state.agent.fps}")
@@ -56,6 +60,11 @@ def show_audio_details():
         with st.expander(":blue[Transcription]"):
             st.markdown(st.session_state.agent.audio_transcription)
 
+        if st.session_state.agent.audio_segments:
+            with st.expander(":blue[Timestamped Transcription]"):
+                for segment in st.session_state.agent.audio_segments:
+                    st.markdown(f"`{segment['start']:.1f}s - {segment['end']:.1f}s` {segment['text']}")
+
         with st.expander(":green[Summarization]"):
             st.markdown(st.session_state.agent.audio_summary)          
 
@@ -64,7 +73,7 @@ def show_audio_details():
 
 
 def display_raw_frame(frame):
-    img_html = f"<img src='data:image/png;base64,{frame}'>"
+    img_html = f"<img src='data:image/jpeg;base64,{base64.b64encode(frame).decode('ascii')}'>"
     # img_html = f"<img src='data:image/png;base64,{frame}' class='img-fluid'>"
     st.markdown(
         img_html, unsafe_allow_html=True,
@@ -80,7 +89,7 @@ def show_video_details():
             col_left, col_right = st.columns([1,2])
             
             with col_left:
-                st.subheader("Frame")
+                st.subheader(f"Frame at {summary.timestamp:.1f} s")
                 # st.image(summary.raw_data, use_column_width=True)
                 # st.image(BytesIO(base64.b64decode(summary.raw_data)), use_column_width=True)
 
@@ -97,6 +106,10 @@ def show_video_details():
             st.divider()
             # st.rerun()
 
+        if st.session_state.agent.video_summary:
+            with st.expander(":green[Video Summary]", expanded=True):
+                st.markdown(st.session_state.agent.video_summary)
+
 
 def main():
 
@@ -143,7 +156,17 @@ def main():
             accept_multiple_files=False, 
             label_visibility="visible"
         )
+        frame_selection = st.selectbox(
+            "Frame selection",
+            options=["keyframes", "interval"],
+            help="Keyframes keeps a frame only when the scene changes, interval keeps one frame every frame offset seconds"
+        )
         frame_offset = st.slider("Frame offset", 1, 10, 5)
+        summary_mode = st.selectbox(
+            "Summarization",
+            options=["sequential", "windowed"],
+            help="Windowed summarizes overlapping segments of frames concurrently and merges their chapters"
+        )
 
         if video_file != None:
 
@@ -151,7 +174,7 @@ def main():
             # with st.spinner("Processing..."):
 
             # Step 1: Get raw contents from video
-            st.session_state.agent = VideoProcessingAgent(video_file, vector_store_type=st.session_state.vector_store, fps=frame_offset)
+            st.session_state.agent = VideoProcessingAgent(video_file, vector_store_type=st.session_state.vector_store, fps=frame_offset, summary_mode=summary_mode, frame_selection=frame_selection)
             # To read file as bytes:
             video_data = video_file.getvalue()
             video_file_name = video_file.name
@@ -4,6 +4,7 @@ from pathlib import Path
 import dotenv
 import pandas as pd
 from framework.text_loader import *
+from framework.text_loader import show_query_cache_metrics
 from framework.schema import *
 from framework.class_definitions import *
 
@@ -71,10 +72,11 @@ def main():
     with st.sidebar:    
         st.session_state.vector_store = st.selectbox(
             ":blue[Vector Store]",
-            options=[vector_store_type.value for vector_store_type in VectorStoreType]
+            options=[vector_store_type.value for vector_store_type in VectorStoreType] + [ALL_VECTOR_STORES]
         )
         print(f"Selected Vector Store: {st.session_state.vector_store}")
         st.session_state.search_agent = create_ignite_search_agent(vector_store_type=st.session_state.vector_store)
+        query_cache_placeholder = st.empty()
 
     # if st.session_state.search_agent is None:
         # st.session_state.search_agent = VectorSearchAgentFactory.create_vector_search_agent(vector_store_type=st.session_state.vector_store)
@@ -86,15 +88,16 @@ def main():
         print(f"Prompt: {prompt}")
         # query = generate_embeddings(prompt)
         response = perform_vector_search(prompt, limit=1)
+        top_item = response.first()
         # print(response)
         # with open("./results.json", "w") as f:
         #     f.write(json.dumps(response))
         messages.chat_message("user").write(prompt)
-        if len(response) == 0:
+        if top_item is None:
             messages.chat_message("assistant").write("No results found.")
         else:
             with messages.chat_message("assistant"):
-                asset_name = response[0]['asset_name']
+                asset_name = top_item.document['asset_name']
                 asset_info = st.session_state.search_agent.perform_search("CC_VideoAssets", filter={"asset_name": asset_name}, limit=1)
                 print(asset_info)
                 # Get the video url
@@ -113,6 +116,8 @@ def main():
                     df = pd.DataFrame(key_value_pairs)
                     st.table(df)
 
+    show_query_cache_metrics(query_cache_placeholder)
+
 
 if __name__ == "__main__":
     main()